@@ -1,4 +1,5 @@
 import os
+from contextlib import nullcontext
 from typing import Union
 
 from q2_types.feature_data_mag import MAGSequencesDirFmt
@@ -15,6 +16,23 @@ from q2_types.per_sample_sequences import (
 )
 from q2_types.sample_data import SampleData
 
+from q2_amrfinderplus.batch import _can_batch, _run_amrfinderplus_batches
+from q2_amrfinderplus.cache import ResultCache
+from q2_amrfinderplus.dedup import (
+    ContigDeduplication,
+    ProteinDeduplication,
+    _can_deduplicate_contigs,
+    _can_deduplicate_proteins,
+)
+from q2_amrfinderplus.duplicates import (
+    _copy_duplicate_results,
+    _duplicate_report,
+    _find_duplicate_genomes,
+)
+from q2_amrfinderplus.prescreen import KmerPrescreen
+from q2_amrfinderplus.resume import ResumeState
+from q2_amrfinderplus.staging import DatabaseStaging
+from q2_amrfinderplus.telemetry import _write_failure_report, _write_telemetry
 from q2_amrfinderplus.types import (
     AMRFinderPlusAnnotationsDirFmt,
     AMRFinderPlusDatabaseDirFmt,
@@ -24,8 +42,44 @@ from q2_amrfinderplus.utils import (
     _create_sample_dict,
     _create_sample_dirs,
     _get_file_paths,
-    _run_amrfinderplus_analyse,
+    _get_num_partitions,
+    _prefetch_database,
+    _run_amrfinderplus_jobs,
     _validate_inputs,
+    colorify,
+)
+
+# Parameters of _annotate that control how amrfinderplus is run and are not passed
+# on to _run_amrfinderplus_analyse
+RUN_OPTIONS = (
+    "sequences",
+    "proteins",
+    "loci",
+    "cores",
+    "cache_dir",
+    "cache_max_size",
+    "batch_size",
+    "db_staging_dir",
+    "db_staging_max_size",
+    "prefetch_db",
+    "telemetry_path",
+    "prescreen",
+    "prescreen_min_hits",
+    "deduplicate_proteins",
+    "deduplicate_contigs",
+    "deduplicate_genomes",
+    "resume_dir",
+    "failure_report_path",
+)
+
+# Parameters of annotate that are not passed on to _annotate
+PIPELINE_OPTIONS = (
+    "ctx",
+    "sequences",
+    "proteins",
+    "loci",
+    "num_partitions",
+    "partition_mode",
 )
 
 
@@ -44,7 +98,25 @@ def annotate(
     annotation_format="prodigal",
     report_common=False,
     threads=None,
+    cores=None,
+    cache_dir=None,
+    cache_max_size=None,
+    batch_size=None,
+    db_staging_dir=None,
+    db_staging_max_size=None,
+    prefetch_db=False,
+    telemetry_path=None,
+    prescreen=False,
+    prescreen_min_hits=10,
+    deduplicate_proteins=False,
+    deduplicate_contigs=False,
+    deduplicate_genomes=False,
+    resume_dir=None,
+    timeout=None,
+    retries=0,
+    failure_report_path=None,
     num_partitions=None,
+    partition_mode="count",
 ):
     # Validate input and parameter combinations
     _validate_inputs(
@@ -58,11 +130,7 @@ def annotate(
         organism,
     )
 
-    kwargs = {
-        k: v
-        for k, v in locals().items()
-        if k not in ["ctx", "sequences", "proteins", "loci", "num_partitions"]
-    }
+    kwargs = {k: v for k, v in locals().items() if k not in PIPELINE_OPTIONS}
 
     # Get actions
     annotation_action = ctx.get_action("amrfinderplus", "_annotate")
@@ -72,26 +140,38 @@ def annotate(
     collate_genes = ctx.get_action("types", "collate_genes")
     collate_proteins = ctx.get_action("types", "collate_proteins")
 
+    # Derive the number of partitions from the available cores if requested
+    num_partitions = _get_num_partitions(num_partitions, threads, cores)
+
     # Partition the sequences
     if sequences is not None:
         if sequences.type <= SampleData[Contigs]:
-            partition_action = ctx.get_action("types", "partition_contigs")
+            partition_name = "contigs"
         elif sequences.type <= SampleData[MAGs]:
-            partition_action = ctx.get_action("types", "partition_sample_data_mags")
+            partition_name = "sample_data_mags"
         else:
-            partition_action = ctx.get_action("types", "partition_feature_data_mags")
-        (partitioned_seqs,) = partition_action(sequences, num_partitions)
+            partition_name = "feature_data_mags"
+        (partitioned_seqs,) = _partition(
+            ctx, partition_name, sequences, num_partitions, partition_mode
+        )
         partition_keys = partitioned_seqs.keys()
 
+    # When partitioning by size only the sequences, or the proteins if no sequences
+    # are given, are partitioned. Every partition receives the complete proteins and
+    # loci and _annotate looks up the files of its genomes by ID.
+    partitioned_proteins = None
+    partitioned_loci = None
+
     # Partition the proteins
-    if proteins is not None:
-        partition_proteins = ctx.get_action("types", "partition_proteins")
-        (partitioned_proteins,) = partition_proteins(proteins, num_partitions)
+    if proteins is not None and (partition_mode == "count" or sequences is None):
+        (partitioned_proteins,) = _partition(
+            ctx, "proteins", proteins, num_partitions, partition_mode
+        )
         if sequences is None:
             partition_keys = partitioned_proteins.keys()
 
     # Partition the loci
-    if loci is not None:
+    if loci is not None and partition_mode == "count":
         partition_loci = ctx.get_action("types", "partition_loci")
         (partitioned_loci,) = partition_loci(loci, num_partitions)
 
@@ -107,9 +187,13 @@ def annotate(
                 partitioned_seqs.collection[i] if sequences is not None else None
             ),
             proteins=(
-                partitioned_proteins.collection[i] if proteins is not None else None
+                partitioned_proteins.collection[i]
+                if partitioned_proteins is not None
+                else proteins
+            ),
+            loci=(
+                partitioned_loci.collection[i] if partitioned_loci is not None else loci
             ),
-            loci=partitioned_loci.collection[i] if loci is not None else None,
             **kwargs,
         )
 
@@ -139,6 +223,16 @@ def annotate(
     )
 
 
+def _partition(ctx, name, data, num_partitions, partition_mode):
+    # Partition by number of genomes with q2-types or by input size
+    if partition_mode == "count":
+        partition_action = ctx.get_action("types", f"partition_{name}")
+        return partition_action(data, num_partitions)
+
+    partition_action = ctx.get_action("amrfinderplus", f"_partition_{name}_by_size")
+    return partition_action(data, num_partitions, partition_mode)
+
+
 def _annotate(
     amrfinderplus_db: AMRFinderPlusDatabaseDirFmt,
     sequences: Union[
@@ -155,6 +249,23 @@ def _annotate(
     annotation_format: str = "prodigal",
     report_common: bool = False,
     threads: int = None,
+    cores: int = None,
+    cache_dir: str = None,
+    cache_max_size: int = None,
+    batch_size: int = None,
+    db_staging_dir: str = None,
+    db_staging_max_size: int = None,
+    prefetch_db: bool = False,
+    telemetry_path: str = None,
+    prescreen: bool = False,
+    prescreen_min_hits: int = 10,
+    deduplicate_proteins: bool = False,
+    deduplicate_contigs: bool = False,
+    deduplicate_genomes: bool = False,
+    resume_dir: str = None,
+    timeout: int = None,
+    retries: int = 0,
+    failure_report_path: str = None,
 ) -> (
     AMRFinderPlusAnnotationsDirFmt,
     AMRFinderPlusAnnotationsDirFmt,
@@ -162,9 +273,7 @@ def _annotate(
     ProteinsDirectoryFormat,
 ):
     # Set up common parameters for _run_amrfinderplus_analyse
-    common_params = {
-        k: v for k, v in locals().items() if k not in ("sequences", "proteins", "loci")
-    }
+    common_params = {k: v for k, v in locals().items() if k not in RUN_OPTIONS}
 
     # Innit output formats
     amr_annotations = AMRFinderPlusAnnotationsDirFmt()
@@ -174,6 +283,8 @@ def _annotate(
 
     # Create sample_dict to iterate over input files
     sample_dict = _create_sample_dict(proteins, sequences)
+    jobs = []
+    genome_ids = []
 
     # Iterate over sample_dict
     for sample_id, files_dict in sample_dict.items():
@@ -215,18 +326,241 @@ def _annotate(
                 str(amr_all_mutations), sample_id, f"{_id}_amr_all_mutations.tsv"
             )
 
-            # Run amrfinderplus
-            _run_amrfinderplus_analyse(
-                dna_path=dna_path,
-                protein_path=protein_path,
-                gff_path=gff_path,
-                amr_annotations_path=amr_annotations_path,
-                amr_genes_path=amr_genes_path,
-                amr_proteins_path=amr_proteins_path,
-                amr_all_mutations_path=amr_all_mutations_path,
-                **common_params,
+            jobs.append(
+                {
+                    "dna_path": dna_path,
+                    "protein_path": protein_path,
+                    "gff_path": gff_path,
+                    "amr_annotations_path": amr_annotations_path,
+                    "amr_genes_path": amr_genes_path,
+                    "amr_proteins_path": amr_proteins_path,
+                    "amr_all_mutations_path": amr_all_mutations_path,
+                    **common_params,
+                }
+            )
+            genome_ids.append((sample_id, _id))
+
+    # Set up the result cache if a cache directory is given
+    cache = None
+    if cache_dir:
+        cache = ResultCache(
+            cache_dir=cache_dir,
+            amrfinderplus_db=amrfinderplus_db,
+            params=common_params,
+            max_size=cache_max_size * 1024**2 if cache_max_size else None,
+        )
+
+    # Write outputs to the working directory and skip genomes that were completed
+    # by a previous run if a working directory is given
+    resume = None
+    output_jobs = jobs
+    completed = [False] * len(jobs)
+    if resume_dir:
+        resume = ResumeState(resume_dir, amrfinderplus_db, common_params, cache=cache)
+        jobs = [
+            resume.redirect(job, sample_id, _id)
+            for job, (sample_id, _id) in zip(jobs, genome_ids)
+        ]
+        completed = [resume.is_complete(job) for job in jobs]
+        print(resume.summary())
+
+    # Stage the database on node-local storage if a staging directory is given
+    staged_db = nullcontext(amrfinderplus_db)
+    if db_staging_dir:
+        staging = DatabaseStaging(
+            db_staging_dir,
+            max_size=db_staging_max_size * 1024**2 if db_staging_max_size else None,
+        )
+        staged_db = staging.stage(amrfinderplus_db)
+
+    with staged_db as database:
+        for job in jobs:
+            job["amrfinderplus_db"] = database
+
+        # Read the database into the page cache before the first genome is annotated
+        if prefetch_db:
+            num_files, size, duration = _prefetch_database(database)
+            print(
+                f"Prefetched {num_files} database files ({size / 1024**2:.1f} MB) "
+                f"into the page cache in {duration:.1f} s."
             )
 
+        # Genomes with identical input files are only annotated once
+        duplicates = [None] * len(jobs)
+        if deduplicate_genomes:
+            duplicates = _find_duplicate_genomes(jobs, threads=cores)
+            duplicates = [
+                None if complete else duplicate
+                for complete, duplicate in zip(completed, duplicates)
+            ]
+            print(_duplicate_report(genome_ids, duplicates))
+        unique = [
+            i
+            for i, duplicate in enumerate(duplicates)
+            if duplicate is None and not completed[i]
+        ]
+
+        # Skip genomes that share too few k-mers with the database
+        skipped = [False] * len(jobs)
+        if prescreen and organism:
+            print(
+                colorify(
+                    "The prescreen is not used if an organism is given, because "
+                    "point mutations are reported for all genomes."
+                )
+            )
+        elif prescreen:
+            # Genomes are screened on the cores of the budget or of one
+            # AMRFinderPlus run, which uses 4 threads if none are specified
+            kmer_prescreen = KmerPrescreen(
+                database,
+                min_hits=prescreen_min_hits,
+                max_workers=cores or threads or 4,
+            )
+            for i, skip in zip(
+                unique, kmer_prescreen.screen([jobs[i] for i in unique])
+            ):
+                skipped[i] = skip
+            print(kmer_prescreen.summary())
+        run_jobs = [jobs[i] for i in unique if not skipped[i]]
+
+        # Identical proteins or contigs of different genomes are only annotated
+        # once if requested and supported for the inputs
+        deduplication = None
+        if deduplicate_proteins and _can_deduplicate_proteins(
+            sequences, proteins, organism
+        ):
+            deduplication = ProteinDeduplication(run_jobs)
+        elif deduplicate_contigs and _can_deduplicate_contigs(
+            sequences, proteins, organism
+        ):
+            deduplication = ContigDeduplication(run_jobs)
+        elif deduplicate_proteins or deduplicate_contigs:
+            print(
+                colorify(
+                    "Deduplication is only supported for either protein or "
+                    "nucleotide sequences without organism. Genomes are annotated "
+                    "separately."
+                )
+            )
+
+        marked = []
+
+        # Failed genomes are recorded instead of stopping the run if a failure
+        # report is requested
+        failures = [] if failure_report_path else None
+
+        # Run amrfinderplus for all genomes, concurrently if a core budget is given
+        # and in batches of multiple genomes if a batch size is given. With
+        # deduplication, all unique sequences are annotated in one run.
+        if deduplication is not None and run_jobs:
+            usages = deduplication.run(
+                threads=threads, cores=cores, cache=cache, failures=failures
+            )
+            print(deduplication.summary())
+        elif batch_size and batch_size > 1 and _can_batch(loci, annotation_format):
+            usages = _run_amrfinderplus_batches(
+                run_jobs,
+                batch_size,
+                threads=threads,
+                cores=cores,
+                cache=cache,
+                failures=failures,
+            )
+        else:
+            if batch_size and batch_size > 1:
+                print(
+                    colorify(
+                        "Batching is only supported for the 'prodigal' annotation "
+                        "format. Genomes are annotated one at a time."
+                    )
+                )
+            # Genomes are marked as completed as soon as they are finished
+            marked = run_jobs
+            usages = _run_amrfinderplus_jobs(
+                run_jobs,
+                threads=threads,
+                cores=cores,
+                cache=cache if resume is None else resume,
+                failures=failures,
+            )
+
+    # Map failures to the genomes, including the duplicates of failed genomes
+    run_indices = [i for i in unique if not skipped[i]]
+    failed = {run_indices[index]: error for index, error in failures or []}
+    failed.update(
+        {
+            i: failed[duplicate]
+            for i, duplicate in enumerate(duplicates)
+            if duplicate in failed
+        }
+    )
+
+    # Duplicates get the results of the identical genome
+    if deduplicate_genomes:
+        _copy_duplicate_results(jobs, duplicates)
+
+    # Mark the remaining genomes as completed and add all outputs from the working
+    # directory to the output artifacts. Genomes skipped by the prescreen are not
+    # marked, because their empty outputs depend on the prescreen settings.
+    if resume is not None:
+        marked = set(map(id, marked))
+        for i, (job, output_job, complete) in enumerate(
+            zip(jobs, output_jobs, completed)
+        ):
+            prescreened = skipped[i] or (
+                duplicates[i] is not None and skipped[duplicates[i]]
+            )
+            if (
+                not complete
+                and id(job) not in marked
+                and i not in failed
+                and not prescreened
+            ):
+                resume.mark_complete(job)
+            resume.publish(job, output_job)
+
+    # Record the resource usage of every genome for capacity planning
+    if telemetry_path:
+        run_usages = iter(usages)
+        usages = [
+            (
+                {"resumed": True}
+                if complete
+                else (
+                    {"duplicate": True}
+                    if duplicate is not None
+                    else {"skipped": True} if skip else next(run_usages)
+                )
+            )
+            for complete, skip, duplicate in zip(completed, skipped, duplicates)
+        ]
+        _write_telemetry(telemetry_path, genome_ids, jobs, usages)
+
+    # List failed genomes, which are missing from the outputs
+    if failure_report_path:
+        _write_failure_report(
+            failure_report_path,
+            [genome_ids[i] for i in sorted(failed)],
+            [failed[i] for i in sorted(failed)],
+        )
+        if failed:
+            print(
+                colorify(
+                    f"{len(failed)} of {len(jobs)} genomes failed and were left out "
+                    f"of the outputs. They are listed in {failure_report_path}."
+                )
+            )
+        if jobs and len(failed) == len(jobs):
+            raise Exception(
+                f"AMRFinderPlus failed for all genomes. Please inspect "
+                f"{failure_report_path}, stdout and stderr to learn more."
+            )
+
+    if cache is not None:
+        cache.evict()
+        print(cache.summary())
+
     # Create empty files for empty output artifacts if needed
     _create_empty_files(
         sequences, proteins, organism, amr_genes, amr_proteins, amr_all_mutations
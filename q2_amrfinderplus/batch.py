@@ -0,0 +1,205 @@
+import os
+import re
+import tempfile
+
+from q2_amrfinderplus.utils import (
+    OUTPUT_FILES,
+    _is_output_expected,
+    _run_amrfinderplus_jobs,
+)
+
+# Prefix added to all contig and protein IDs of a genome in a batch. The genome
+# index in the batch is used to assign the output lines back to the genomes.
+BATCH_ID_PREFIX = "q2amr{}_"
+BATCH_ID_REGEX = re.compile(r"(?<![^\s>:|])q2amr(\d+)_")
+
+# Columns of the annotation and all mutations outputs that hold input IDs
+ID_COLUMNS = ("Protein id", "Protein identifier", "Contig id")
+
+
+def _can_batch(loci, annotation_format):
+    # Protein and GFF IDs can only be prefixed consistently for the prodigal
+    # format, where protein IDs are derived from the contig IDs
+    return loci is None or annotation_format == "prodigal"
+
+
+def _run_amrfinderplus_batches(
+    jobs, batch_size, threads, cores=None, cache=None, failures=None
+):
+    """
+    Runs AMRFinderPlus once per batch of genomes instead of once per genome.
+    The inputs of all genomes in a batch are merged into one file with genome
+    specific ID prefixes and the outputs are split back into the output paths of
+    the individual jobs. Returns the resource usage of every job, which is the
+    usage of the whole batch with the index of the batch added. If a failures
+    list is given, all genomes of a failed batch are appended to it.
+    """
+    batches = [jobs[i : i + batch_size] for i in range(0, len(jobs), batch_size)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        batch_jobs = []
+        for i, batch in enumerate(batches):
+            batch_dir = os.path.join(tmp, f"batch{i}")
+            os.mkdir(batch_dir)
+            batch_jobs.append(_merge_batch(batch, batch_dir))
+
+        batch_failures = None if failures is None else []
+        batch_usages = _run_amrfinderplus_jobs(
+            batch_jobs,
+            threads=threads,
+            cores=cores,
+            cache=cache,
+            failures=batch_failures,
+        )
+        failed_batches = dict(batch_failures or [])
+
+        usages = []
+        for i, (batch, batch_job, usage) in enumerate(
+            zip(batches, batch_jobs, batch_usages)
+        ):
+            if i in failed_batches:
+                failures.extend(
+                    (i * batch_size + j, failed_batches[i]) for j in range(len(batch))
+                )
+            else:
+                _split_batch(batch, batch_job)
+            usages.extend(
+                [None if usage is None else {**usage, "batch": i}] * len(batch)
+            )
+
+    return usages
+
+
+def _merge_batch(batch, batch_dir):
+    # Create a job that uses merged inputs and writes to the batch directory
+    batch_job = {
+        **batch[0],
+        **{
+            path_arg: os.path.join(batch_dir, file_name)
+            for path_arg, file_name in OUTPUT_FILES.items()
+        },
+    }
+
+    for input_type, file_name in (
+        ("dna_path", "sequences.fasta"),
+        ("protein_path", "proteins.fasta"),
+        ("gff_path", "loci.gff"),
+    ):
+        if not batch[0][input_type]:
+            continue
+
+        batch_job[input_type] = os.path.join(batch_dir, file_name)
+        with open(batch_job[input_type], "w") as merged:
+            for index, job in enumerate(batch):
+                prefix = BATCH_ID_PREFIX.format(index)
+                if input_type == "gff_path":
+                    _write_prefixed_gff(job[input_type], merged, prefix)
+                else:
+                    _write_prefixed_fasta(job[input_type], merged, prefix)
+
+    return batch_job
+
+
+def _write_prefixed_fasta(file_fp, out, prefix):
+    with open(file_fp) as f:
+        for line in f:
+            if line.startswith(">"):
+                line = f">{prefix}{line[1:]}"
+            out.write(line if line.endswith("\n") else line + "\n")
+
+
+def _write_prefixed_gff(file_fp, out, prefix):
+    with open(file_fp) as f:
+        in_fasta = False
+        for line in f:
+            line = line if line.endswith("\n") else line + "\n"
+
+            if in_fasta:
+                if line.startswith(">"):
+                    line = f">{prefix}{line[1:]}"
+            elif line.startswith("##FASTA"):
+                in_fasta = True
+            elif line.startswith("##gff-version"):
+                # Only keep the version directive of the first genome
+                if out.tell() > 0:
+                    continue
+            elif line.startswith("##sequence-region"):
+                directive, seqid, rest = line.split(" ", 2)
+                line = f"{directive} {prefix}{seqid} {rest}"
+            elif len(line.split("\t")) == 9 and not line.startswith("#"):
+                fields = line.split("\t")
+                seqid = fields[0]
+                fields[0] = prefix + seqid
+
+                # Prodigal IDs can contain the contig ID
+                fields[8] = fields[8].replace(f"ID={seqid}_", f"ID={prefix}{seqid}_")
+                line = "\t".join(fields)
+
+            out.write(line)
+
+
+def _split_batch(batch, batch_job):
+    for path_arg, file_name in OUTPUT_FILES.items():
+        # All genomes of a batch have the same input types
+        if not _is_output_expected(batch_job, path_arg):
+            continue
+
+        output_paths = [job[path_arg] for job in batch]
+        if file_name.endswith(".tsv"):
+            _split_tsv(batch_job[path_arg], output_paths)
+        else:
+            _split_fasta(batch_job[path_arg], output_paths)
+
+
+def _split_tsv(batch_fp, output_paths):
+    with open(batch_fp) as f:
+        header = f.readline()
+        lines = f.readlines()
+
+    columns = header.rstrip("\n").split("\t")
+    id_indices = [i for i, column in enumerate(columns) if column in ID_COLUMNS]
+
+    # Every genome gets the header, also if it has no hits
+    genome_lines = [[header] for _ in output_paths]
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        index = None
+        for i in id_indices:
+            match = BATCH_ID_REGEX.match(fields[i])
+            if match:
+                index = int(match.group(1))
+                fields[i] = BATCH_ID_REGEX.sub("", fields[i])
+        if index is None:
+            raise ValueError(
+                f"Output line of a batched AMRFinderPlus run could not be assigned to "
+                f"a genome:\n{line}"
+            )
+        genome_lines[index].append("\t".join(fields) + "\n")
+
+    _write_genome_files(output_paths, genome_lines)
+
+
+def _split_fasta(batch_fp, output_paths):
+    # Every genome gets a file, also if it has no hits
+    genome_lines = [[] for _ in output_paths]
+    if os.path.exists(batch_fp):
+        with open(batch_fp) as f:
+            for line in f:
+                if line.startswith(">"):
+                    match = BATCH_ID_REGEX.search(line)
+                    if match is None:
+                        raise ValueError(
+                            "Sequence of a batched AMRFinderPlus run could not be "
+                            f"assigned to a genome:\n{line}"
+                        )
+                    out_lines = genome_lines[int(match.group(1))]
+                    line = BATCH_ID_REGEX.sub("", line)
+                out_lines.append(line)
+
+    _write_genome_files(output_paths, genome_lines)
+
+
+def _write_genome_files(output_paths, genome_lines):
+    for output_path, out_lines in zip(output_paths, genome_lines):
+        with open(output_path, "w") as f:
+            f.writelines(out_lines)
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from q2_amrfinderplus.utils import OUTPUT_FILES, _job_outputs, _link_or_copy
+
+# Analysis parameters that change the AMRFinderPlus output. "threads" is excluded
+# because it only affects the runtime.
+CACHE_KEY_PARAMETERS = (
+    "organism",
+    "plus",
+    "ident_min",
+    "curated_ident",
+    "coverage_min",
+    "translation_table",
+    "annotation_format",
+    "report_common",
+)
+
+# Database files that identify the database release
+DATABASE_VERSION_FILES = ("version.txt", "database_format_version.txt")
+
+
+class ResultCache:
+    """
+    On-disk cache of AMRFinderPlus outputs. Entries are keyed by a hash of the
+    input file contents, the database version and all analysis parameters. The
+    total size of the cache is bounded by evicting the least recently used
+    entries.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory where cache entries are stored. Created if it does not exist.
+    amrfinderplus_db : AMRFinderPlusDatabaseDirFmt
+        Database used for the analysis.
+    params : dict
+        Analysis parameters of _run_amrfinderplus_analyse.
+    max_size : int
+        Maximum size of the cache in bytes. Unbounded if None.
+    """
+
+    def __init__(self, cache_dir, amrfinderplus_db, params, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Hash database version and parameters once, input files are added per job
+        self._base_hash = _base_hash(amrfinderplus_db, params)
+
+    def key(self, job):
+        return _job_key(self._base_hash, job)
+
+    def fetch(self, job):
+        """
+        Link or copy the cached outputs of a job to its output paths. Returns
+        True on a cache hit and False on a miss.
+        """
+        entry_dir = self._entry_dir(self.key(job))
+        outputs = _job_outputs(job)
+
+        if not all(
+            os.path.exists(os.path.join(entry_dir, OUTPUT_FILES[path_arg]))
+            for path_arg in outputs
+        ):
+            self._count(hit=False)
+            return False
+
+        for path_arg in outputs:
+            _link_or_copy(
+                os.path.join(entry_dir, OUTPUT_FILES[path_arg]), job[path_arg]
+            )
+
+        # Mark entry as recently used
+        os.utime(entry_dir)
+        self._count(hit=True)
+        return True
+
+    def store(self, job):
+        entry_dir = self._entry_dir(self.key(job))
+        outputs = _job_outputs(job)
+
+        # Entries without all expected outputs would never be fetched
+        if os.path.exists(entry_dir) or not all(
+            os.path.exists(job[path_arg]) for path_arg in outputs
+        ):
+            return
+
+        # Fill a temporary directory and publish it atomically, so that concurrent
+        # readers never see incomplete entries
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir), prefix=".tmp-")
+        for path_arg in outputs:
+            _link_or_copy(job[path_arg], os.path.join(tmp_dir, OUTPUT_FILES[path_arg]))
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another process published the same entry in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_size."""
+        if self.max_size is None:
+            return
+
+        entries = []
+        for prefix in os.scandir(self.cache_dir):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.is_dir() and not entry.name.startswith("."):
+                    entries.append(
+                        (entry.stat().st_mtime, _dir_size(entry.path), entry.path)
+                    )
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
+
+    def summary(self):
+        return f"Result cache: {self.hits} hits, {self.misses} misses."
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+def _base_hash(amrfinderplus_db, params):
+    # Hash of the database version and of all parameters that change the output
+    base_hash = hashlib.sha256()
+    for file_name in DATABASE_VERSION_FILES:
+        file_path = os.path.join(str(amrfinderplus_db), file_name)
+        if os.path.exists(file_path):
+            with open(file_path, "rb") as f:
+                base_hash.update(f.read())
+        base_hash.update(b"\0")
+    for param in CACHE_KEY_PARAMETERS:
+        base_hash.update(f"{param}={params.get(param)!r}\0".encode())
+    return base_hash
+
+
+def _job_key(base_hash, job):
+    # Adds the contents of the input files of a job to the base hash
+    key_hash = base_hash.copy()
+    for input_type in ("dna_path", "protein_path", "gff_path"):
+        key_hash.update(f"{input_type}\0".encode())
+        if job.get(input_type):
+            _update_hash_from_file(key_hash, job[input_type])
+        key_hash.update(b"\0")
+    return key_hash.hexdigest()
+
+
+def _update_hash_from_file(file_hash, file_path, chunk_size=1024 * 1024):
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(chunk)
+
+
+def _dir_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
@@ -0,0 +1,53 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from q2_amrfinderplus.types import AMRFinderPlusAnnotationsDirFmt
+from q2_amrfinderplus.utils import _link_or_copy
+
+
+def collate_amrfinderplus_annotations(
+    annotations: AMRFinderPlusAnnotationsDirFmt,
+) -> AMRFinderPlusAnnotationsDirFmt:
+    collated = AMRFinderPlusAnnotationsDirFmt()
+
+    # Map the relative paths of all files to their source. Only directory entries
+    # are read, so that colliding IDs are found before any file is written.
+    files = {}
+    collisions = []
+    for partition in annotations:
+        for rel_path, src in _list_files(str(partition)):
+            if rel_path in files:
+                collisions.append(rel_path)
+            files[rel_path] = src
+
+    if collisions:
+        raise ValueError(
+            "The following files are contained in more than one of the annotations "
+            "to be collated. Make sure that sample and genome IDs are unique across "
+            f"all partitions:\n{', '.join(sorted(collisions))}"
+        )
+
+    for rel_dir in {os.path.dirname(rel_path) for rel_path in files} - {""}:
+        os.makedirs(os.path.join(str(collated), rel_dir), exist_ok=True)
+
+    # Files are hardlinked or reflinked within the same filesystem, so that only
+    # files on other filesystems are copied, in parallel
+    with ThreadPoolExecutor() as executor:
+        list(
+            executor.map(
+                lambda item: _link_or_copy(
+                    item[1], os.path.join(str(collated), item[0])
+                ),
+                files.items(),
+            )
+        )
+
+    return collated
+
+
+def _list_files(dir_path):
+    # Yields the path relative to dir_path and the absolute path of every file
+    for root, _, file_names in os.walk(dir_path):
+        for file_name in file_names:
+            file_fp = os.path.join(root, file_name)
+            yield os.path.relpath(file_fp, dir_path), file_fp
@@ -1,14 +1,23 @@
 import os
 import re
 import subprocess
-
-from qiime2.util import duplicate
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from q2_amrfinderplus.types import AMRFinderPlusDatabaseDirFmt
-from q2_amrfinderplus.utils import run_command
+from q2_amrfinderplus.types._format import (
+    DATABASE_CHECKSUMS,
+    _compute_checksums,
+    _mark_database_verified,
+    _read_checksums,
+)
+from q2_amrfinderplus.utils import _link_or_copy, run_command
 
 
-def fetch_amrfinderplus_db() -> AMRFinderPlusDatabaseDirFmt:
+def fetch_amrfinderplus_db(
+    previous_db: AMRFinderPlusDatabaseDirFmt = None,
+) -> AMRFinderPlusDatabaseDirFmt:
     amrfinderplus_db = AMRFinderPlusDatabaseDirFmt()
 
     # Run "amrfinder -u" command that downloads the database
@@ -21,18 +30,128 @@ def fetch_amrfinderplus_db() -> AMRFinderPlusDatabaseDirFmt:
     )
 
     # Copy all files from amrfinder_db_path to database directory format
-    _copy_all(amrfinder_db_path, amrfinderplus_db.path)
+    _copy_all(
+        amrfinder_db_path,
+        amrfinderplus_db.path,
+        str(previous_db) if previous_db is not None else None,
+    )
 
     return amrfinderplus_db
 
 
-def _copy_all(src_dir, des_dir):
+def import_amrfinderplus_db(
+    source: str,
+    previous_db: AMRFinderPlusDatabaseDirFmt = None,
+) -> AMRFinderPlusDatabaseDirFmt:
+    amrfinderplus_db = AMRFinderPlusDatabaseDirFmt()
+
+    if not os.path.exists(source):
+        raise ValueError(f"The database source {source} does not exist.")
+
+    previous_dir = str(previous_db) if previous_db is not None else None
+    if os.path.isdir(source):
+        _copy_all(_find_database_dir(source), amrfinderplus_db.path, previous_dir)
+
+    else:
+        # Extract the tarball to a temporary directory and move the files from there
+        with tempfile.TemporaryDirectory() as tmp:
+            _extract_tarball(source, tmp)
+            _copy_all(_find_database_dir(tmp), amrfinderplus_db.path, previous_dir)
+
+    # Check the directory layout and the first records of the FASTA files. The file
+    # contents are covered by the checksums computed while copying.
+    amrfinderplus_db.validate(level="min")
+    _mark_database_verified(str(amrfinderplus_db))
+
+    return amrfinderplus_db
+
+
+def _extract_tarball(tarball, des_dir):
+    if not tarfile.is_tarfile(tarball):
+        raise ValueError(
+            f"The database source {tarball} is neither a directory nor a tarball."
+        )
+
+    with tarfile.open(tarball) as tar:
+        # The data filter rejects absolute paths, links outside des_dir and
+        # special files
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(des_dir, filter="data")
+        else:
+            tar.extractall(des_dir)
+
+
+def _find_database_dir(dir_path):
+    # The database files can be in a subdirectory, e.g. a dated directory of the
+    # AMRFinderPlus data directory. That directory holds several releases and a
+    # link "latest" to the newest one.
+    candidates = []
+    for root, dir_names, file_names in os.walk(dir_path):
+        latest = os.path.join(root, "latest")
+        if "latest" in dir_names and _is_database_dir(latest):
+            return latest
+        if _is_database_dir(root, file_names):
+            candidates.append(root)
+
+    if not candidates:
+        raise ValueError(
+            f"No AMRFinderPlus database was found in {dir_path}. The database "
+            "directory must contain the files version.txt and AMRProt.fa."
+        )
+
+    # Without a link, the release with the newest version is used
+    return max(candidates, key=lambda path: (_read_version(path), path))
+
+
+def _is_database_dir(path, file_names=None):
+    if file_names is None:
+        file_names = os.listdir(path)
+    return "version.txt" in file_names and "AMRProt.fa" in file_names
+
+
+def _read_version(path):
+    # Versions look like "2024-01-31.1" and are compared number by number
+    with open(os.path.join(path, "version.txt")) as f:
+        return tuple(int(number) for number in re.findall(r"\d+", f.read()))
+
+
+def _copy_all(src_dir, des_dir, previous_dir=None):
+    """
+    Links or copies the runtime database files from src_dir to des_dir and writes
+    the checksum manifest. Files with the same checksum as in the database in
+    previous_dir are taken from there instead of the source directory.
+    """
     regex = re.compile(r"^(?:changes\.txt|README.*|.*\.log)$")
-    # Loop over all files in the source directory
-    for file in os.listdir(src_dir):
-        # Copy runtime database files, skipping release notes and logs.
-        if not regex.match(file):
-            duplicate(os.path.join(src_dir, file), os.path.join(des_dir, file))
+    # Skip release notes and logs
+    file_names = sorted(file for file in os.listdir(src_dir) if not regex.match(file))
+    checksums = _compute_checksums(src_dir, file_names)
+    previous_checksums = _read_checksums(previous_dir) if previous_dir else {}
+
+    def materialize(file_name):
+        if previous_checksums.get(file_name) == checksums[file_name]:
+            src = os.path.join(previous_dir, file_name)
+        else:
+            src = os.path.join(src_dir, file_name)
+        _link_or_copy(src, os.path.join(des_dir, file_name))
+
+    # Files are copied in parallel if they can not be linked
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(materialize, file_names))
+
+    # Write checksum manifest that replaces the parsing of all FASTA files when
+    # the database is validated
+    _write_checksums(str(des_dir), checksums)
+
+
+def _write_checksums(db_path, checksums=None):
+    file_names = sorted(
+        file for file in os.listdir(db_path) if file != DATABASE_CHECKSUMS
+    )
+    if checksums is None:
+        checksums = _compute_checksums(db_path, file_names)
+    with open(os.path.join(db_path, DATABASE_CHECKSUMS), "w") as f:
+        for file_name in file_names:
+            f.write(f"{file_name}\t{checksums[file_name]}\n")
 
 
 def run_amrfinder_fetch():
@@ -0,0 +1,305 @@
+import hashlib
+import os
+import re
+import tempfile
+from contextlib import ExitStack
+
+from q2_amrfinderplus.utils import _get_num_jobs, _run_amrfinderplus_jobs
+
+# ID of every unique sequence in the deduplicated input
+DEDUP_ID = "q2amrseq{}"
+DEDUP_ID_REGEX = re.compile(r"(?<![^\s>:|])q2amrseq(\d+)(?![^\s:|])")
+
+
+class _Deduplication:
+    """
+    Annotates the sequences of many genomes with AMRFinderPlus runs on the set
+    of unique sequences. Sequences are identified by a hash of their sequence.
+    The unique sequences are split into size-balanced chunks, one per concurrent
+    AMRFinderPlus process of the core budget. The hits of every unique sequence
+    are written to the outputs of all genomes that contain it, with the sequence
+    IDs of the genome.
+
+    Parameters
+    ----------
+    jobs : list of dict
+        Jobs of genomes with the same input types and without organism.
+    """
+
+    # Input of the jobs that is deduplicated and the name of its sequences
+    input_path = None
+    unit = None
+    # FASTA output with the sequences of the hits
+    fasta_output_path = None
+    # Columns of the annotation output that hold input IDs, and columns by which
+    # the rows are sorted, as in the output of a run on a single genome
+    id_columns = ()
+    sort_columns = ()
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.num_sequences = 0
+        # For every unique sequence the chunk it is annotated in and the genome
+        # indices and IDs of the sequences that are identical to it. The
+        # sequences themselves are only kept in the chunk files.
+        self.sequence_chunks = []
+        self.occurrences = []
+
+    @property
+    def num_unique(self):
+        return len(self.occurrences)
+
+    def run(self, threads, cores=None, cache=None, failures=None):
+        """
+        Runs AMRFinderPlus on the unique sequences and writes the outputs of all
+        jobs. Returns the resource usage of every job, which is the combined usage
+        of the deduplicated runs. If a failures list is given, all genomes with a
+        sequence in a failed chunk are appended to it and get no outputs.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            chunk_jobs = self._merge(tmp, _get_num_jobs(threads, cores))
+            chunk_failures = None if failures is None else []
+            chunk_usages = _run_amrfinderplus_jobs(
+                chunk_jobs,
+                threads=threads,
+                cores=cores,
+                cache=cache,
+                failures=chunk_failures,
+            )
+            failed_chunks = dict(chunk_failures or [])
+            failed = self._failed_genomes(failed_chunks, len(chunk_jobs))
+            self._split(
+                [job for i, job in enumerate(chunk_jobs) if i not in failed_chunks],
+                failed,
+            )
+
+        if failures is not None:
+            failures.extend(sorted(failed.items()))
+
+        usage = _combine_usages(
+            [u for i, u in enumerate(chunk_usages) if i not in failed_chunks]
+        )
+        return [
+            {"failed": True, "batch": 0} if index in failed else usage
+            for index in range(len(self.jobs))
+        ]
+
+    def summary(self):
+        return (
+            f"Deduplication: {self.num_unique} of {self.num_sequences} "
+            f"{self.unit} in {len(self.jobs)} genomes are unique and were annotated."
+        )
+
+    def _normalize(self, sequence):
+        # Form of a sequence by which identical sequences are found
+        return sequence
+
+    def _merge(self, tmp, num_chunks=1):
+        chunk_jobs = [
+            {
+                **self.jobs[0],
+                self.input_path: os.path.join(tmp, f"sequences{i}.fasta"),
+                "amr_annotations_path": os.path.join(tmp, f"amr_annotations{i}.tsv"),
+                self.fasta_output_path: os.path.join(tmp, f"amr_sequences{i}.fasta"),
+            }
+            for i in range(num_chunks)
+        ]
+
+        # Every unique sequence is written as soon as it is first seen, to the
+        # chunk with the fewest characters so far. Chunks are filled in order, so
+        # that only trailing chunks can be empty.
+        chunk_sizes = [0] * num_chunks
+        indices = {}
+        with ExitStack() as stack:
+            chunk_files = [
+                stack.enter_context(open(job[self.input_path], "w"))
+                for job in chunk_jobs
+            ]
+            for index, job in enumerate(self.jobs):
+                for seq_id, sequence in _read_fasta(job[self.input_path]):
+                    # Sequences are compared by their normalized form, but written
+                    # as they are in the first genome that contains them
+                    key = self._normalize(sequence)
+                    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+                    if digest not in indices:
+                        indices[digest] = self.num_unique
+                        chunk = chunk_sizes.index(min(chunk_sizes))
+                        chunk_files[chunk].write(
+                            f">{DEDUP_ID.format(indices[digest])}\n{sequence}\n"
+                        )
+                        chunk_sizes[chunk] += len(sequence)
+                        self.sequence_chunks.append(chunk)
+                        self.occurrences.append([])
+                    self.occurrences[indices[digest]].append((index, seq_id))
+                    self.num_sequences += 1
+
+        return chunk_jobs[: max(self.sequence_chunks, default=0) + 1]
+
+    def _failed_genomes(self, failed_chunks, num_chunks):
+        # Genomes fail if one of their sequences was in a failed chunk, or if no
+        # chunk was annotated at all
+        if not failed_chunks:
+            return {}
+        if len(failed_chunks) == num_chunks:
+            error = next(iter(failed_chunks.values()))
+            return {index: error for index in range(len(self.jobs))}
+
+        failed = {}
+        for chunk, occurrences in zip(self.sequence_chunks, self.occurrences):
+            if chunk in failed_chunks:
+                for index, _ in occurrences:
+                    failed.setdefault(index, failed_chunks[chunk])
+        return failed
+
+    def _split(self, chunk_jobs, failed=()):
+        header = None
+        genome_rows = [[] for _ in self.jobs]
+        for chunk_job in chunk_jobs:
+            with open(chunk_job["amr_annotations_path"]) as f:
+                header = f.readline()
+                lines = f.readlines()
+
+            columns = header.rstrip("\n").split("\t")
+            id_indices = [i for i, c in enumerate(columns) if c in self.id_columns]
+            sort_indices = [i for i, c in enumerate(columns) if c in self.sort_columns]
+
+            for line in lines:
+                fields = line.rstrip("\n").split("\t")
+                id_index = next(
+                    (i for i in id_indices if DEDUP_ID_REGEX.fullmatch(fields[i])),
+                    None,
+                )
+                for index, seq_id in self._occurrences(
+                    None if id_index is None else fields[id_index]
+                ):
+                    fields[id_index] = seq_id
+                    genome_rows[index].append(
+                        (_sort_key(fields, sort_indices), "\t".join(fields) + "\n")
+                    )
+
+        # Every genome that did not fail gets the header, also if it has no hits
+        for index, (job, rows) in enumerate(zip(self.jobs, genome_rows)):
+            if index in failed:
+                continue
+            rows.sort(key=lambda row: row[0])
+            with open(job["amr_annotations_path"], "w") as f:
+                f.write(header)
+                f.writelines(line for _, line in rows)
+
+        # Every genome gets a FASTA file, also if it has no hits. The records are
+        # ordered by sequence ID, keeping the order of the hits on a sequence.
+        genome_records = [[] for _ in self.jobs]
+        for chunk_job in chunk_jobs:
+            if not os.path.exists(chunk_job[self.fasta_output_path]):
+                continue
+            for name, sequence in _read_fasta(
+                chunk_job[self.fasta_output_path], full_header=True
+            ):
+                match = DEDUP_ID_REGEX.search(name)
+                for index, seq_id in self._occurrences(match and match.group(0)):
+                    genome_records[index].append(
+                        (
+                            seq_id,
+                            DEDUP_ID_REGEX.sub(lambda _: seq_id, name, count=1),
+                            sequence,
+                        )
+                    )
+
+        for index, (job, records) in enumerate(zip(self.jobs, genome_records)):
+            if index in failed:
+                continue
+            records.sort(key=lambda record: record[0])
+            with open(job[self.fasta_output_path], "w") as f:
+                f.writelines(f">{name}\n{sequence}\n" for _, name, sequence in records)
+
+    def _occurrences(self, dedup_id):
+        match = DEDUP_ID_REGEX.fullmatch(dedup_id or "")
+        if match is None or int(match.group(1)) >= self.num_unique:
+            raise ValueError(
+                "Output of a deduplicated AMRFinderPlus run could not be assigned "
+                f"to {self.unit[:-1]}: {dedup_id}"
+            )
+        return self.occurrences[int(match.group(1))]
+
+
+class ProteinDeduplication(_Deduplication):
+    """
+    Annotates the unique proteins of protein-only genomes in one AMRFinderPlus
+    run and writes the hits to the outputs of every genome.
+    """
+
+    input_path = "protein_path"
+    unit = "proteins"
+    fasta_output_path = "amr_proteins_path"
+    id_columns = ("Protein id", "Protein identifier")
+    sort_columns = ("Protein id", "Protein identifier")
+
+
+class ContigDeduplication(_Deduplication):
+    """
+    Annotates the unique contigs of nucleotide-only genomes in one AMRFinderPlus
+    run and writes the hits to the outputs of every genome. Contigs are compared
+    case-insensitively and annotated as they are in the first genome that contains
+    them, so that soft-masked regions keep their case. The positions of the hits
+    are relative to the contig and the same in every genome that contains it.
+    """
+
+    input_path = "dna_path"
+    unit = "contigs"
+    fasta_output_path = "amr_genes_path"
+    id_columns = ("Contig id",)
+    sort_columns = ("Contig id", "Start", "Stop")
+
+    def _normalize(self, sequence):
+        return sequence.upper()
+
+
+def _can_deduplicate_proteins(sequences, proteins, organism):
+    # Hits on proteins only depend on the protein sequence, unless contigs are
+    # given or point mutations are reported for every genome
+    return proteins is not None and sequences is None and not organism
+
+
+def _can_deduplicate_contigs(sequences, proteins, organism):
+    # Hits on contigs only depend on the contig sequence, unless proteins are
+    # given or point mutations are reported for every genome
+    return sequences is not None and proteins is None and not organism
+
+
+def _combine_usages(usages):
+    # The chunks run concurrently, so the wall time is the longest run, while CPU
+    # times and peak memory add up. Cached chunks have no usage.
+    usages = [usage for usage in usages if usage is not None]
+    if not usages:
+        return None
+    combined = {"batch": 0}
+    for column in ("wall_time", "user_time", "system_time", "max_rss"):
+        values = [usage[column] for usage in usages if column in usage]
+        if values:
+            combined[column] = max(values) if column == "wall_time" else sum(values)
+    return combined
+
+
+def _sort_key(fields, sort_indices):
+    # Numeric columns are compared as numbers
+    return tuple(
+        (0, int(fields[i]), "") if fields[i].isdigit() else (1, 0, fields[i])
+        for i in sort_indices
+    )
+
+
+def _read_fasta(file_fp, full_header=False):
+    # Yields the ID, or the whole header, and the sequence of every record
+    name, chunks = None, []
+    with open(file_fp) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(chunks)
+                name = line[1:] if full_header else line[1:].partition(" ")[0]
+                chunks = []
+            elif line:
+                chunks.append(line)
+    if name is not None:
+        yield name, "".join(chunks)
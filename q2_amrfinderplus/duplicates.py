@@ -0,0 +1,100 @@
+import hashlib
+import mmap
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from q2_amrfinderplus.utils import _job_outputs, _link_or_copy
+
+# Inputs of a job that identify a genome
+INPUT_PATHS = ("dna_path", "protein_path", "gff_path")
+
+
+def _find_duplicate_genomes(jobs, threads=None):
+    """
+    Finds genomes with byte-identical input files. Returns for every job the
+    index of the first job with the same inputs, or None if it is the first.
+    Only files of genomes whose input sizes match another genome are hashed.
+    """
+    sizes = defaultdict(list)
+    for index, job in enumerate(jobs):
+        sizes[_input_sizes(job)].append(index)
+    candidates = [indices for indices in sizes.values() if len(indices) > 1]
+
+    # Hash every file once, in parallel, because hashlib releases the GIL
+    paths = sorted(
+        {
+            jobs[index][input_path]
+            for indices in candidates
+            for index in indices
+            for input_path in INPUT_PATHS
+            if jobs[index][input_path]
+        }
+    )
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        digests = dict(zip(paths, executor.map(_hash_file, paths)))
+
+    duplicates = [None] * len(jobs)
+    for indices in candidates:
+        first = {}
+        for index in indices:
+            key = tuple(
+                digests.get(jobs[index][input_path]) for input_path in INPUT_PATHS
+            )
+            if key in first:
+                duplicates[index] = first[key]
+            else:
+                first[key] = index
+
+    return duplicates
+
+
+def _copy_duplicate_results(jobs, duplicates):
+    # Duplicates get the outputs of the genome that was annotated, as hardlinks
+    # if possible
+    for job, duplicate in zip(jobs, duplicates):
+        if duplicate is None:
+            continue
+        for path_arg in _job_outputs(job):
+            src = jobs[duplicate][path_arg]
+            if os.path.exists(src):
+                _link_or_copy(src, job[path_arg])
+
+
+def _duplicate_report(genome_ids, duplicates):
+    lines = [
+        f"  {'/'.join(genome_ids[index])} is identical to "
+        f"{'/'.join(genome_ids[duplicate])}"
+        for index, duplicate in enumerate(duplicates)
+        if duplicate is not None
+    ]
+    if not lines:
+        return "Duplicate genomes: none found."
+    return (
+        f"Duplicate genomes: {len(lines)} of {len(duplicates)} genomes are "
+        "identical to another genome and were not annotated again:\n" + "\n".join(lines)
+    )
+
+
+def _input_sizes(job):
+    return tuple(
+        os.path.getsize(job[input_path]) if job[input_path] else None
+        for input_path in INPUT_PATHS
+    )
+
+
+def _hash_file(file_path, chunk_size=4 * 1024 * 1024):
+    # The file is memory-mapped and hashed in chunks, so that it is not copied
+    # into the Python heap
+    file_hash = hashlib.blake2b(digest_size=32)
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return file_hash.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                for start in range(0, len(view), chunk_size):
+                    file_hash.update(view[start : start + chunk_size])
+            finally:
+                view.release()
+    return file_hash.hexdigest()
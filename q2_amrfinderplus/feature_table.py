@@ -1,54 +1,151 @@
+import numpy as np
 import pandas as pd
+from q2_types.feature_table import BIOMV210Format
 
+from q2_amrfinderplus import __version__
 from q2_amrfinderplus.types import AMRFinderPlusAnnotationsDirFmt
 
+# Columns needed to identify a hit, in addition to the level column
+POSITION_COLUMNS = ["Contig id", "Start", "Stop", "Strand"]
+LEVEL_COLUMNS = {
+    "gene": ["Gene symbol", "Element symbol"],
+    "class": ["Class"],
+    "subclass": ["Subclass"],
+}
+
+# Number of files after which the collected hits are deduplicated again, so that
+# memory is bounded by the number of distinct hits
+COMPACT_INTERVAL = 1000
+
 
 def create_feature_table(
     annotations: AMRFinderPlusAnnotationsDirFmt,
     level: str = "gene",
-) -> pd.DataFrame:
-    frames = []
+) -> BIOMV210Format:
+    # biom, h5py and scipy are only needed to write the table. They are imported
+    # here, so that this module does not add them to the imports of the plugin.
+    # q2-types imports biom anyway, so this does not make loading the plugin faster.
+    import biom
+    import h5py
+    from scipy.sparse import coo_matrix
+
     sample_dict = annotations.annotation_dict()
 
     # Check if sample_dict is nested and create fake sample if needed
     if type(next(iter(sample_dict.values()), None)) == str:
         sample_dict = {"": sample_dict}
 
-    # Loop over all files, read in dataframes and concatenate them
+    # Contig IDs, features and strands are stored as integer codes. Every hit is
+    # one row of contig code, feature code, start, stop and strand code.
+    contig_ids = {}
+    features = {}
+    strands = {}
+    chunks = []
+
+    # Loop over all files, read in the needed columns and encode the hits
     for sample_id, file_dict in sample_dict.items():
         for _id, file_fp in file_dict.items():
-            try:
-                file_df = pd.read_csv(file_fp, sep="\t")
-
-                if level == "gene":
-                    if "Gene symbol" in file_df.columns:
-                        level_column = "Gene symbol"
-                    else:
-                        level_column = "Element symbol"
-                else:
-                    level_column = level.capitalize()
-
-                file_df = file_df[
-                    ["Contig id", level_column, "Start", "Stop", "Strand"]
-                ]
-
-            except pd.errors.EmptyDataError as e:
-                raise ValueError(
-                    "File is empty. All mutations output is empty if no organism was "
-                    f"specified.\n\nOriginal error: {e}"
-                )
-            except KeyError as e:
-                raise KeyError(
-                    "If the annotations were created solely from protein data, there "
-                    "is no positional information and no gene abundance per contig "
-                    f"can be calculated.\n\nOriginal error: {e}"
-                )
-
-            frames.append(file_df)
-
-    # Drop duplicated rows and pivot table
-    df = pd.concat(frames)
-    df.drop_duplicates(keep="first", inplace=True)
-    df_pivot = pd.crosstab(df["Contig id"], df[level_column])
-
-    return df_pivot
+            file_df, level_column = _read_hits(file_fp, level)
+            chunks.append(
+                _encode_hits(file_df, level_column, contig_ids, features, strands)
+            )
+
+            if len(chunks) >= COMPACT_INTERVAL:
+                chunks = [_unique_hits(chunks)]
+
+    # Drop duplicated hits and count them per contig and feature
+    hits = _unique_hits(chunks)
+    contig_labels, contig_index = _sorted_index(contig_ids)
+    feature_labels, feature_index = _sorted_index(features)
+    counts = coo_matrix(
+        (
+            np.ones(len(hits), dtype=np.int64),
+            (feature_index[hits[:, 1]], contig_index[hits[:, 0]]),
+        ),
+        shape=(len(feature_labels), len(contig_labels)),
+    ).tocsr()
+
+    # Features are observations and contigs are samples of the table
+    table = biom.Table(counts, observation_ids=feature_labels, sample_ids=contig_labels)
+
+    feature_table = BIOMV210Format()
+    with h5py.File(str(feature_table), "w") as f:
+        table.to_hdf5(f, generated_by=f"q2-amrfinderplus {__version__}")
+    return feature_table
+
+
+def _sorted_index(vocabulary):
+    # Returns the alphabetically sorted labels and the position of every code in
+    # the sorted labels
+    labels = np.array(list(vocabulary), dtype=object)
+    order = np.argsort(labels, kind="stable")
+    index = np.empty(len(labels), dtype=np.int64)
+    index[order] = np.arange(len(labels))
+    return labels[order].tolist(), index
+
+
+def _read_hits(file_fp, level):
+    candidates = LEVEL_COLUMNS[level]
+    try:
+        file_df = pd.read_csv(
+            file_fp,
+            sep="\t",
+            usecols=lambda column: column in POSITION_COLUMNS or column in candidates,
+            dtype={
+                "Contig id": "category",
+                "Start": "Int64",
+                "Stop": "Int64",
+                "Strand": "category",
+                **{column: "category" for column in candidates},
+            },
+        )
+    except pd.errors.EmptyDataError as e:
+        raise ValueError(
+            "File is empty. All mutations output is empty if no organism was "
+            f"specified.\n\nOriginal error: {e}"
+        )
+
+    level_column = next((c for c in candidates if c in file_df.columns), candidates[0])
+    missing = [c for c in POSITION_COLUMNS + [level_column] if c not in file_df.columns]
+    if missing:
+        raise KeyError(
+            "If the annotations were created solely from protein data, there "
+            "is no positional information and no gene abundance per contig "
+            f"can be calculated.\n\nMissing columns: {', '.join(missing)}"
+        )
+
+    # Hits without contig or feature are not counted
+    file_df = file_df.dropna(subset=["Contig id", level_column])
+    file_df = file_df.drop_duplicates()
+    return file_df, level_column
+
+
+def _encode_hits(file_df, level_column, contig_ids, features, strands):
+    return np.column_stack(
+        [
+            _encode(file_df["Contig id"], contig_ids),
+            _encode(file_df[level_column], features),
+            file_df["Start"].fillna(-1).to_numpy(dtype=np.int64),
+            file_df["Stop"].fillna(-1).to_numpy(dtype=np.int64),
+            _encode(file_df["Strand"], strands),
+        ]
+    ).reshape(-1, 5)
+
+
+def _encode(values, vocabulary):
+    # Map the categories of one file to global codes, missing values get code -1.
+    # Categories of rows that were dropped are not added to the vocabulary, so
+    # that the table has no empty features or contigs.
+    categorical = pd.Categorical(values).remove_unused_categories()
+    mapping = np.array(
+        [vocabulary.setdefault(c, len(vocabulary)) for c in categorical.categories]
+        + [-1],
+        dtype=np.int64,
+    )
+    return mapping[categorical.codes]
+
+
+def _unique_hits(chunks):
+    if not chunks:
+        return np.empty((0, 5), dtype=np.int64)
+    return np.unique(np.concatenate(chunks), axis=0)
@@ -0,0 +1,137 @@
+import heapq
+import os
+import shutil
+import warnings
+
+import pandas as pd
+from q2_types.feature_data_mag import MAGSequencesDirFmt
+from q2_types.genome_data import ProteinsDirectoryFormat
+from q2_types.per_sample_sequences import ContigSequencesDirFmt, MultiMAGSequencesDirFmt
+from qiime2.util import duplicate
+
+
+def _partition_contigs_by_size(
+    contigs: ContigSequencesDirFmt, num_partitions: int = None, weight: str = "bytes"
+) -> ContigSequencesDirFmt:
+    return _partition_by_size(contigs, num_partitions, weight)
+
+
+def _partition_sample_data_mags_by_size(
+    mags: MultiMAGSequencesDirFmt, num_partitions: int = None, weight: str = "bytes"
+) -> MultiMAGSequencesDirFmt:
+    return _partition_by_size(mags, num_partitions, weight)
+
+
+def _partition_feature_data_mags_by_size(
+    mags: MAGSequencesDirFmt, num_partitions: int = None, weight: str = "bytes"
+) -> MAGSequencesDirFmt:
+    return _partition_by_size(mags, num_partitions, weight)
+
+
+def _partition_proteins_by_size(
+    proteins: ProteinsDirectoryFormat, num_partitions: int = None, weight: str = "bytes"
+) -> ProteinsDirectoryFormat:
+    return _partition_by_size(proteins, num_partitions, weight)
+
+
+def _partition_by_size(data, num_partitions, weight):
+    """
+    Splits a directory format into partitions with balanced total input size.
+    Every top level file or per sample directory is one unit that is kept together.
+    Units are assigned largest first to the currently smallest partition.
+
+    Parameters
+    ----------
+    data : DirectoryFormat
+        Sequences with one file per genome or one directory per sample.
+    num_partitions : int
+        Number of partitions. One partition per unit if None.
+    weight : str
+        "bytes" to balance file sizes or "bases" to balance the number of sequence
+        characters.
+
+    Returns
+    -------
+    dict
+        Mapping of partition number to a directory format of the input type.
+    """
+    units = _get_partition_units(data.path, weight)
+
+    if num_partitions is None or num_partitions > len(units):
+        if num_partitions is not None:
+            warnings.warn(
+                "You have requested a number of partitions "
+                f"({num_partitions}) that is greater than your number "
+                f"of genomes or samples ({len(units)}). Your data will be "
+                f"partitioned by genome or sample into {len(units)} partitions."
+            )
+        num_partitions = len(units)
+
+    bins = _bin_pack(units, num_partitions)
+
+    manifest_fp = os.path.join(str(data), "MANIFEST")
+    partitions = {}
+    for i, unit_names in enumerate(bins, 1):
+        result = type(data)()
+        for unit_name in unit_names:
+            src = os.path.join(str(data), unit_name)
+            des = os.path.join(str(result), unit_name)
+            if os.path.isdir(src):
+                shutil.copytree(src, des, copy_function=duplicate)
+            else:
+                duplicate(src, des)
+
+        # Keep only the manifest rows of samples in this partition
+        if os.path.exists(manifest_fp):
+            manifest = pd.read_csv(manifest_fp)
+            manifest = manifest[manifest["sample-id"].isin(unit_names)]
+            manifest.to_csv(os.path.join(str(result), "MANIFEST"), index=False)
+
+        partitions[i] = result
+
+    return partitions
+
+
+def _get_partition_units(dir_path, weight):
+    units = {}
+    for entry in sorted(os.scandir(dir_path), key=lambda entry: entry.name):
+        if entry.name == "MANIFEST" or entry.name.startswith("."):
+            continue
+        if entry.is_dir():
+            files = [
+                os.path.join(root, file)
+                for root, _, file_names in os.walk(entry.path)
+                for file in file_names
+            ]
+        else:
+            files = [entry.path]
+        units[entry.name] = sum(_get_file_weight(file, weight) for file in files)
+    return units
+
+
+def _get_file_weight(file_fp, weight):
+    if weight == "bytes":
+        return os.path.getsize(file_fp)
+
+    # Count sequence characters, excluding FASTA headers and line breaks
+    count = 0
+    with open(file_fp, "rb") as f:
+        for line in f:
+            if not line.startswith(b">"):
+                count += len(line.rstrip())
+    return count
+
+
+def _bin_pack(units, num_partitions):
+    # Longest processing time first: assign the largest remaining unit to the
+    # partition with the smallest total weight
+    bins = [(0, i, []) for i in range(num_partitions)]
+    for name, unit_weight in sorted(
+        units.items(), key=lambda item: (-item[1], item[0])
+    ):
+        total, i, names = heapq.heappop(bins)
+        names.append(name)
+        heapq.heappush(bins, (total + unit_weight, i, names))
+
+    # Drop empty partitions and keep the original order within each partition
+    return [sorted(names) for _, _, names in sorted(bins, key=lambda b: b[1]) if names]
@@ -13,22 +13,39 @@ from q2_types.feature_table import FeatureTable, Frequency
 from q2_types.genome_data import Genes, GenomeData, Loci, Proteins
 from q2_types.per_sample_sequences import Contigs, MAGs
 from q2_types.sample_data import SampleData
-from qiime2.core.type import Bool, Choices, Float, Int, List, Range, Str
+from qiime2.core.type import (
+    Bool,
+    Choices,
+    Collection,
+    Float,
+    Int,
+    List,
+    Range,
+    Str,
+)
 from qiime2.plugin import Citations, Plugin
 
 from q2_amrfinderplus import __version__
 from q2_amrfinderplus.annotate import _annotate, annotate
-from q2_amrfinderplus.database import fetch_amrfinderplus_db
+from q2_amrfinderplus.collate import collate_amrfinderplus_annotations
+from q2_amrfinderplus.database import fetch_amrfinderplus_db, import_amrfinderplus_db
 from q2_amrfinderplus.feature_table import create_feature_table
+from q2_amrfinderplus.partition import (
+    _partition_contigs_by_size,
+    _partition_feature_data_mags_by_size,
+    _partition_proteins_by_size,
+    _partition_sample_data_mags_by_size,
+)
 from q2_amrfinderplus.types._format import (
     AMRFinderPlusAnnotationFormat,
     AMRFinderPlusAnnotationsDirFmt,
+    AMRFinderPlusAnnotationsParquetDirFmt,
+    AMRFinderPlusAnnotationsParquetFormat,
     AMRFinderPlusDatabaseDirFmt,
     BinaryFormat,
     TextFormat,
 )
 from q2_amrfinderplus.types._type import AMRFinderPlusAnnotations, AMRFinderPlusDatabase
-from q2_amrfinderplus.utils import collate_amrfinderplus_annotations
 
 citations = Citations.load("citations.bib", package="q2_amrfinderplus")
 
@@ -47,10 +64,14 @@ plugin = Plugin(
 
 plugin.methods.register_function(
     function=fetch_amrfinderplus_db,
-    inputs={},
+    inputs={"previous_db": AMRFinderPlusDatabase},
     parameters={},
     outputs=[("amrfinderplus_db", AMRFinderPlusDatabase)],
-    input_descriptions={},
+    input_descriptions={
+        "previous_db": "A previously downloaded AMRFinderPlus database. Files that "
+        "did not change since then are taken from this database instead of being "
+        "copied again."
+    },
     parameter_descriptions={},
     output_descriptions={
         "amrfinderplus_db": "AMRFinderPlus database.",
@@ -60,6 +81,30 @@ plugin.methods.register_function(
     citations=[citations["feldgarden2021amrfinderplus"]],
 )
 
+plugin.methods.register_function(
+    function=import_amrfinderplus_db,
+    inputs={"previous_db": AMRFinderPlusDatabase},
+    parameters={"source": Str},
+    outputs=[("amrfinderplus_db", AMRFinderPlusDatabase)],
+    input_descriptions={
+        "previous_db": "A previously imported AMRFinderPlus database. Files that "
+        "did not change since then are taken from this database instead of being "
+        "copied again."
+    },
+    parameter_descriptions={
+        "source": "Local directory or tarball with the AMRFinderPlus database "
+        "files, e.g. a mirror of the AMRFinderPlus data directory on a shared "
+        "filesystem."
+    },
+    output_descriptions={
+        "amrfinderplus_db": "AMRFinderPlus database.",
+    },
+    name="Import AMRFinderPlus database from a local directory.",
+    description="Create an AMRFinderPlus database artifact from a local directory "
+    "or tarball without downloading the database.",
+    citations=[citations["feldgarden2021amrfinderplus"]],
+)
+
 organisms = [
     "Acinetobacter_baumannii",
     "Bordetella_pertussis",
@@ -148,6 +193,23 @@ amrfinderplus_parameters = {
     ),
     "report_common": Bool,
     "threads": Int % Range(0, None, inclusive_start=False),
+    "cores": Int % Range(0, None, inclusive_start=False),
+    "cache_dir": Str,
+    "cache_max_size": Int % Range(0, None, inclusive_start=False),
+    "batch_size": Int % Range(0, None, inclusive_start=False),
+    "db_staging_dir": Str,
+    "db_staging_max_size": Int % Range(0, None, inclusive_start=False),
+    "prefetch_db": Bool,
+    "telemetry_path": Str,
+    "prescreen": Bool,
+    "prescreen_min_hits": Int % Range(1, None),
+    "deduplicate_proteins": Bool,
+    "deduplicate_contigs": Bool,
+    "deduplicate_genomes": Bool,
+    "resume_dir": Str,
+    "timeout": Int % Range(1, None),
+    "retries": Int % Range(0, None),
+    "failure_report_path": Str,
 }
 
 amrfinderplus_parameter_descriptions = {
@@ -185,6 +247,108 @@ amrfinderplus_parameter_descriptions = {
         "the running host may cause blastp to fail. Using more than 4 threads may "
         "speed up searches."
     ),
+    "cores": (
+        "Total number of cores available for the annotation. Genomes are annotated "
+        "concurrently by as many AMRFinderPlus processes as fit into this budget "
+        "with the given number of threads each (4 if threads is not set), starting "
+        "with the largest genomes. If not set, genomes are annotated one at a time."
+    ),
+    "cache_dir": (
+        "Directory of an on-disk result cache. Results are reused for genomes whose "
+        "input files, database version and analysis parameters match a previous "
+        "run instead of running AMRFinderPlus again."
+    ),
+    "cache_max_size": (
+        "Maximum size of the result cache in MB. The least recently used results "
+        "are removed when the cache grows larger. Unlimited if not set."
+    ),
+    "batch_size": (
+        "Number of genomes that are annotated together in one AMRFinderPlus run. "
+        "Batching avoids the start-up cost of AMRFinderPlus for every genome and "
+        "speeds up the annotation of many small genomes. Results are split back into "
+        "one file per genome. Together with loci, batching is only supported for the "
+        "'prodigal' annotation format."
+    ),
+    "db_staging_dir": (
+        "Directory on fast node-local storage, e.g. local scratch or /dev/shm. The "
+        "database is copied there once per node and version and AMRFinderPlus reads "
+        "it from the local copy instead of the artifact, which may be on a network "
+        "filesystem."
+    ),
+    "db_staging_max_size": (
+        "Maximum size of all databases in the staging directory in MB. The least "
+        "recently used databases that are not in use are removed when the "
+        "directory grows larger. Unlimited if not set."
+    ),
+    "prefetch_db": (
+        "Read the BLAST and HMM files of the database into the page cache before "
+        "the first genome is annotated, so that the first AMRFinderPlus runs on a "
+        "node with a cold cache are not slower than the following ones."
+    ),
+    "telemetry_path": (
+        "Path of a TSV file to which the input size, wall time, user and system CPU "
+        "time and peak memory of the AMRFinderPlus run of every genome are "
+        "appended. Genomes annotated in one batch share the values of the batch."
+    ),
+    "prescreen": (
+        "Look up the k-mers of every genome in a k-mer index of the database "
+        "before running AMRFinderPlus. Genomes that share fewer k-mers with the "
+        "database than 'prescreen-min-hits' get empty outputs without running "
+        "AMRFinderPlus. Genes with less than about 80% identity to the database "
+        "may be missed. Not used if an organism is given. The index is stored in "
+        "the user cache directory."
+    ),
+    "prescreen_min_hits": (
+        "Minimum number of distinct k-mers (25-mers for nucleotide and 10-mers "
+        "for protein sequences) a genome has to share with the database to be "
+        "annotated by AMRFinderPlus."
+    ),
+    "deduplicate_proteins": (
+        "Annotate every distinct protein sequence only once if only protein "
+        "sequences are given. The proteins of all genomes are deduplicated by "
+        "sequence and annotated in as many concurrent AMRFinderPlus runs as fit "
+        "into the core budget, and the hits are written to the outputs of every "
+        "genome containing the protein, with its protein IDs. Not used if contigs "
+        "or an organism are given."
+    ),
+    "deduplicate_contigs": (
+        "Annotate every distinct contig only once if only nucleotide sequences "
+        "are given, e.g. plasmids shared by many isolates. The contigs of all "
+        "genomes are deduplicated by their case-insensitive sequence and annotated "
+        "in as many concurrent AMRFinderPlus runs as fit into the core budget, and "
+        "the hits are written to the outputs of every genome containing the "
+        "contig, with its contig IDs. Not used if proteins or an organism are "
+        "given."
+    ),
+    "deduplicate_genomes": (
+        "Annotate genomes with byte-identical input files only once, e.g. "
+        "resubmitted isolates. All input files are hashed before the annotation "
+        "and the results of every distinct genome are linked or copied to its "
+        "duplicates. Duplicates are listed in the log."
+    ),
+    "resume_dir": (
+        "Working directory that makes the annotation resumable. The outputs of "
+        "every genome are written to this directory together with a completion "
+        "marker. If a run is interrupted, a rerun with the same inputs, database, "
+        "parameters and working directory only annotates the genomes without "
+        "marker."
+    ),
+    "timeout": (
+        "Maximum wall-clock time in seconds of the AMRFinderPlus run of one "
+        "genome. Runs that take longer are stopped together with their BLAST and "
+        "HMMER processes and fail. No limit if not set."
+    ),
+    "retries": (
+        "Number of times an AMRFinderPlus run that ran out of memory is retried. "
+        "Every retry uses half the threads of the previous attempt."
+    ),
+    "failure_report_path": (
+        "Path of a TSV file to which the IDs and errors of genomes that failed are "
+        "appended. If given, failed genomes are left out of the outputs and the "
+        "remaining genomes are annotated, instead of stopping at the first "
+        "failure. Genomes annotated in one batch fail together, and with "
+        "deduplication a genome fails if one of its sequences failed."
+    ),
 }
 
 amrfinderplus_output_descriptions = {
@@ -261,7 +425,9 @@ plugin.pipelines.register_function(
     },
     parameters={
         **amrfinderplus_parameters,
-        "num_partitions": Int % Range(0, None, inclusive_start=False),
+        "num_partitions": Int % Range(0, None, inclusive_start=False)
+        | Str % Choices("auto"),
+        "partition_mode": Str % Choices("count", "bytes", "bases"),
     },
     outputs=[
         ("amr_annotations", GenomeData[AMRFinderPlusAnnotations]),
@@ -272,7 +438,17 @@ plugin.pipelines.register_function(
     input_descriptions=amrfinderplus_input_descriptions,
     parameter_descriptions={
         **amrfinderplus_parameter_descriptions,
-        "num_partitions": "Number of partitions that should run in parallel.",
+        "num_partitions": (
+            "Number of partitions that should run in parallel. 'auto' derives the "
+            "number from the available cores and the cores or threads used by each "
+            "partition."
+        ),
+        "partition_mode": (
+            "How the input is split into partitions. 'count' splits by number of "
+            "genomes or samples. 'bytes' and 'bases' balance the partitions by total "
+            "file size or number of sequence characters, assigning the largest "
+            "genomes or samples first."
+        ),
     },
     output_descriptions=amrfinderplus_output_descriptions,
     name="Annotate MAGs or contigs with AMRFinderPlus.",
@@ -283,6 +459,42 @@ plugin.pipelines.register_function(
     citations=[citations["feldgarden2021amrfinderplus"]],
 )
 
+size_partition_inputs = [
+    (_partition_contigs_by_size, "contigs", SampleData[Contigs], "contigs"),
+    (_partition_sample_data_mags_by_size, "mags", SampleData[MAGs], "MAGs"),
+    (_partition_feature_data_mags_by_size, "mags", FeatureData[MAG], "MAGs"),
+    (_partition_proteins_by_size, "proteins", GenomeData[Proteins], "proteins"),
+]
+
+for function, input_name, input_type, description_name in size_partition_inputs:
+    plugin.methods.register_function(
+        function=function,
+        inputs={input_name: input_type},
+        parameters={
+            "num_partitions": Int % Range(1, None),
+            "weight": Str % Choices("bytes", "bases"),
+        },
+        outputs={"partitioned_" + input_name: Collection[input_type]},
+        input_descriptions={input_name: f"The {description_name} to partition."},
+        parameter_descriptions={
+            "num_partitions": (
+                "The number of partitions to split the data into. Defaults to one "
+                "partition per genome or sample."
+            ),
+            "weight": (
+                "Balance partitions by total file size ('bytes') or by number of "
+                "sequence characters ('bases')."
+            ),
+        },
+        name=f"Partition {description_name} by size.",
+        description=(
+            f"Partition {description_name} into groups of balanced total size. Files "
+            "or per sample directories are assigned largest first to the smallest "
+            "partition."
+        ),
+    )
+
+
 plugin.methods.register_function(
     function=create_feature_table,
     inputs={"annotations": GenomeData[AMRFinderPlusAnnotations]},
@@ -332,6 +544,8 @@ plugin.register_formats(
     BinaryFormat,
     AMRFinderPlusAnnotationFormat,
     AMRFinderPlusAnnotationsDirFmt,
+    AMRFinderPlusAnnotationsParquetFormat,
+    AMRFinderPlusAnnotationsParquetDirFmt,
 )
 
 importlib.import_module("q2_amrfinderplus.types._transformer")
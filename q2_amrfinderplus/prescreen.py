@@ -0,0 +1,293 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from q2_amrfinderplus.staging import _database_key
+from q2_amrfinderplus.utils import _job_outputs
+
+# Length of the nucleotide and protein k-mers. Random matches of 25-mers and
+# 10-mers are rare in a bacterial genome, while genes with about 85% nucleotide
+# or 80% amino acid identity to a reference still share several k-mers with it.
+PRESCREEN_K = {"dna": 25, "protein": 10}
+
+# Database files the k-mers of the index are taken from
+PRESCREEN_SOURCES = {"dna": "AMR_CDS.fa", "protein": "AMRProt.fa"}
+
+# Maximum number of characters of a sequence whose k-mers are computed at once.
+# Longer sequences are screened in overlapping chunks to bound the memory use.
+PRESCREEN_CHUNK_SIZE = 1024 * 1024
+
+# Characters of every alphabet and the number of bits used per character
+ALPHABETS = {"dna": ("ACGT", 2), "protein": ("ACDEFGHIKLMNPQRSTVWY", 5)}
+
+# Columns of the AMRFinderPlus output for database format versions 3 and 4. The
+# position columns are only written if nucleotide sequences or GFF files are
+# given.
+POSITION_COLUMNS = ("Contig id", "Start", "Stop", "Strand")
+ANNOTATION_HEADERS = {
+    "3": (
+        "Protein identifier",
+        "Contig id",
+        "Start",
+        "Stop",
+        "Strand",
+        "Gene symbol",
+        "Sequence name",
+        "Scope",
+        "Element type",
+        "Element subtype",
+        "Class",
+        "Subclass",
+        "Method",
+        "Target length",
+        "Reference sequence length",
+        "% Coverage of reference sequence",
+        "% Identity to reference sequence",
+        "Alignment length",
+        "Accession of closest sequence",
+        "Name of closest sequence",
+        "HMM id",
+        "HMM description",
+        "Hierarchy node",
+    ),
+    "4": (
+        "Protein id",
+        "Contig id",
+        "Start",
+        "Stop",
+        "Strand",
+        "Element symbol",
+        "Element name",
+        "Scope",
+        "Type",
+        "Subtype",
+        "Class",
+        "Subclass",
+        "Method",
+        "Target length",
+        "Reference sequence length",
+        "% Coverage of reference",
+        "% Identity to reference",
+        "Alignment length",
+        "Closest reference accession",
+        "Closest reference name",
+        "HMM accession",
+        "HMM description",
+        "Hierarchy node",
+    ),
+}
+
+
+class KmerPrescreen:
+    """
+    Prescreen that finds genomes without plausible AMR content. The k-mers of
+    every genome are looked up in an index of the nucleotide and protein
+    sequences of the database. Genomes with fewer matching k-mers than min_hits
+    are not annotated with AMRFinderPlus and get empty outputs instead. The index
+    is built once per database and stored in the user cache directory.
+
+    Parameters
+    ----------
+    amrfinderplus_db : AMRFinderPlusDatabaseDirFmt
+        Database used for the analysis.
+    min_hits : int
+        Minimum number of distinct k-mers a genome has to share with the database
+        to be annotated.
+    max_workers : int
+        Maximum number of genomes that are screened concurrently.
+    """
+
+    def __init__(self, amrfinderplus_db, min_hits=10, max_workers=None):
+        self.min_hits = min_hits
+        self.max_workers = max_workers
+        self.screened = 0
+        self.skipped = 0
+        self.index = _load_index(amrfinderplus_db)
+        self._amrfinderplus_db = amrfinderplus_db
+
+    def hits(self, job):
+        # Proteins are screened if given, because AMRFinderPlus searches them
+        # instead of the contigs
+        kind, path = (
+            ("protein", job["protein_path"])
+            if job["protein_path"]
+            else ("dna", job["dna_path"])
+        )
+        index = self.index[kind]
+
+        # Without index, e.g. if the database file is missing, nothing is skipped
+        if not len(index):
+            return None
+
+        # Sequences are screened chunk by chunk and only the matching k-mers are
+        # kept, so that the memory use does not grow with the genome size
+        matches = [np.empty(0, dtype=np.uint64)]
+        for sequence in _iter_sequences(path, overlap=PRESCREEN_K[kind] - 1):
+            kmers = _kmers(sequence, kind)
+            positions = np.minimum(np.searchsorted(index, kmers), len(index) - 1)
+            matches.append(kmers[index[positions] == kmers])
+        return len(np.unique(np.concatenate(matches)))
+
+    def screen(self, jobs):
+        """
+        Writes empty outputs for all genomes that are skipped. Returns for every
+        job whether it was skipped.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            hits = list(executor.map(self.hits, jobs))
+
+        skipped = [h is not None and h < self.min_hits for h in hits]
+        for job, skip in zip(jobs, skipped):
+            if skip:
+                _write_empty_outputs(job, self._amrfinderplus_db)
+
+        self.screened += len(jobs)
+        self.skipped += sum(skipped)
+        return skipped
+
+    def summary(self):
+        return (
+            f"Prescreen: {self.skipped} of {self.screened} genomes share no k-mers "
+            "with the database and were not annotated."
+        )
+
+
+def _get_prescreen_dir():
+    # Directory with the k-mer indices of all databases
+    cache_home = os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "q2-amrfinderplus", "prescreen")
+
+
+def _load_index(amrfinderplus_db):
+    k = "-".join(str(PRESCREEN_K[kind]) for kind in PRESCREEN_K)
+    index_fp = os.path.join(
+        _get_prescreen_dir(), f"{_database_key(amrfinderplus_db)}-k{k}.npz"
+    )
+    if os.path.exists(index_fp):
+        with np.load(index_fp) as index:
+            return {kind: index[kind] for kind in PRESCREEN_K}
+
+    index = {}
+    for kind, file_name in PRESCREEN_SOURCES.items():
+        source_fp = os.path.join(str(amrfinderplus_db), file_name)
+        index[kind] = (
+            _kmers(_read_sequences(source_fp), kind)
+            if os.path.exists(source_fp)
+            else np.empty(0, dtype=np.uint64)
+        )
+
+    # Publish the index atomically. If the cache directory is not writable, the
+    # index is built again by the next run.
+    try:
+        os.makedirs(os.path.dirname(index_fp), exist_ok=True)
+        fd, tmp_fp = tempfile.mkstemp(dir=os.path.dirname(index_fp), suffix=".npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **index)
+        os.replace(tmp_fp, index_fp)
+    except OSError:
+        pass
+
+    return index
+
+
+def _read_sequences(file_fp):
+    # Concatenates all sequences of a FASTA file, separated by a character that
+    # is not part of any alphabet, so that no k-mer spans two sequences
+    with open(file_fp, "rb") as f:
+        records = f.read().split(b">")
+    return b"*".join(
+        record.partition(b"\n")[2].replace(b"\n", b"").replace(b"\r", b"")
+        for record in records
+    )
+
+
+def _iter_sequences(file_fp, overlap, chunk_size=PRESCREEN_CHUNK_SIZE):
+    """
+    Yields the sequences of a FASTA file one at a time. Sequences longer than
+    chunk_size are yielded in chunks that overlap by overlap characters, so that
+    every window of overlap + 1 characters is contained in one chunk.
+    """
+    chunk = bytearray()
+    with open(file_fp, "rb") as f:
+        for line in f:
+            if line.startswith(b">"):
+                if len(chunk) > overlap:
+                    yield bytes(chunk)
+                chunk.clear()
+                continue
+            chunk += line.rstrip(b"\r\n")
+            while len(chunk) >= chunk_size:
+                yield bytes(chunk[:chunk_size])
+                del chunk[: chunk_size - overlap]
+    if len(chunk) > overlap:
+        yield bytes(chunk)
+
+
+def _code_table(alphabet):
+    table = np.full(256, 255, dtype=np.uint8)
+    for code, char in enumerate(alphabet):
+        table[ord(char)] = code
+        table[ord(char.lower())] = code
+    return table
+
+
+CODE_TABLES = {kind: _code_table(alphabet) for kind, (alphabet, _) in ALPHABETS.items()}
+
+
+def _kmers(sequence, kind):
+    """
+    Returns the sorted, distinct k-mers of a sequence encoded as integers. Windows
+    with characters outside of the alphabet are left out. Nucleotide k-mers are
+    canonical, i.e. the smaller of the k-mer and its reverse complement.
+    """
+    k = PRESCREEN_K[kind]
+    bits = np.uint64(ALPHABETS[kind][1])
+    codes = CODE_TABLES[kind][np.frombuffer(sequence, dtype=np.uint8)]
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+
+    # Windows are valid if they contain no invalid character
+    invalid = np.concatenate([[0], np.cumsum(codes == 255)])
+    valid = invalid[k:] - invalid[:-k] == 0
+
+    values = codes.astype(np.uint64)
+    kmers = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        kmers = (kmers << bits) | values[j : j + n]
+
+    if kind == "dna":
+        reverse = np.zeros(n, dtype=np.uint64)
+        for j in range(k):
+            reverse |= (np.uint64(3) - values[j : j + n]) << (bits * np.uint64(j))
+        kmers = np.minimum(kmers, reverse)
+
+    return np.unique(kmers[valid])
+
+
+def _annotation_header(amrfinderplus_db, positional):
+    # The header depends on the database format, which is tied to the major
+    # version of AMRFinderPlus
+    version_fp = os.path.join(str(amrfinderplus_db), "database_format_version.txt")
+    major = "4"
+    if os.path.exists(version_fp):
+        with open(version_fp) as f:
+            major = f.read().strip().split(".")[0]
+
+    header = ANNOTATION_HEADERS.get(major, ANNOTATION_HEADERS["4"])
+    return [c for c in header if positional or c not in POSITION_COLUMNS]
+
+
+def _write_empty_outputs(job, amrfinderplus_db):
+    # Outputs as written by AMRFinderPlus for a genome without hits
+    header = _annotation_header(
+        amrfinderplus_db, positional=bool(job["dna_path"] or job["gff_path"])
+    )
+    with open(job["amr_annotations_path"], "w") as f:
+        f.write("\t".join(header) + "\n")
+
+    for path_arg in _job_outputs(job):
+        if path_arg in ("amr_genes_path", "amr_proteins_path"):
+            open(job[path_arg], "w").close()
@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+
+from q2_amrfinderplus.cache import _base_hash, _job_key
+from q2_amrfinderplus.utils import (
+    OUTPUT_FILES,
+    _job_outputs,
+    _link_or_copy,
+    _remove_outputs,
+)
+
+# File name of the completion marker of a genome
+MARKER_SUFFIX = ".done"
+
+
+class ResumeState:
+    """
+    Working directory that makes runs resumable. The outputs of every genome are
+    written to the working directory and a completion marker with a digest of
+    the input files, the database version and the analysis parameters is written
+    once the genome is finished. A rerun with the same working directory skips
+    all genomes with a matching marker.
+
+    The state can be used in place of a ResultCache when running jobs, so that
+    markers are written as soon as a genome is finished. Results are fetched
+    from and stored in the given cache, if any.
+
+    Parameters
+    ----------
+    resume_dir : str
+        Working directory. Created if it does not exist.
+    amrfinderplus_db : AMRFinderPlusDatabaseDirFmt
+        Database used for the analysis.
+    params : dict
+        Analysis parameters of _run_amrfinderplus_analyse.
+    cache : ResultCache
+        Result cache that is used for genomes that are not completed.
+    """
+
+    def __init__(self, resume_dir, amrfinderplus_db, params, cache=None):
+        self.resume_dir = resume_dir
+        self.cache = cache
+        self.completed = 0
+        self._base_hash = _base_hash(amrfinderplus_db, params)
+        # Marker paths and keys of the genomes by their annotation output path
+        self._markers = {}
+        self._keys = {}
+
+    def redirect(self, job, sample_id, _id):
+        """
+        Returns a copy of the job that writes its outputs to the working
+        directory instead of the output artifacts.
+        """
+        genome_dir = os.path.join(self.resume_dir, sample_id)
+        os.makedirs(genome_dir, exist_ok=True)
+        redirected = {
+            **job,
+            **{
+                path_arg: os.path.join(genome_dir, os.path.basename(job[path_arg]))
+                for path_arg in OUTPUT_FILES
+                if job.get(path_arg)
+            },
+        }
+        self._markers[redirected["amr_annotations_path"]] = os.path.join(
+            genome_dir, f"{_id}{MARKER_SUFFIX}"
+        )
+        return redirected
+
+    def is_complete(self, job):
+        """
+        Returns True if the genome was finished by a previous run with the same
+        inputs and parameters. Stale markers are removed, so that a genome is
+        never considered complete while its outputs are rewritten. The outputs of
+        genomes that are not complete are removed as well, because they can be
+        hardlinks of cache entries and published artifacts, which must not be
+        changed when the outputs are written again.
+        """
+        marker_path = self._markers[job["amr_annotations_path"]]
+        if os.path.exists(marker_path):
+            with open(marker_path) as f:
+                try:
+                    key = json.load(f).get("key")
+                except ValueError:
+                    key = None
+            if key == self._key(job) and all(
+                os.path.exists(job[path_arg]) for path_arg in _job_outputs(job)
+            ):
+                self.completed += 1
+                return True
+            os.remove(marker_path)
+        _remove_outputs(job)
+        return False
+
+    def mark_complete(self, job):
+        # The marker is written atomically after all outputs are in place
+        marker_path = self._markers[job["amr_annotations_path"]]
+        fd, tmp_fp = tempfile.mkstemp(dir=os.path.dirname(marker_path), prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"key": self._key(job)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fp, marker_path)
+
+    def publish(self, job, output_job):
+        # Link the outputs in the working directory to the output artifacts
+        for path_arg in _job_outputs(job):
+            if os.path.exists(job[path_arg]):
+                _link_or_copy(job[path_arg], output_job[path_arg])
+
+    def fetch(self, job):
+        if self.cache is not None and self.cache.fetch(job):
+            self.mark_complete(job)
+            return True
+        return False
+
+    def store(self, job):
+        if self.cache is not None:
+            self.cache.store(job)
+        self.mark_complete(job)
+
+    def summary(self):
+        return f"Resume: {self.completed} genomes were completed by a previous run."
+
+    def _key(self, job):
+        # Input files are only hashed once per genome
+        path = job["amr_annotations_path"]
+        if path not in self._keys:
+            self._keys[path] = _job_key(self._base_hash, job)
+        return self._keys[path]
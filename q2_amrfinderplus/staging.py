@@ -0,0 +1,169 @@
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from q2_amrfinderplus.cache import _dir_size
+from q2_amrfinderplus.types._format import DATABASE_CHECKSUMS
+
+
+class DatabaseStaging:
+    """
+    Node-local copies of AMRFinderPlus databases. A database is copied once per
+    staging directory and shared by all jobs on the node. Copies are keyed by the
+    database version and the digest of the checksum manifest, published atomically
+    and reference counted, so that copies in use are never evicted.
+
+    Parameters
+    ----------
+    staging_dir : str
+        Directory on fast local storage, e.g. local scratch or /dev/shm. Created if
+        it does not exist.
+    max_size : int
+        Maximum size of all staged databases in bytes. Unbounded if None.
+    """
+
+    def __init__(self, staging_dir, max_size=None):
+        self.staging_dir = staging_dir
+        self.max_size = max_size
+        os.makedirs(os.path.join(staging_dir, ".refs"), exist_ok=True)
+
+    def key(self, amrfinderplus_db):
+        return _database_key(amrfinderplus_db)
+
+    @contextmanager
+    def stage(self, amrfinderplus_db):
+        """
+        Context manager that yields the path of the local copy of the database.
+        The copy is created if it does not exist yet.
+        """
+        key = self.key(amrfinderplus_db)
+        entry_dir = os.path.join(self.staging_dir, key)
+
+        # Register the reference before copying, so that the copy can not be
+        # evicted by a concurrent job before it is used
+        with self._lock(".lock"):
+            ref = self._add_ref(key)
+
+        try:
+            # Only one job per node copies a database, the others wait for it
+            with self._lock(f".lock-{key}"):
+                if not os.path.exists(entry_dir):
+                    self._copy(str(amrfinderplus_db), entry_dir)
+
+            # Mark the copy as recently used
+            os.utime(entry_dir)
+            yield entry_dir
+
+        finally:
+            with self._lock(".lock"):
+                os.remove(ref)
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used copies without references over max_size."""
+        if self.max_size is None:
+            return
+
+        with self._lock(".lock"):
+            entries = [
+                (entry.stat().st_mtime, _dir_size(entry.path), entry)
+                for entry in os.scandir(self.staging_dir)
+                if entry.is_dir() and not entry.name.startswith(".")
+            ]
+
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries, key=lambda e: e[:2]):
+                if total_size <= self.max_size:
+                    break
+                if self._has_refs(entry.name):
+                    continue
+                shutil.rmtree(entry.path, ignore_errors=True)
+                total_size -= size
+
+    def _copy(self, src_dir, entry_dir):
+        # Copy to a temporary directory and publish it atomically
+        tmp_dir = tempfile.mkdtemp(dir=self.staging_dir, prefix=".tmp-")
+        try:
+            file_names = [
+                entry.name for entry in os.scandir(src_dir) if entry.is_file()
+            ]
+            with ThreadPoolExecutor() as executor:
+                list(
+                    executor.map(
+                        lambda file_name: shutil.copyfile(
+                            os.path.join(src_dir, file_name),
+                            os.path.join(tmp_dir, file_name),
+                        ),
+                        file_names,
+                    )
+                )
+            os.rename(tmp_dir, entry_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def _add_ref(self, key):
+        ref_dir = os.path.join(self.staging_dir, ".refs", key)
+        os.makedirs(ref_dir, exist_ok=True)
+        ref = os.path.join(ref_dir, f"{os.getpid()}-{uuid.uuid4().hex}")
+        open(ref, "w").close()
+        return ref
+
+    def _has_refs(self, key):
+        # References of processes that are not running anymore are removed
+        ref_dir = os.path.join(self.staging_dir, ".refs", key)
+        if not os.path.isdir(ref_dir):
+            return False
+
+        has_refs = False
+        for ref in os.scandir(ref_dir):
+            if _is_running(int(ref.name.split("-")[0])):
+                has_refs = True
+            else:
+                os.remove(ref.path)
+        return has_refs
+
+    @contextmanager
+    def _lock(self, name):
+        with open(os.path.join(self.staging_dir, name), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user
+        return True
+    return True
+
+
+def _database_key(amrfinderplus_db):
+    # Identifies a database by its version and the digest of its manifest
+    db_path = str(amrfinderplus_db)
+    with open(os.path.join(db_path, "version.txt")) as f:
+        version = re.sub(r"[^\w.-]", "_", f.read().strip())
+
+    # Databases without a manifest are identified by their file names and sizes
+    manifest_fp = os.path.join(db_path, DATABASE_CHECKSUMS)
+    if os.path.exists(manifest_fp):
+        with open(manifest_fp, "rb") as f:
+            digest = hashlib.sha256(f.read())
+    else:
+        digest = hashlib.sha256()
+        for entry in sorted(os.scandir(db_path), key=lambda e: e.name):
+            digest.update(f"{entry.name}\t{entry.stat().st_size}\n".encode())
+
+    return f"{version}-{digest.hexdigest()[:16]}"
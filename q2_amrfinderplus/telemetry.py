@@ -0,0 +1,94 @@
+import fcntl
+import os
+
+from q2_amrfinderplus.utils import _get_input_size
+
+# Columns of the telemetry file. Times are in seconds and sizes in bytes. Genomes
+# annotated in one batch share the resource usage of the batch. Cached genomes,
+# genomes completed by a previous run, genomes skipped by the prescreen, duplicates
+# of other genomes and failed genomes have no resource usage.
+TELEMETRY_COLUMNS = (
+    "sample_id",
+    "id",
+    "input_size",
+    "cached",
+    "resumed",
+    "skipped",
+    "duplicate",
+    "failed",
+    "batch",
+    "wall_time",
+    "user_time",
+    "system_time",
+    "max_rss",
+)
+
+# Columns of the failure report
+FAILURE_REPORT_COLUMNS = ("sample_id", "id", "error")
+
+
+def _write_telemetry(telemetry_path, genome_ids, jobs, usages):
+    """
+    Appends one row per genome with the input size and the resource usage of its
+    AMRFinderPlus run to a TSV file. The usage is None for cached genomes. The
+    header is written if the file is new, so that all partitions of a pipeline run
+    can append to the same file.
+    """
+    lines = []
+    for (sample_id, _id), job, usage in zip(genome_ids, jobs, usages):
+        cached = usage is None
+        usage = usage or {}
+        row = {
+            "sample_id": sample_id,
+            "id": _id,
+            "input_size": _get_input_size(
+                job["dna_path"], job["protein_path"], job["gff_path"]
+            ),
+            "cached": cached,
+            "resumed": bool(usage.get("resumed")),
+            "skipped": bool(usage.get("skipped")),
+            "duplicate": bool(usage.get("duplicate")),
+            "failed": bool(usage.get("failed")),
+            "batch": usage.get("batch"),
+            **{
+                column: f"{usage[column]:.3f}"
+                for column in ("wall_time", "user_time", "system_time")
+                if column in usage
+            },
+            "max_rss": usage.get("max_rss"),
+        }
+        lines.append(
+            "\t".join(
+                "" if row.get(column) is None else str(row[column])
+                for column in TELEMETRY_COLUMNS
+            )
+            + "\n"
+        )
+
+    _append_rows(telemetry_path, TELEMETRY_COLUMNS, lines)
+
+
+def _write_failure_report(failure_report_path, genome_ids, errors):
+    """
+    Appends one row per failed genome with its error to a TSV file. The header is
+    written if the file is new.
+    """
+    lines = [
+        "\t".join([sample_id, _id, " ".join(error.split())]) + "\n"
+        for (sample_id, _id), error in zip(genome_ids, errors)
+    ]
+    _append_rows(failure_report_path, FAILURE_REPORT_COLUMNS, lines)
+
+
+def _append_rows(file_path, columns, lines):
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    with open(file_path, "a") as f:
+        # Concurrent partitions must not write the header twice or mix lines
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_size == 0:
+                f.write("\t".join(columns) + "\n")
+            f.writelines(lines)
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
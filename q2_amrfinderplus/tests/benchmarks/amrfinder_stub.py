@@ -0,0 +1,143 @@
+"""
+Stand-in for the amrfinder executable used by the benchmarks. It accepts the
+arguments that the plugin passes to AMRFinderPlus and instantly writes outputs in
+the AMRFinderPlus format, with hits for a deterministic subset of the input
+sequences. Only the standard library is imported to keep the start-up time low.
+"""
+
+import sys
+import zlib
+
+# Gene symbol, sequence name, class and subclass of the reported hits
+GENES = (
+    ("blaTEM-1", "class A beta-lactamase TEM-1", "BETA-LACTAM", "BETA-LACTAM"),
+    ("blaCTX-M-15", "class A extended-spectrum beta-lactamase", "BETA-LACTAM", "CEPH"),
+    ("aph(3'')-Ib", "aminoglycoside O-phosphotransferase", "AMINOGLYCOSIDE", "STREP"),
+    ("sul1", "sulfonamide-resistant dihydropteroate synthase", "SULFONAMIDE", "SULF"),
+    ("tet(A)", "tetracycline efflux MFS transporter", "TETRACYCLINE", "TETRA"),
+    ("qnrS1", "quinolone resistance pentapeptide repeat protein", "QUINOLONE", "QUIN"),
+    ("dfrA17", "trimethoprim-resistant dihydrofolate reductase", "TRIMETHOPRIM", "TMP"),
+    ("stxA2", "Shiga toxin Stx2 subunit A", "NA", "NA"),
+)
+
+# Every HIT_INTERVAL-th sequence on average has a hit
+HIT_INTERVAL = 3
+
+POSITION_COLUMNS = ["Contig id", "Start", "Stop", "Strand"]
+HEADER_START = ["Protein id"]
+HEADER_END = [
+    "Element symbol",
+    "Element name",
+    "Scope",
+    "Type",
+    "Subtype",
+    "Class",
+    "Subclass",
+    "Method",
+    "Target length",
+    "Reference sequence length",
+    "% Coverage of reference",
+    "% Identity to reference",
+    "Alignment length",
+    "Closest reference accession",
+    "Closest reference name",
+    "HMM accession",
+    "HMM description",
+    "Hierarchy node",
+]
+MUTATIONS_HEADER = HEADER_START + POSITION_COLUMNS + HEADER_END
+
+
+def parse_args(argv):
+    # Options without a value, all other options take exactly one value
+    flags = {"--plus", "--print_node", "--report_common"}
+    args = {}
+    i = 0
+    while i < len(argv):
+        if argv[i] in flags:
+            args[argv[i]] = True
+            i += 1
+        else:
+            args[argv[i]] = argv[i + 1]
+            i += 2
+    return args
+
+
+def read_fasta(path):
+    records = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith(">"):
+                records.append([line[1:].split()[0], []])
+            elif records:
+                records[-1][1].append(line.strip())
+    return [(seq_id, "".join(lines)) for seq_id, lines in records]
+
+
+def main(argv):
+    args = parse_args(argv)
+    dna = read_fasta(args["-n"]) if "-n" in args else []
+    proteins = read_fasta(args["-p"]) if "-p" in args else []
+
+    # Hits are reported on proteins if given, like AMRFinderPlus does
+    records = proteins or dna
+    positional = bool(dna)
+    columns = HEADER_START + (POSITION_COLUMNS if positional else []) + HEADER_END
+
+    rows, genes, hit_proteins = [], [], []
+    for seq_id, seq in records:
+        code = zlib.crc32(seq_id.encode())
+        if code % HIT_INTERVAL:
+            continue
+        symbol, name, drug_class, subclass = GENES[code % len(GENES)]
+        stop = max(1, min(len(seq), 900))
+        row = ["NA" if not proteins else seq_id]
+        if positional:
+            contig_id = seq_id if not proteins else dna[0][0]
+            row += [contig_id, "1", str(stop), "+"]
+            genes.append((f"{contig_id}:1-{stop} {symbol}", seq[:stop]))
+        row += [
+            symbol,
+            name,
+            "core",
+            "AMR",
+            "AMR",
+            drug_class,
+            subclass,
+            "EXACTP" if proteins else "EXACTX",
+            str(stop // 3),
+            str(stop // 3),
+            "100.00",
+            "100.00",
+            str(stop // 3),
+            f"WP_{code % 10**9:09d}.1",
+            name,
+            "NA",
+            "NA",
+            symbol,
+        ]
+        rows.append(row)
+        if proteins:
+            hit_proteins.append((f"{seq_id} {symbol}", seq))
+
+    with open(args["-o"], "w") as f:
+        f.write("\t".join(columns) + "\n")
+        f.writelines("\t".join(row) + "\n" for row in rows)
+
+    for option, sequences in (
+        ("--nucleotide_output", genes),
+        ("--protein_output", hit_proteins),
+    ):
+        if option in args:
+            with open(args[option], "w") as f:
+                f.writelines(f">{header}\n{seq}\n" for header, seq in sequences)
+
+    if "--mutation_all" in args:
+        with open(args["--mutation_all"], "w") as f:
+            f.write("\t".join(MUTATIONS_HEADER) + "\n")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
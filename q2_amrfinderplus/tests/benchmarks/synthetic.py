@@ -0,0 +1,207 @@
+import itertools
+import os
+import random
+import uuid
+
+from q2_types.per_sample_sequences import MultiMAGSequencesDirFmt
+
+from q2_amrfinderplus.prescreen import ANNOTATION_HEADERS
+from q2_amrfinderplus.types import AMRFinderPlusAnnotationsDirFmt
+
+# Columns of the AMRFinderPlus annotations before and after version 4.0, which
+# renamed "Gene symbol" to "Element symbol" among others
+HEADERS = {
+    "Gene symbol": ANNOTATION_HEADERS["3"],
+    "Element symbol": ANNOTATION_HEADERS["4"],
+}
+
+# Gene families, classes and subclasses the synthetic genes are derived from
+GENE_FAMILIES = (
+    ("blaTEM", "BETA-LACTAM", "BETA-LACTAM"),
+    ("blaCTX-M", "BETA-LACTAM", "CEPHALOSPORIN"),
+    ("blaOXA", "BETA-LACTAM", "CARBAPENEM"),
+    ("aac(6')", "AMINOGLYCOSIDE", "AMIKACIN/KANAMYCIN/TOBRAMYCIN"),
+    ("aph(3'')", "AMINOGLYCOSIDE", "STREPTOMYCIN"),
+    ("tet", "TETRACYCLINE", "TETRACYCLINE"),
+    ("sul", "SULFONAMIDE", "SULFONAMIDE"),
+    ("dfrA", "TRIMETHOPRIM", "TRIMETHOPRIM"),
+    ("qnr", "QUINOLONE", "QUINOLONE"),
+    ("erm", "LINCOSAMIDE/MACROLIDE/STREPTOGRAMIN", "ERYTHROMYCIN"),
+)
+
+METHODS = ("EXACTX", "BLASTX", "PARTIALX", "ALLELEX", "HMM")
+
+
+def create_annotations(
+    path,
+    num_samples=1,
+    mags_per_sample=1,
+    hits_per_genome=10,
+    num_genes=100,
+    contigs_per_genome=50,
+    distinct_hits_per_genome=50,
+    layout="per_sample",
+    header="Element symbol",
+    seed=42,
+):
+    """
+    Creates an AMRFinderPlus annotations directory with synthetic hits.
+
+    Genes are drawn from a vocabulary of num_genes genes with a Zipf-like
+    distribution, so that few genes are common and most are rare, as in real
+    data. Contig IDs are unique per genome. The rows of every genome are drawn
+    from distinct_hits_per_genome hits, so that the number of rows grows with
+    hits_per_genome while the number of distinct hits and features stays fixed.
+
+    Parameters
+    ----------
+    path : str
+        Directory that is created.
+    num_samples : int
+        Number of samples, or of files for the flat layout together with
+        mags_per_sample.
+    mags_per_sample : int
+        Number of MAGs per sample.
+    hits_per_genome : int
+        Number of hits in every annotation file.
+    num_genes : int
+        Size of the gene vocabulary.
+    contigs_per_genome : int
+        Number of contigs the hits of a genome are spread over.
+    distinct_hits_per_genome : int
+        Number of distinct hits of every genome. The rows are drawn from them with
+        replacement.
+    layout : str
+        "per_sample" for one directory per sample, like SampleData[MAGs]
+        annotations, or "flat" for all files in one directory, like
+        SampleData[Contigs] or FeatureData[MAG] annotations.
+    header : str
+        "Element symbol" for the header of AMRFinderPlus 4 or "Gene symbol" for
+        the header of earlier versions.
+    seed : int
+        Seed of the random number generator.
+
+    Returns
+    -------
+    AMRFinderPlusAnnotationsDirFmt
+        Annotations in the created directory.
+    """
+    if layout not in ("per_sample", "flat"):
+        raise ValueError(f"Unknown layout: {layout}")
+
+    rng = random.Random(seed)
+    header_line = "\t".join(HEADERS[header]) + "\n"
+    genes = _create_gene_vocabulary(num_genes)
+    cum_weights = list(
+        itertools.accumulate(1 / rank for rank in range(1, num_genes + 1))
+    )
+
+    os.makedirs(path)
+    for i in range(num_samples):
+        sample_dir = os.path.join(path, f"sample{i + 1}")
+        if layout == "per_sample":
+            os.mkdir(sample_dir)
+
+        for _ in range(mags_per_sample):
+            genome_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            file_name = f"{genome_id}_amr_annotations.tsv"
+            file_fp = os.path.join(
+                sample_dir if layout == "per_sample" else path, file_name
+            )
+            distinct_hits = [
+                _create_row(rng, genome_id, contigs_per_genome, gene_row)
+                for gene_row in rng.choices(
+                    genes, cum_weights=cum_weights, k=distinct_hits_per_genome
+                )
+            ]
+
+            with open(file_fp, "w") as f:
+                f.write(header_line)
+                f.writelines(rng.choices(distinct_hits, k=hits_per_genome))
+
+    return AMRFinderPlusAnnotationsDirFmt(path, "r")
+
+
+def _create_gene_vocabulary(num_genes):
+    # Every gene is the tab separated part of a row that only depends on the gene
+    genes = []
+    for i in range(num_genes):
+        family, drug_class, subclass = GENE_FAMILIES[i % len(GENE_FAMILIES)]
+        symbol = f"{family}-{i // len(GENE_FAMILIES) + 1}"
+        name = f"{family} family resistance protein {symbol}"
+        genes.append(
+            (
+                symbol,
+                "\t".join([symbol, name, "core", "AMR", "AMR", drug_class, subclass]),
+                f"WP_{i:09d}.1\t{name}",
+            )
+        )
+    return genes
+
+
+def _create_row(rng, genome_id, contigs_per_genome, gene_row):
+    symbol, gene_columns, reference_columns = gene_row
+    length = rng.randrange(150, 1500)
+    start = rng.randrange(1, 100000)
+    coverage = rng.uniform(60, 100)
+    return (
+        "\t".join(
+            [
+                "NA",
+                f"{genome_id[:8]}_contig{rng.randrange(contigs_per_genome)}",
+                str(start),
+                str(start + length - 1),
+                rng.choice("+-"),
+                gene_columns,
+                rng.choice(METHODS),
+                str(length // 3),
+                str(int(length / 3 / coverage * 100)),
+                f"{coverage:.2f}",
+                f"{rng.uniform(80, 100):.2f}",
+                str(length // 3),
+                reference_columns,
+                "NA",
+                "NA",
+                symbol,
+            ]
+        )
+        + "\n"
+    )
+
+
+def create_mags(
+    path,
+    num_genomes,
+    mags_per_sample=100,
+    contigs_per_mag=4,
+    contig_length=300,
+    seed=42,
+):
+    """
+    Creates a SampleData[MAGs] directory with the given number of MAGs. Contigs
+    are drawn from a pool of random sequences, so that creating large inputs is
+    fast.
+    """
+    rng = random.Random(seed)
+    pool = [
+        "".join(rng.choices("ACGT", k=contig_length))
+        for _ in range(contigs_per_mag * 50)
+    ]
+
+    os.makedirs(path)
+    manifest = ["sample-id,mag-id,filename\n"]
+    for i in range(num_genomes):
+        sample_id = f"sample{i // mags_per_sample + 1}"
+        mag_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        sample_dir = os.path.join(path, sample_id)
+        os.makedirs(sample_dir, exist_ok=True)
+
+        with open(os.path.join(sample_dir, f"{mag_id}.fasta"), "w") as f:
+            for j in range(contigs_per_mag):
+                f.write(f">{mag_id[:8]}_contig{j}\n{rng.choice(pool)}\n")
+        manifest.append(f"{sample_id},{mag_id},{sample_id}/{mag_id}.fasta\n")
+
+    with open(os.path.join(path, "MANIFEST"), "w") as f:
+        f.writelines(manifest)
+
+    return MultiMAGSequencesDirFmt(path, "r")
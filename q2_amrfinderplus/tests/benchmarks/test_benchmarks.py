@@ -0,0 +1,236 @@
+import gc
+import json
+import os
+import stat
+import sys
+import time
+import tracemalloc
+import unittest
+from contextlib import redirect_stdout
+from importlib.metadata import version
+from unittest.mock import patch
+
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.annotate import _annotate
+from q2_amrfinderplus.collate import collate_amrfinderplus_annotations
+from q2_amrfinderplus.feature_table import create_feature_table
+from q2_amrfinderplus.partition import _partition_by_size
+from q2_amrfinderplus.tests.benchmarks.synthetic import create_mags
+from q2_amrfinderplus.types import AMRFinderPlusDatabaseDirFmt
+from q2_amrfinderplus.types._transformer import _metadata_transformer_helper
+from q2_amrfinderplus.utils import _create_sample_dict, _get_file_paths
+
+# The benchmarks are slow and only run if this environment variable is set
+BENCHMARK_ENV = "Q2_AMRFINDERPLUS_BENCHMARK"
+
+# If set, the measured values are stored as the new baselines
+BENCHMARK_UPDATE_ENV = "Q2_AMRFINDERPLUS_BENCHMARK_UPDATE"
+
+BASELINES_FP = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+# A stage regresses if its peak memory or the number of memory blocks it leaves
+# allocated exceeds the baseline times the tolerance. Both are traced with
+# tracemalloc and do not depend on the speed of the machine, unlike the time, which
+# is only reported. The slack absorbs the noise of stages that allocate very little.
+TOLERANCE = 1.2
+MEMORY_SLACK = 64 * 1024
+BLOCKS_SLACK = 50
+
+NUM_PARTITIONS = 4
+
+# Libraries whose allocations are measured along with the plugin. The baselines are
+# only compared if they were stored with the same versions.
+LIBRARIES = ("biom-format", "numpy", "pandas", "pyarrow", "scipy")
+
+
+@unittest.skipUnless(
+    os.environ.get(BENCHMARK_ENV), f"Set {BENCHMARK_ENV}=1 to run the benchmarks."
+)
+class TestBenchmarks(TestPluginBase):
+    """
+    Measures the time, the peak memory and the allocated memory blocks of the
+    Python layer of the plugin with an amrfinder stub that writes its outputs
+    instantly. Memory is traced with tracemalloc, which also slows down the
+    stages, so the reported times are only comparable with each other.
+    """
+
+    package = "q2_amrfinderplus.tests"
+
+    @classmethod
+    def setUpClass(cls):
+        with open(BASELINES_FP) as f:
+            cls.baselines = json.load(f)
+        cls.versions = _library_versions()
+
+        # Allocations depend on the versions of Python and the libraries
+        mismatches = [
+            f"{name} {cls.versions[name]} (baseline {baseline})"
+            for name, baseline in cls.baselines["versions"].items()
+            if cls.versions.get(name) != baseline
+        ]
+        if mismatches and not os.environ.get(BENCHMARK_UPDATE_ENV):
+            raise unittest.SkipTest(
+                "The baselines were stored with other versions: "
+                + ", ".join(mismatches)
+                + f". Set {BENCHMARK_UPDATE_ENV}=1 to store new baselines."
+            )
+        super().setUpClass()
+        cls.results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.environ.get(BENCHMARK_UPDATE_ENV) and cls.results:
+            # Baselines of other versions are not kept
+            if cls.baselines["versions"] != cls.versions:
+                cls.baselines = {"versions": cls.versions, "stages": {}}
+            for stage, sizes in cls.results.items():
+                cls.baselines["stages"].setdefault(stage, {}).update(sizes)
+            with open(BASELINES_FP, "w") as f:
+                json.dump(cls.baselines, f, indent=2, sort_keys=True)
+                f.write("\n")
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = self.temp_dir.name
+        self.amrfinderplus_db = AMRFinderPlusDatabaseDirFmt(
+            self.get_data_path("minimal_database"), "r"
+        )
+
+        # Put the amrfinder stub on PATH, run by the current interpreter
+        bin_dir = os.path.join(self.tmp, "bin")
+        os.mkdir(bin_dir)
+        stub_fp = os.path.join(bin_dir, "amrfinder")
+        with open(os.path.join(os.path.dirname(__file__), "amrfinder_stub.py")) as f:
+            stub = f.read()
+        with open(stub_fp, "w") as f:
+            f.write(f"#!{sys.executable} -S\n{stub}")
+        os.chmod(stub_fp, os.stat(stub_fp).st_mode | stat.S_IEXEC)
+
+        path_patcher = patch.dict(
+            os.environ, {"PATH": bin_dir + os.pathsep + os.environ.get("PATH", "")}
+        )
+        path_patcher.start()
+        self.addCleanup(path_patcher.stop)
+
+    def test_benchmark_10(self):
+        self._run_benchmark(10)
+
+    def test_benchmark_1k(self):
+        self._run_benchmark(1000)
+
+    def test_benchmark_10k(self):
+        self._run_benchmark(10000)
+
+    def _run_benchmark(self, num_genomes):
+        # The stages run once on a single genome first, so that the modules they
+        # import lazily are not counted in the measurements
+        self._run_stages(create_mags(os.path.join(self.tmp, "warmup"), 1))
+
+        measurements = {}
+
+        def measure(stage, func, *args, **kwargs):
+            result, measurements[stage] = _measure(func, *args, **kwargs)
+            return result
+
+        mags = create_mags(os.path.join(self.tmp, "mags"), num_genomes)
+        self._run_stages(mags, measure)
+        self._check_baselines(str(num_genomes), measurements)
+
+    def _run_stages(self, mags, measure=None):
+        if measure is None:
+
+            def measure(stage, func, *args, **kwargs):
+                return func(*args, **kwargs)
+
+        partitions = measure(
+            "partition", _partition_by_size, mags, NUM_PARTITIONS, "bytes"
+        )
+        sample_dict = measure("sample_dict", _create_sample_dict, None, mags)
+        measure("file_paths", _get_all_file_paths, mags, sample_dict)
+        annotations = measure("annotate", self._annotate_partitions, partitions)
+        collated = measure("collate", collate_amrfinderplus_annotations, annotations)
+        measure("feature_table", create_feature_table, collated)
+        measure("metadata", _metadata_transformer_helper, collated)
+
+    def _annotate_partitions(self, partitions):
+        # The commands printed for every genome are not shown
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            return [
+                _annotate(
+                    self.amrfinderplus_db,
+                    sequences=partition,
+                    threads=1,
+                    cores=os.cpu_count(),
+                )[0]
+                for partition in partitions.values()
+            ]
+
+    def _check_baselines(self, size, measurements):
+        update = os.environ.get(BENCHMARK_UPDATE_ENV)
+        regressions = []
+        for stage, (duration, memory, blocks) in measurements.items():
+            self.results.setdefault(stage, {})[size] = {
+                "memory": memory,
+                "blocks": blocks,
+            }
+            print(
+                f"{stage:>15} {size:>7} genomes: {duration:8.2f} s "
+                f"{memory / 1024**2:10.1f} MB {blocks:10d} blocks"
+            )
+
+            baseline = self.baselines["stages"].get(stage, {}).get(size)
+            if baseline is None:
+                regressions.append(f"{stage}: no baseline")
+                continue
+            if memory > baseline["memory"] * TOLERANCE + MEMORY_SLACK:
+                regressions.append(
+                    f"{stage}: {memory / 1024**2:.2f} MB, baseline "
+                    f"{baseline['memory'] / 1024**2:.2f} MB"
+                )
+            if blocks > baseline["blocks"] * TOLERANCE + BLOCKS_SLACK:
+                regressions.append(
+                    f"{stage}: {blocks} blocks, baseline {baseline['blocks']} blocks"
+                )
+
+        if regressions and not update:
+            self.fail(
+                f"Regressions with {size} genomes:\n"
+                + "\n".join(regressions)
+                + f"\nSet {BENCHMARK_UPDATE_ENV}=1 to store new baselines."
+            )
+
+
+def _library_versions():
+    versions = {"python": "{}.{}".format(*sys.version_info[:2])}
+    versions.update({name: version(name) for name in LIBRARIES})
+    return versions
+
+
+def _measure(func, *args, **kwargs):
+    # Returns the result, the duration in seconds, the peak of the memory allocated
+    # by Python and numpy in bytes and the number of memory blocks that are still
+    # allocated when the function returns, which includes its result. Garbage is
+    # collected before and after, so that the blocks do not depend on when the
+    # garbage collector last ran.
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        duration = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        gc.collect()
+        blocks = len(tracemalloc.take_snapshot().traces)
+    finally:
+        tracemalloc.stop()
+    return result, (duration, peak, blocks)
+
+
+def _get_all_file_paths(mags, sample_dict):
+    return [
+        _get_file_paths(mags, None, None, _id, file_fp, sample_id)
+        for sample_id, file_dict in sample_dict.items()
+        for _id, file_fp in file_dict.items()
+    ]
@@ -0,0 +1,126 @@
+import math
+import os
+
+import biom
+import pandas as pd
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.feature_table import create_feature_table
+from q2_amrfinderplus.tests.benchmarks.synthetic import create_annotations
+from q2_amrfinderplus.tests.benchmarks.test_benchmarks import BENCHMARK_ENV, _measure
+from q2_amrfinderplus.types._transformer import _metadata_transformer_helper
+
+# Factors by which the number of rows per genome is scaled
+SCALES = (1, 4, 16)
+
+# The number of genomes and of their distinct hits is fixed, only the number of
+# rows grows. The largest scale has 160k rows, enough for the memory that grows
+# with the rows to swamp the fixed cost of pandas, or two million rows with the
+# benchmark environment variable set.
+NUM_SAMPLES = 10
+MAGS_PER_SAMPLE = 10
+HITS_PER_GENOME = 1250 if os.environ.get(BENCHMARK_ENV) else 100
+
+
+class TestScaling(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = self.temp_dir.name
+
+    def _memory_exponent(self, func):
+        # Slope of the peak memory over the number of rows on a log-log scale, 1
+        # for linear growth. The function runs once before, so that the modules
+        # it imports lazily are not counted.
+        func(
+            create_annotations(
+                os.path.join(self.tmp, f"{func.__name__}_warmup"), hits_per_genome=1
+            )
+        )
+        peaks = []
+        for scale in SCALES:
+            annotations = create_annotations(
+                os.path.join(self.tmp, f"{func.__name__}_{scale}"),
+                num_samples=NUM_SAMPLES,
+                mags_per_sample=MAGS_PER_SAMPLE,
+                hits_per_genome=HITS_PER_GENOME * scale,
+            )
+            _, (_, peak, _) = _measure(func, annotations)
+            peaks.append(peak)
+        return math.log(peaks[-1] / peaks[0]) / math.log(SCALES[-1] / SCALES[0])
+
+    def test_create_feature_table_memory(self):
+        # Only the distinct hits are kept, so memory hardly grows with the rows
+        self.assertLess(self._memory_exponent(create_feature_table), 0.5)
+
+    def test_annotation_dict_memory(self):
+        # The files are not read
+        self.assertLess(
+            self._memory_exponent(lambda annotations: annotations.annotation_dict()),
+            0.1,
+        )
+
+    def test_metadata_transformer_memory(self):
+        # The metadata has one row per hit, so memory grows linearly at best. With
+        # the fixed cost on top, linear growth gives an exponent below 1 (about
+        # 0.75 at the default sizes), super-linear growth does not.
+        self.assertLess(self._memory_exponent(_metadata_transformer_helper), 1)
+
+    def test_create_annotations_layouts(self):
+        for layout in ("per_sample", "flat"):
+            for header in ("Element symbol", "Gene symbol"):
+                with self.subTest(layout=layout, header=header):
+                    annotations = create_annotations(
+                        os.path.join(self.tmp, f"{layout}_{header}"),
+                        num_samples=2,
+                        mags_per_sample=3,
+                        hits_per_genome=20,
+                        num_genes=5,
+                        layout=layout,
+                        header=header,
+                    )
+                    annotation_dict = annotations.annotation_dict()
+                    if layout == "per_sample":
+                        self.assertEqual(list(annotation_dict), ["sample1", "sample2"])
+                        self.assertEqual(
+                            [len(files) for files in annotation_dict.values()], [3, 3]
+                        )
+                    else:
+                        self.assertEqual(len(annotation_dict), 6)
+
+                    df = _metadata_transformer_helper(annotations)
+                    self.assertEqual(len(df), 120)
+                    self.assertIn(header, df.columns)
+                    self.assertLessEqual(df[header].nunique(), 5)
+
+                    # Duplicated hits are counted once
+                    table = biom.load_table(str(create_feature_table(annotations)))
+                    self.assertEqual(table.sum(), len(df.drop_duplicates()))
+
+    def test_create_annotations_distinct_hits(self):
+        # More rows per genome repeat the same distinct hits
+        counts = []
+        for hits_per_genome in (10, 1000):
+            df = _metadata_transformer_helper(
+                create_annotations(
+                    os.path.join(self.tmp, str(hits_per_genome)),
+                    num_samples=2,
+                    hits_per_genome=hits_per_genome,
+                    distinct_hits_per_genome=5,
+                )
+            )
+            self.assertEqual(len(df), 2 * hits_per_genome)
+            counts.append(len(df.drop_duplicates()))
+
+        self.assertLessEqual(counts[0], 10)
+        self.assertEqual(counts[1], 10)
+
+    def test_create_annotations_deterministic(self):
+        dfs = [
+            _metadata_transformer_helper(
+                create_annotations(os.path.join(self.tmp, str(i)), hits_per_genome=5)
+            )
+            for i in range(2)
+        ]
+        pd.testing.assert_frame_equal(*dfs)
@@ -1,3 +1,4 @@
+import os
 from unittest.mock import MagicMock, call, patch
 
 import qiime2
@@ -42,12 +43,12 @@ class TestAnnotate(TestPluginBase):
         "q2_amrfinderplus.annotate._get_file_paths",
         return_value=("dna_path", "protein_path", "gff_path"),
     )
-    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_analyse")
+    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_jobs")
     @patch("q2_amrfinderplus.annotate._create_empty_files")
     def test__annotate(
         self,
         mock_create_empty_files,
-        mock_run_amrfinderplus,
+        mock_run_amrfinderplus_jobs,
         mock_get_file_paths,
         mock_create_sample_dirs,
         mock_create_sample_dict,
@@ -64,6 +65,531 @@ class TestAnnotate(TestPluginBase):
         self.assertIsInstance(result[2], GenesDirectoryFormat)
         self.assertIsInstance(result[3], ProteinsDirectoryFormat)
 
+        # Ensure one job was created for the single genome
+        jobs = mock_run_amrfinderplus_jobs.call_args.args[0]
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]["dna_path"], "dna_path")
+        self.assertNotIn("cores", jobs[0])
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path", "id2": "file_path"}},
+    )
+    @patch("q2_amrfinderplus.annotate._create_sample_dirs")
+    @patch(
+        "q2_amrfinderplus.annotate._get_file_paths",
+        return_value=("dna_path", None, None),
+    )
+    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_jobs")
+    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_batches")
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    def test__annotate_batches(
+        self,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_batches,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dirs,
+        mock_create_sample_dict,
+    ):
+        _annotate(AMRFinderPlusDatabaseDirFmt(), batch_size=10, cores=8, threads=2)
+
+        mock_run_amrfinderplus_jobs.assert_not_called()
+        jobs = mock_run_amrfinderplus_batches.call_args.args[0]
+        self.assertEqual(len(jobs), 2)
+        self.assertNotIn("batch_size", jobs[0])
+        mock_run_amrfinderplus_batches.assert_called_once_with(
+            jobs, 10, threads=2, cores=8, cache=None, failures=None
+        )
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path"}},
+    )
+    @patch("q2_amrfinderplus.annotate._create_sample_dirs")
+    @patch(
+        "q2_amrfinderplus.annotate._get_file_paths",
+        return_value=("dna_path", None, None),
+    )
+    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_jobs")
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    @patch("q2_amrfinderplus.annotate.DatabaseStaging")
+    def test__annotate_db_staging(
+        self,
+        mock_staging,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dirs,
+        mock_create_sample_dict,
+    ):
+        mock_staging.return_value.stage.return_value.__enter__.return_value = (
+            "/dev/shm/db"
+        )
+        amrfinderplus_db = AMRFinderPlusDatabaseDirFmt()
+
+        _annotate(amrfinderplus_db, db_staging_dir="/dev/shm", db_staging_max_size=2)
+
+        mock_staging.assert_called_once_with("/dev/shm", max_size=2 * 1024**2)
+        mock_staging.return_value.stage.assert_called_once_with(amrfinderplus_db)
+        jobs = mock_run_amrfinderplus_jobs.call_args.args[0]
+        self.assertEqual(jobs[0]["amrfinderplus_db"], "/dev/shm/db")
+        self.assertNotIn("db_staging_dir", jobs[0])
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path"}},
+    )
+    @patch("q2_amrfinderplus.annotate._create_sample_dirs")
+    @patch(
+        "q2_amrfinderplus.annotate._get_file_paths",
+        return_value=("dna_path", None, None),
+    )
+    @patch(
+        "q2_amrfinderplus.annotate._run_amrfinderplus_jobs",
+        return_value=[{"wall_time": 1.0}],
+    )
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    @patch("q2_amrfinderplus.annotate._write_telemetry")
+    def test__annotate_telemetry(
+        self,
+        mock_write_telemetry,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dirs,
+        mock_create_sample_dict,
+    ):
+        _annotate(AMRFinderPlusDatabaseDirFmt(), telemetry_path="telemetry.tsv")
+
+        jobs = mock_run_amrfinderplus_jobs.call_args.args[0]
+        self.assertNotIn("telemetry_path", jobs[0])
+        mock_write_telemetry.assert_called_once_with(
+            "telemetry.tsv", [("sample1", "id1")], jobs, [{"wall_time": 1.0}]
+        )
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path", "id2": "file_path"}},
+    )
+    @patch("q2_amrfinderplus.annotate._create_sample_dirs")
+    @patch(
+        "q2_amrfinderplus.annotate._get_file_paths",
+        return_value=("dna_path", None, None),
+    )
+    @patch(
+        "q2_amrfinderplus.annotate._run_amrfinderplus_jobs",
+        return_value=[{"wall_time": 1.0}],
+    )
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    @patch("q2_amrfinderplus.annotate._write_telemetry")
+    @patch("q2_amrfinderplus.annotate.KmerPrescreen")
+    def test__annotate_prescreen(
+        self,
+        mock_prescreen,
+        mock_write_telemetry,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dirs,
+        mock_create_sample_dict,
+    ):
+        mock_prescreen.return_value.screen.return_value = [True, False]
+        amrfinderplus_db = AMRFinderPlusDatabaseDirFmt()
+
+        _annotate(
+            amrfinderplus_db,
+            prescreen=True,
+            prescreen_min_hits=5,
+            telemetry_path="telemetry.tsv",
+        )
+
+        mock_prescreen.assert_called_once_with(
+            amrfinderplus_db, min_hits=5, max_workers=4
+        )
+        jobs = mock_prescreen.return_value.screen.call_args.args[0]
+        self.assertEqual(len(jobs), 2)
+        self.assertNotIn("prescreen", jobs[0])
+        mock_run_amrfinderplus_jobs.assert_called_once_with(
+            [jobs[1]], threads=None, cores=None, cache=None, failures=None
+        )
+        self.assertEqual(
+            mock_write_telemetry.call_args.args[3],
+            [{"skipped": True}, {"wall_time": 1.0}],
+        )
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path", "id2": "file_path"}},
+    )
+    @patch("q2_amrfinderplus.annotate._create_sample_dirs")
+    @patch(
+        "q2_amrfinderplus.annotate._get_file_paths",
+        return_value=("dna_path", None, None),
+    )
+    @patch(
+        "q2_amrfinderplus.annotate._run_amrfinderplus_jobs",
+        return_value=[{"wall_time": 1.0}],
+    )
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    @patch("q2_amrfinderplus.annotate._write_telemetry")
+    @patch("q2_amrfinderplus.annotate._find_duplicate_genomes", return_value=[None, 0])
+    @patch("q2_amrfinderplus.annotate._copy_duplicate_results")
+    def test__annotate_deduplicate_genomes(
+        self,
+        mock_copy_duplicate_results,
+        mock_find_duplicate_genomes,
+        mock_write_telemetry,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dirs,
+        mock_create_sample_dict,
+    ):
+        _annotate(
+            AMRFinderPlusDatabaseDirFmt(),
+            deduplicate_genomes=True,
+            cores=8,
+            telemetry_path="telemetry.tsv",
+        )
+
+        jobs = mock_find_duplicate_genomes.call_args.args[0]
+        self.assertEqual(mock_find_duplicate_genomes.call_args.kwargs, {"threads": 8})
+        self.assertNotIn("deduplicate_genomes", jobs[0])
+        mock_run_amrfinderplus_jobs.assert_called_once_with(
+            [jobs[0]], threads=None, cores=8, cache=None, failures=None
+        )
+        mock_copy_duplicate_results.assert_called_once_with(jobs, [None, 0])
+        self.assertEqual(
+            mock_write_telemetry.call_args.args[3],
+            [{"wall_time": 1.0}, {"duplicate": True}],
+        )
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path"}},
+    )
+    @patch("q2_amrfinderplus.annotate._create_sample_dirs")
+    @patch(
+        "q2_amrfinderplus.annotate._get_file_paths",
+        return_value=("dna_path", None, None),
+    )
+    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_jobs")
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    @patch("q2_amrfinderplus.annotate.KmerPrescreen")
+    def test__annotate_prescreen_organism(
+        self,
+        mock_prescreen,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dirs,
+        mock_create_sample_dict,
+    ):
+        _annotate(AMRFinderPlusDatabaseDirFmt(), prescreen=True, organism="Escherichia")
+
+        mock_prescreen.assert_not_called()
+        self.assertEqual(len(mock_run_amrfinderplus_jobs.call_args.args[0]), 1)
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path", "id2": "file_path"}},
+    )
+    @patch("q2_amrfinderplus.annotate._create_sample_dirs")
+    @patch(
+        "q2_amrfinderplus.annotate._get_file_paths",
+        return_value=(None, "protein_path", None),
+    )
+    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_jobs")
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    @patch("q2_amrfinderplus.annotate.ProteinDeduplication")
+    def test__annotate_deduplicate_proteins(
+        self,
+        mock_deduplication,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dirs,
+        mock_create_sample_dict,
+    ):
+        _annotate(
+            AMRFinderPlusDatabaseDirFmt(),
+            proteins=self.proteins,
+            deduplicate_proteins=True,
+            threads=2,
+        )
+
+        jobs = mock_deduplication.call_args.args[0]
+        self.assertEqual(len(jobs), 2)
+        self.assertNotIn("deduplicate_proteins", jobs[0])
+        mock_deduplication.return_value.run.assert_called_once_with(
+            threads=2, cores=None, cache=None, failures=None
+        )
+        mock_run_amrfinderplus_jobs.assert_not_called()
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path"}},
+    )
+    @patch("q2_amrfinderplus.annotate._create_sample_dirs")
+    @patch(
+        "q2_amrfinderplus.annotate._get_file_paths",
+        return_value=("dna_path", None, None),
+    )
+    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_jobs")
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    @patch("q2_amrfinderplus.annotate.ProteinDeduplication")
+    def test__annotate_deduplicate_proteins_sequences(
+        self,
+        mock_deduplication,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dirs,
+        mock_create_sample_dict,
+    ):
+        # Proteins are only deduplicated without contigs
+        _annotate(
+            AMRFinderPlusDatabaseDirFmt(),
+            sequences=self.mags,
+            proteins=self.proteins,
+            deduplicate_proteins=True,
+        )
+
+        mock_deduplication.assert_not_called()
+        self.assertEqual(len(mock_run_amrfinderplus_jobs.call_args.args[0]), 1)
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path", "id2": "file_path"}},
+    )
+    @patch("q2_amrfinderplus.annotate._create_sample_dirs")
+    @patch(
+        "q2_amrfinderplus.annotate._get_file_paths",
+        return_value=("dna_path", None, None),
+    )
+    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_jobs")
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    @patch("q2_amrfinderplus.annotate.ContigDeduplication")
+    def test__annotate_deduplicate_contigs(
+        self,
+        mock_deduplication,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dirs,
+        mock_create_sample_dict,
+    ):
+        _annotate(
+            AMRFinderPlusDatabaseDirFmt(),
+            sequences=self.mags,
+            deduplicate_contigs=True,
+            batch_size=10,
+        )
+
+        jobs = mock_deduplication.call_args.args[0]
+        self.assertEqual(len(jobs), 2)
+        self.assertNotIn("deduplicate_contigs", jobs[0])
+        mock_deduplication.return_value.run.assert_called_once_with(
+            threads=None, cores=None, cache=None, failures=None
+        )
+        mock_run_amrfinderplus_jobs.assert_not_called()
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path", "id2": "file_path"}},
+    )
+    @patch("q2_amrfinderplus.annotate._get_file_paths")
+    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_jobs")
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    def test__annotate_resume(
+        self,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dict,
+    ):
+        tmp = self.temp_dir.name
+        resume_dir = os.path.join(tmp, "resume")
+        for _id in ("id1", "id2"):
+            with open(os.path.join(tmp, f"{_id}.fasta"), "w") as f:
+                f.write(f">{_id}\nACGT\n")
+        mock_get_file_paths.side_effect = lambda *args: (
+            os.path.join(tmp, f"{args[3]}.fasta"),
+            None,
+            None,
+        )
+
+        def run_jobs(jobs, threads, cores=None, cache=None, failures=None, fail=False):
+            for job in jobs:
+                if fail and "id2" in job["amr_annotations_path"]:
+                    raise Exception("AMRFinderPlus was killed")
+                with open(job["amr_annotations_path"], "w") as f:
+                    f.write("header\n")
+                open(job["amr_genes_path"], "w").close()
+                cache.store(job)
+            return [{"wall_time": 1.0}] * len(jobs)
+
+        # The first run is interrupted after the first genome
+        mock_run_amrfinderplus_jobs.side_effect = lambda *args, **kwargs: run_jobs(
+            *args, **kwargs, fail=True
+        )
+        with self.assertRaisesRegex(Exception, "killed"):
+            _annotate(
+                AMRFinderPlusDatabaseDirFmt(),
+                sequences=self.mags,
+                resume_dir=resume_dir,
+            )
+        self.assertEqual(os.listdir(resume_dir), ["sample1"])
+        jobs = mock_run_amrfinderplus_jobs.call_args.args[0]
+        self.assertTrue(jobs[0]["amr_annotations_path"].startswith(resume_dir))
+
+        # The rerun only annotates the remaining genome
+        mock_run_amrfinderplus_jobs.side_effect = run_jobs
+        telemetry_path = os.path.join(tmp, "telemetry.tsv")
+        amr_annotations, _, amr_genes, _ = _annotate(
+            AMRFinderPlusDatabaseDirFmt(),
+            sequences=self.mags,
+            resume_dir=resume_dir,
+            telemetry_path=telemetry_path,
+        )
+
+        jobs = mock_run_amrfinderplus_jobs.call_args.args[0]
+        self.assertEqual(len(jobs), 1)
+        self.assertIn("id2", jobs[0]["amr_annotations_path"])
+        for _id in ("id1", "id2"):
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(
+                        str(amr_annotations), "sample1", f"{_id}_amr_annotations.tsv"
+                    )
+                )
+            )
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(str(amr_genes), "sample1", f"{_id}_amr_genes.fasta")
+                )
+            )
+
+        # The genome of the first run is reported as resumed, not as cached
+        with open(telemetry_path) as f:
+            rows = [line.rstrip("\n").split("\t") for line in f]
+        rows = [dict(zip(rows[0], row)) for row in rows[1:]]
+        self.assertEqual(
+            [(row["id"], row["cached"], row["resumed"]) for row in rows],
+            [("id1", "False", "True"), ("id2", "False", "False")],
+        )
+        self.assertEqual(rows[1]["wall_time"], "1.000")
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path", "id2": "file_path"}},
+    )
+    @patch(
+        "q2_amrfinderplus.annotate._get_file_paths",
+        return_value=("dna_path", None, None),
+    )
+    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_jobs")
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    def test__annotate_failure_report(
+        self,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dict,
+    ):
+        failure_report_path = os.path.join(self.temp_dir.name, "failures.tsv")
+
+        def run_jobs(jobs, threads, cores=None, cache=None, failures=None):
+            failures.append((1, "AMRFinderPlus did not finish"))
+            return [{"wall_time": 1.0}, {"failed": True}]
+
+        mock_run_amrfinderplus_jobs.side_effect = run_jobs
+
+        # The run finishes and the failed genome is listed in the report
+        _annotate(
+            AMRFinderPlusDatabaseDirFmt(),
+            sequences=self.mags,
+            timeout=60,
+            retries=1,
+            failure_report_path=failure_report_path,
+        )
+
+        with open(failure_report_path) as f:
+            self.assertEqual(
+                f.read(),
+                "sample_id\tid\terror\nsample1\tid2\tAMRFinderPlus did not finish\n",
+            )
+        jobs = mock_run_amrfinderplus_jobs.call_args.args[0]
+        self.assertEqual(jobs[0]["timeout"], 60)
+        self.assertEqual(jobs[0]["retries"], 1)
+
+        # The run fails if all genomes failed
+        def run_jobs_fail(jobs, threads, cores=None, cache=None, failures=None):
+            failures.extend((i, "AMRFinderPlus failed") for i in range(len(jobs)))
+            return [{"failed": True}] * len(jobs)
+
+        mock_run_amrfinderplus_jobs.side_effect = run_jobs_fail
+        with self.assertRaisesRegex(Exception, "failed for all genomes"):
+            _annotate(
+                AMRFinderPlusDatabaseDirFmt(),
+                sequences=self.mags,
+                failure_report_path=failure_report_path,
+            )
+
+    @patch(
+        "q2_amrfinderplus.annotate._create_sample_dict",
+        return_value={"sample1": {"id1": "file_path", "id2": "file_path"}},
+    )
+    @patch("q2_amrfinderplus.annotate._get_file_paths")
+    @patch("q2_amrfinderplus.annotate._run_amrfinderplus_jobs")
+    @patch("q2_amrfinderplus.annotate._create_empty_files")
+    @patch("q2_amrfinderplus.annotate.KmerPrescreen")
+    def test__annotate_resume_prescreen(
+        self,
+        mock_prescreen,
+        mock_create_empty_files,
+        mock_run_amrfinderplus_jobs,
+        mock_get_file_paths,
+        mock_create_sample_dict,
+    ):
+        tmp = self.temp_dir.name
+        resume_dir = os.path.join(tmp, "resume")
+        for _id in ("id1", "id2"):
+            with open(os.path.join(tmp, f"{_id}.fasta"), "w") as f:
+                f.write(f">{_id}\nACGT\n")
+        mock_get_file_paths.side_effect = lambda *args: (
+            os.path.join(tmp, f"{args[3]}.fasta"),
+            None,
+            None,
+        )
+
+        def screen(jobs):
+            for job in jobs:
+                with open(job["amr_annotations_path"], "w") as f:
+                    f.write("header\n")
+                open(job["amr_genes_path"], "w").close()
+            return [True] * len(jobs)
+
+        mock_prescreen.return_value.screen.side_effect = screen
+        mock_run_amrfinderplus_jobs.return_value = []
+
+        _annotate(
+            AMRFinderPlusDatabaseDirFmt(),
+            sequences=self.mags,
+            prescreen=True,
+            resume_dir=resume_dir,
+        )
+
+        # Genomes skipped by the prescreen are not marked as completed
+        self.assertEqual(os.listdir(resume_dir), ["sample1"])
+        self.assertFalse(
+            any(
+                file_name.endswith(".done")
+                for file_name in os.listdir(os.path.join(resume_dir, "sample1"))
+            )
+        )
+
     @patch("q2_amrfinderplus.annotate._validate_inputs")
     def test_annotate_pipeline_mags(self, mock_validate_inputs):
         mock_action = MagicMock(
@@ -194,3 +720,50 @@ class TestAnnotate(TestPluginBase):
             call("types", "collate_proteins"),
             call("types", "partition_proteins"),
         ]
+
+    @patch("q2_amrfinderplus.annotate._validate_inputs")
+    def test_annotate_pipeline_partition_by_size(self, mock_validate_inputs):
+        mock_annotate = MagicMock(
+            return_value=("annotations", "all_mutations", "genes", "proteins")
+        )
+        mock_partition = MagicMock(
+            return_value=(ResultCollection({"1": "seqs_1", "2": "seqs_2"}),)
+        )
+        mock_action = MagicMock(
+            side_effect=[
+                mock_annotate,
+                lambda x: ("collated_annotations",),
+                lambda x: ("collated_genes",),
+                lambda x: ("collated_proteins",),
+                mock_partition,
+            ]
+        )
+
+        mock_ctx = MagicMock(get_action=mock_action)
+        annotate(
+            ctx=mock_ctx,
+            sequences=self.mags,
+            proteins=self.proteins,
+            loci=self.loci,
+            amrfinderplus_db=AMRFinderPlusDatabaseDirFmt(),
+            num_partitions=2,
+            partition_mode="bases",
+        )
+
+        # Only the sequences are partitioned, proteins and loci are passed on whole
+        assert mock_ctx.get_action.call_args_list == [
+            call("amrfinderplus", "_annotate"),
+            call("amrfinderplus", "collate_amrfinderplus_annotations"),
+            call("types", "collate_genes"),
+            call("types", "collate_proteins"),
+            call("amrfinderplus", "_partition_sample_data_mags_by_size"),
+        ]
+        mock_partition.assert_called_once_with(self.mags, 2, "bases")
+        self.assertEqual(mock_annotate.call_count, 2)
+        for annotate_call, seqs in zip(
+            mock_annotate.call_args_list, ["seqs_1", "seqs_2"]
+        ):
+            self.assertEqual(annotate_call.kwargs["sequences"], seqs)
+            self.assertIs(annotate_call.kwargs["proteins"], self.proteins)
+            self.assertIs(annotate_call.kwargs["loci"], self.loci)
+            self.assertNotIn("partition_mode", annotate_call.kwargs)
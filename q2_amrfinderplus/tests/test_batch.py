@@ -0,0 +1,213 @@
+import os
+from unittest.mock import patch
+
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.batch import (
+    _can_batch,
+    _merge_batch,
+    _run_amrfinderplus_batches,
+    _split_batch,
+)
+
+HEADER = "Protein id\tContig id\tStart\tStop\tStrand\tElement symbol\tMethod\n"
+
+
+class TestBatch(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = self.temp_dir.name
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def _job(self, name, dna_path=None, protein_path=None, gff_path=None):
+        return {
+            "dna_path": dna_path,
+            "protein_path": protein_path,
+            "gff_path": gff_path,
+            "organism": None,
+            "threads": 1,
+            "amr_annotations_path": os.path.join(self.tmp, f"{name}_amr.tsv"),
+            "amr_genes_path": os.path.join(self.tmp, f"{name}_genes.fasta"),
+            "amr_proteins_path": os.path.join(self.tmp, f"{name}_proteins.fasta"),
+            "amr_all_mutations_path": os.path.join(self.tmp, f"{name}_mut.tsv"),
+        }
+
+    def test_can_batch(self):
+        self.assertTrue(_can_batch(None, "prokka"))
+        self.assertTrue(_can_batch("loci", "prodigal"))
+        self.assertFalse(_can_batch("loci", "prokka"))
+
+    def test_merge_batch_fasta(self):
+        jobs = [
+            self._job("g1", dna_path=self._write("g1.fasta", ">contig1\nACGT\n")),
+            self._job("g2", dna_path=self._write("g2.fasta", ">contig1 x\nGG")),
+        ]
+        batch_dir = os.path.join(self.tmp, "batch")
+        os.mkdir(batch_dir)
+
+        batch_job = _merge_batch(jobs, batch_dir)
+
+        self.assertEqual(
+            self._read(batch_job["dna_path"]),
+            ">q2amr0_contig1\nACGT\n>q2amr1_contig1 x\nGG\n",
+        )
+        self.assertIsNone(batch_job["protein_path"])
+        self.assertEqual(batch_job["threads"], 1)
+        self.assertEqual(
+            batch_job["amr_annotations_path"],
+            os.path.join(batch_dir, "amr_annotations.tsv"),
+        )
+
+    def test_merge_batch_gff(self):
+        gff = (
+            "##gff-version 3\n"
+            "##sequence-region contig1 1 960\n"
+            "contig1\tProdigal_v2.6.3\tCDS\t1\t960\t.\t+\t0\tID=contig1_1;partial=00\n"
+        )
+        proteins = self._write("proteins.fasta", ">contig1_1\nMK\n")
+        jobs = [
+            self._job("g1", protein_path=proteins, gff_path=self._write("1.gff", gff)),
+            self._job("g2", protein_path=proteins, gff_path=self._write("2.gff", gff)),
+        ]
+        batch_dir = os.path.join(self.tmp, "batch")
+        os.mkdir(batch_dir)
+
+        batch_job = _merge_batch(jobs, batch_dir)
+
+        self.assertEqual(
+            self._read(batch_job["gff_path"]),
+            "##gff-version 3\n"
+            "##sequence-region q2amr0_contig1 1 960\n"
+            "q2amr0_contig1\tProdigal_v2.6.3\tCDS\t1\t960\t.\t+\t0\t"
+            "ID=q2amr0_contig1_1;partial=00\n"
+            "##sequence-region q2amr1_contig1 1 960\n"
+            "q2amr1_contig1\tProdigal_v2.6.3\tCDS\t1\t960\t.\t+\t0\t"
+            "ID=q2amr1_contig1_1;partial=00\n",
+        )
+        self.assertEqual(
+            self._read(batch_job["protein_path"]),
+            ">q2amr0_contig1_1\nMK\n>q2amr1_contig1_1\nMK\n",
+        )
+
+    def test_split_batch(self):
+        jobs = [
+            self._job("g1", dna_path="g1.fasta"),
+            self._job("g2", dna_path="g2.fasta"),
+            self._job("g3", dna_path="g3.fasta"),
+        ]
+        batch_job = self._job("batch", dna_path="batch.fasta")
+        self._write(
+            "batch_amr.tsv",
+            HEADER
+            + "NA\tq2amr0_contig1\t1\t9\t+\tstxA2\tEXACTX\n"
+            + "NA\tq2amr2_contig1\t1\t9\t+\tblaTEM\tEXACTX\n"
+            + "NA\tq2amr0_contig2\t1\t9\t-\tblaOXA\tBLASTX\n",
+        )
+        self._write(
+            "batch_genes.fasta",
+            ">q2amr0_contig1:1-9 stxA2\nATG\nAAA\n>q2amr2_contig1:1-9 blaTEM\nGGG\n",
+        )
+
+        _split_batch(jobs, batch_job)
+
+        self.assertEqual(
+            self._read(jobs[0]["amr_annotations_path"]),
+            HEADER
+            + "NA\tcontig1\t1\t9\t+\tstxA2\tEXACTX\n"
+            + "NA\tcontig2\t1\t9\t-\tblaOXA\tBLASTX\n",
+        )
+        self.assertEqual(self._read(jobs[1]["amr_annotations_path"]), HEADER)
+        self.assertEqual(
+            self._read(jobs[2]["amr_annotations_path"]),
+            HEADER + "NA\tcontig1\t1\t9\t+\tblaTEM\tEXACTX\n",
+        )
+        self.assertEqual(
+            self._read(jobs[0]["amr_genes_path"]), ">contig1:1-9 stxA2\nATG\nAAA\n"
+        )
+        self.assertEqual(self._read(jobs[1]["amr_genes_path"]), "")
+        self.assertEqual(
+            self._read(jobs[2]["amr_genes_path"]), ">contig1:1-9 blaTEM\nGGG\n"
+        )
+
+        # No protein or all mutations outputs for DNA input without organism
+        self.assertFalse(os.path.exists(jobs[0]["amr_proteins_path"]))
+        self.assertFalse(os.path.exists(jobs[0]["amr_all_mutations_path"]))
+
+    def test_split_batch_unassigned_line(self):
+        jobs = [self._job("g1", protein_path="g1.fasta")]
+        batch_job = self._job("batch", protein_path="batch.fasta")
+        self._write("batch_amr.tsv", HEADER + "p1\tNA\tNA\tNA\tNA\tstxA2\tEXACTP\n")
+
+        with self.assertRaisesRegex(ValueError, "could not be assigned"):
+            _split_batch(jobs, batch_job)
+
+    @patch("q2_amrfinderplus.batch._run_amrfinderplus_jobs")
+    def test_run_amrfinderplus_batches(self, mock_run_jobs):
+        jobs = [
+            self._job(f"g{i}", dna_path=self._write(f"g{i}.fasta", ">c\nA\n"))
+            for i in range(5)
+        ]
+
+        def run_jobs(batch_jobs, threads, cores, cache, failures):
+            for batch_job in batch_jobs:
+                self._write(batch_job["amr_annotations_path"], HEADER)
+            return [{"wall_time": 1.0}, None, {"wall_time": 2.0}]
+
+        mock_run_jobs.side_effect = run_jobs
+
+        usages = _run_amrfinderplus_batches(jobs, 2, threads=1, cores=4)
+
+        # Five genomes in batches of two result in three AMRFinderPlus runs
+        self.assertEqual(len(mock_run_jobs.call_args.args[0]), 3)
+        for job in jobs:
+            self.assertEqual(self._read(job["amr_annotations_path"]), HEADER)
+
+        # Genomes share the resource usage of their batch
+        self.assertEqual(
+            usages,
+            [
+                {"wall_time": 1.0, "batch": 0},
+                {"wall_time": 1.0, "batch": 0},
+                None,
+                None,
+                {"wall_time": 2.0, "batch": 2},
+            ],
+        )
+
+    @patch("q2_amrfinderplus.batch._run_amrfinderplus_jobs")
+    def test_run_amrfinderplus_batches_failures(self, mock_run_jobs):
+        jobs = [
+            self._job(f"g{i}", dna_path=self._write(f"g{i}.fasta", ">c\nA\n"))
+            for i in range(3)
+        ]
+
+        def run_jobs(batch_jobs, threads, cores, cache, failures):
+            self._write(batch_jobs[1]["amr_annotations_path"], HEADER)
+            failures.append((0, "AMRFinderPlus failed"))
+            return [{"failed": True}, {"wall_time": 1.0}]
+
+        mock_run_jobs.side_effect = run_jobs
+        failures = []
+
+        usages = _run_amrfinderplus_batches(
+            jobs, 2, threads=1, cores=4, failures=failures
+        )
+
+        # All genomes of the failed batch are recorded as failed
+        self.assertEqual(
+            failures, [(0, "AMRFinderPlus failed"), (1, "AMRFinderPlus failed")]
+        )
+        self.assertEqual(usages[:2], [{"failed": True, "batch": 0}] * 2)
+        self.assertFalse(os.path.exists(jobs[0]["amr_annotations_path"]))
+        self.assertEqual(self._read(jobs[2]["amr_annotations_path"]), HEADER)
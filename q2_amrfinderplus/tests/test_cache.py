@@ -0,0 +1,122 @@
+import os
+import time
+
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.cache import ResultCache
+
+
+class TestResultCache(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = self.temp_dir.name
+        self.cache_dir = os.path.join(self.tmp, "cache")
+        self.db = os.path.join(self.tmp, "db")
+        os.mkdir(self.db)
+        self._write(os.path.join(self.db, "version.txt"), "2024-01-31.1")
+        self._write(os.path.join(self.db, "database_format_version.txt"), "3.12")
+        self.params = {"organism": None, "plus": False, "threads": 4}
+        self.dna_path = os.path.join(self.tmp, "genome.fasta")
+        self._write(self.dna_path, ">contig1\nACGT\n")
+
+    def _write(self, path, content):
+        with open(path, "w") as f:
+            f.write(content)
+
+    def _job(self, name, dna_path=None):
+        out_dir = os.path.join(self.tmp, name)
+        os.makedirs(out_dir, exist_ok=True)
+        return {
+            "dna_path": dna_path or self.dna_path,
+            "protein_path": None,
+            "gff_path": None,
+            "organism": None,
+            "amr_annotations_path": os.path.join(out_dir, "amr_annotations.tsv"),
+            "amr_genes_path": os.path.join(out_dir, "amr_genes.fasta"),
+            "amr_proteins_path": os.path.join(out_dir, "amr_proteins.fasta"),
+            "amr_all_mutations_path": os.path.join(out_dir, "amr_all_mutations.tsv"),
+        }
+
+    def _run(self, job):
+        self._write(job["amr_annotations_path"], "annotations")
+        self._write(job["amr_genes_path"], "genes")
+
+    def test_store_and_fetch(self):
+        cache = ResultCache(self.cache_dir, self.db, self.params)
+        job = self._job("run1")
+
+        self.assertFalse(cache.fetch(job))
+        self._run(job)
+        cache.store(job)
+
+        job_2 = self._job("run2")
+        self.assertTrue(cache.fetch(job_2))
+        with open(job_2["amr_annotations_path"]) as f:
+            self.assertEqual(f.read(), "annotations")
+        with open(job_2["amr_genes_path"]) as f:
+            self.assertEqual(f.read(), "genes")
+
+        # Outputs that are not produced for DNA input are not restored
+        self.assertFalse(os.path.exists(job_2["amr_proteins_path"]))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.summary(), "Result cache: 1 hits, 1 misses.")
+
+    def test_store_missing_output(self):
+        cache = ResultCache(self.cache_dir, self.db, self.params)
+        job = self._job("run1")
+        self._write(job["amr_annotations_path"], "annotations")
+
+        # No entry is stored without the gene output of DNA input
+        cache.store(job)
+
+        self.assertFalse(os.path.exists(cache._entry_dir(cache.key(job))))
+        self.assertFalse(cache.fetch(self._job("run2")))
+
+    def test_key_depends_on_inputs_database_and_parameters(self):
+        cache = ResultCache(self.cache_dir, self.db, self.params)
+        job = self._job("run1")
+        key = cache.key(job)
+
+        # Same content in a different file gives the same key
+        other_path = os.path.join(self.tmp, "other.fasta")
+        self._write(other_path, ">contig1\nACGT\n")
+        self.assertEqual(cache.key(self._job("run2", other_path)), key)
+
+        # Different content
+        self._write(other_path, ">contig1\nACGA\n")
+        self.assertNotEqual(cache.key(self._job("run2", other_path)), key)
+
+        # Different parameters, threads are ignored
+        cache_plus = ResultCache(self.cache_dir, self.db, {**self.params, "plus": True})
+        self.assertNotEqual(cache_plus.key(job), key)
+        cache_threads = ResultCache(
+            self.cache_dir, self.db, {**self.params, "threads": 8}
+        )
+        self.assertEqual(cache_threads.key(job), key)
+
+        # Different database version
+        self._write(os.path.join(self.db, "version.txt"), "2025-01-31.1")
+        cache_db = ResultCache(self.cache_dir, self.db, self.params)
+        self.assertNotEqual(cache_db.key(job), key)
+
+    def test_evict_least_recently_used(self):
+        cache = ResultCache(self.cache_dir, self.db, self.params, max_size=30)
+        jobs = []
+        for i in range(3):
+            dna_path = os.path.join(self.tmp, f"genome{i}.fasta")
+            self._write(dna_path, f">contig{i}\nACGT\n")
+            job = self._job(f"run{i}", dna_path)
+            self._run(job)
+            cache.store(job)
+            entry_dir = cache._entry_dir(cache.key(job))
+            os.utime(entry_dir, (time.time() - 100 + i, time.time() - 100 + i))
+            jobs.append(job)
+
+        # Each entry has 16 bytes, only the most recent one fits into 30 bytes
+        cache.evict()
+
+        self.assertFalse(os.path.exists(cache._entry_dir(cache.key(jobs[0]))))
+        self.assertFalse(os.path.exists(cache._entry_dir(cache.key(jobs[1]))))
+        self.assertTrue(os.path.exists(cache._entry_dir(cache.key(jobs[2]))))
@@ -0,0 +1,98 @@
+import os
+from unittest.mock import patch
+
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.collate import collate_amrfinderplus_annotations
+from q2_amrfinderplus.types import (
+    AMRFinderPlusAnnotationsDirFmt,
+    AMRFinderPlusDatabaseDirFmt,
+)
+
+
+class TestCollate(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def test_collate_annotations_contigs(self):
+        # Set up the list with annotations objects to collate
+        annotations_1 = AMRFinderPlusDatabaseDirFmt(
+            path=self.get_data_path("annotations_contigs_1"), mode="r"
+        )
+        annotations_2 = AMRFinderPlusDatabaseDirFmt(
+            path=self.get_data_path("annotations_contigs_2"), mode="r"
+        )
+
+        # Run collate functions on the annotations
+        collate = collate_amrfinderplus_annotations([annotations_1, annotations_2])
+
+        for i in range(1, 5):
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(str(collate), f"sample{i}_amr_annotations.tsv")
+                )
+            )
+
+    def test_collate_annotations_mags(self):
+        # Set up the list with annotations objects to collate
+        annotations_1 = AMRFinderPlusDatabaseDirFmt(
+            path=self.get_data_path("annotations_mags_1"), mode="r"
+        )
+        annotations_2 = AMRFinderPlusDatabaseDirFmt(
+            path=self.get_data_path("annotations_mags_2"), mode="r"
+        )
+
+        # Run collate functions on the annotations
+        collate = collate_amrfinderplus_annotations([annotations_1, annotations_2])
+
+        for i in range(1, 3):
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(
+                        str(collate), f"sample{i}", f"mag{i}_amr_annotations.tsv"
+                    )
+                )
+            )
+
+    def test_collate_annotations_hardlinks(self):
+        annotations = AMRFinderPlusAnnotationsDirFmt(
+            path=self.get_data_path("annotations_mags_1"), mode="r"
+        )
+
+        collate = collate_amrfinderplus_annotations([annotations])
+
+        # Files on the same filesystem share their data with the partition
+        src = os.path.join(str(annotations), "sample1", "mag1_amr_annotations.tsv")
+        des = os.path.join(str(collate), "sample1", "mag1_amr_annotations.tsv")
+        if os.stat(src).st_dev == os.stat(des).st_dev:
+            self.assertTrue(os.path.samefile(src, des))
+
+    @patch("q2_amrfinderplus.utils._reflink", return_value=False)
+    @patch("os.link", side_effect=OSError("Invalid cross-device link"))
+    def test_collate_annotations_copy(self, mock_link, mock_reflink):
+        annotations = AMRFinderPlusAnnotationsDirFmt(
+            path=self.get_data_path("annotations_contigs_1"), mode="r"
+        )
+
+        collate = collate_amrfinderplus_annotations([annotations])
+
+        for i in range(1, 3):
+            file_name = f"sample{i}_amr_annotations.tsv"
+            with open(os.path.join(str(annotations), file_name)) as f:
+                exp = f.read()
+            with open(os.path.join(str(collate), file_name)) as f:
+                self.assertEqual(f.read(), exp)
+
+    def test_collate_annotations_collision(self):
+        annotations = AMRFinderPlusAnnotationsDirFmt(
+            path=self.get_data_path("annotations_mags_1"), mode="r"
+        )
+
+        with patch(
+            "q2_amrfinderplus.collate._link_or_copy"
+        ) as mock_link_or_copy, self.assertRaisesRegex(
+            ValueError, r"sample1/mag1_amr_annotations\.tsv"
+        ):
+            collate_amrfinderplus_annotations([annotations, annotations])
+
+        # No file is written if IDs collide
+        mock_link_or_copy.assert_not_called()
@@ -1,12 +1,17 @@
+import hashlib
 import os
 import subprocess
+import tarfile
 from unittest.mock import patch
 
 from qiime2.plugin.testing import TestPluginBase
 
 from q2_amrfinderplus.database import (
     _copy_all,
+    _find_database_dir,
+    _write_checksums,
     fetch_amrfinderplus_db,
+    import_amrfinderplus_db,
     run_amrfinder_fetch,
 )
 
@@ -51,3 +56,148 @@ class TestFetchAMRFinderPlusDB(TestPluginBase):
         _copy_all(os.path.join(tmp, "src"), os.path.join(tmp, "des"))
         self.assertTrue(os.path.exists(os.path.join(tmp, "des", "a")))
         self.assertFalse(os.path.exists(os.path.join(tmp, "des", "changes.txt")))
+
+    def test__write_checksums(self):
+        tmp = self.temp_dir.name
+        with open(os.path.join(tmp, "version.txt"), "w") as f:
+            f.write("2024-01-31.1\n")
+        with open(os.path.join(tmp, "AMRProt.fa"), "w") as f:
+            f.write(">a\nMK\n")
+
+        _write_checksums(tmp)
+
+        with open(os.path.join(tmp, "checksums.tsv")) as f:
+            self.assertEqual(
+                f.read(),
+                "AMRProt.fa\t"
+                + hashlib.sha256(b">a\nMK\n").hexdigest()
+                + "\nversion.txt\t"
+                + hashlib.sha256(b"2024-01-31.1\n").hexdigest()
+                + "\n",
+            )
+
+    def _write_files(self, dir_path, files):
+        os.makedirs(dir_path, exist_ok=True)
+        for file_name, content in files.items():
+            with open(os.path.join(dir_path, file_name), "w") as f:
+                f.write(content)
+
+    def test__copy_all_checksums(self):
+        tmp = self.temp_dir.name
+        self._write_files(os.path.join(tmp, "src"), {"a": "a", "README.md": "r"})
+        os.mkdir(os.path.join(tmp, "des"))
+
+        _copy_all(os.path.join(tmp, "src"), os.path.join(tmp, "des"))
+
+        with open(os.path.join(tmp, "des", "checksums.tsv")) as f:
+            self.assertEqual(f.read(), f"a\t{hashlib.sha256(b'a').hexdigest()}\n")
+
+    def test__copy_all_previous_db(self):
+        # Unchanged files are taken from the previous database
+        tmp = self.temp_dir.name
+        self._write_files(os.path.join(tmp, "src"), {"a": "a", "b": "new"})
+        self._write_files(os.path.join(tmp, "previous"), {"a": "a", "b": "old"})
+        _write_checksums(os.path.join(tmp, "previous"))
+        os.mkdir(os.path.join(tmp, "des"))
+
+        with patch("q2_amrfinderplus.database._link_or_copy") as mock_link:
+            _copy_all(
+                os.path.join(tmp, "src"),
+                os.path.join(tmp, "des"),
+                os.path.join(tmp, "previous"),
+            )
+
+        self.assertCountEqual(
+            [c.args for c in mock_link.call_args_list],
+            [
+                (os.path.join(tmp, "previous", "a"), os.path.join(tmp, "des", "a")),
+                (os.path.join(tmp, "src", "b"), os.path.join(tmp, "des", "b")),
+            ],
+        )
+
+
+class TestImportAMRFinderPlusDB(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def setUp(self):
+        super().setUp()
+        self.db_path = os.path.join(
+            os.path.dirname(__file__), "..", "types", "tests", "data", "database"
+        )
+        patcher = patch(
+            "q2_amrfinderplus.types._format._get_verified_dir",
+            return_value=os.path.join(self.temp_dir.name, "verified"),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_import_amrfinderplus_db_directory(self):
+        obs = import_amrfinderplus_db(self.db_path)
+
+        self.assertEqual(
+            sorted(os.listdir(str(obs))),
+            sorted(os.listdir(self.db_path) + ["checksums.tsv"]),
+        )
+        obs.validate()
+
+    def test_import_amrfinderplus_db_tarball(self):
+        tarball = os.path.join(self.temp_dir.name, "amrfinderplus_db.tar.gz")
+        with tarfile.open(tarball, "w:gz") as tar:
+            tar.add(self.db_path, arcname="data/2024-01-31.1")
+
+        obs = import_amrfinderplus_db(tarball)
+
+        self.assertEqual(
+            sorted(os.listdir(str(obs))),
+            sorted(os.listdir(self.db_path) + ["checksums.tsv"]),
+        )
+
+    def test_import_amrfinderplus_db_not_existing(self):
+        with self.assertRaisesRegex(ValueError, "does not exist"):
+            import_amrfinderplus_db(os.path.join(self.temp_dir.name, "missing"))
+
+    def test_import_amrfinderplus_db_no_tarball(self):
+        path = os.path.join(self.temp_dir.name, "database.txt")
+        with open(path, "w") as f:
+            f.write("not a tarball")
+
+        with self.assertRaisesRegex(ValueError, "neither a directory nor a tarball"):
+            import_amrfinderplus_db(path)
+
+    def test__find_database_dir_nested(self):
+        nested = os.path.join(self.temp_dir.name, "data", "2024-01-31.1")
+        os.makedirs(nested)
+        for file_name in ("version.txt", "AMRProt.fa"):
+            with open(os.path.join(nested, file_name), "w"):
+                pass
+
+        self.assertEqual(_find_database_dir(self.temp_dir.name), nested)
+
+    def _create_release(self, name, version):
+        path = os.path.join(self.temp_dir.name, "data", name)
+        os.makedirs(path)
+        with open(os.path.join(path, "version.txt"), "w") as f:
+            f.write(f"{version}\n")
+        with open(os.path.join(path, "AMRProt.fa"), "w"):
+            pass
+        return path
+
+    def test__find_database_dir_newest_release(self):
+        # Releases are compared by version, not by the directory name
+        self._create_release("2023-11-15.1", "2023-11-15.1")
+        newest = self._create_release("b", "2024-01-31.1")
+        self._create_release("c", "2024-01-31")
+
+        self.assertEqual(_find_database_dir(self.temp_dir.name), newest)
+
+    def test__find_database_dir_latest_link(self):
+        self._create_release("2023-11-15.1", "2023-11-15.1")
+        self._create_release("2024-01-31.1", "2024-01-31.1")
+        latest = os.path.join(self.temp_dir.name, "data", "latest")
+        os.symlink("2023-11-15.1", latest)
+
+        self.assertEqual(_find_database_dir(self.temp_dir.name), latest)
+
+    def test__find_database_dir_error(self):
+        with self.assertRaisesRegex(ValueError, "No AMRFinderPlus database"):
+            _find_database_dir(self.temp_dir.name)
@@ -0,0 +1,315 @@
+import os
+from unittest.mock import patch
+
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.dedup import (
+    ContigDeduplication,
+    ProteinDeduplication,
+    _can_deduplicate_contigs,
+    _can_deduplicate_proteins,
+    _read_fasta,
+    _sort_key,
+)
+
+HEADER = "Protein id\tContig id\tStart\tStop\tStrand\tElement symbol\tMethod\n"
+
+
+def _fake_amrfinderplus(jobs, threads, cores=None, cache=None, failures=None):
+    # Reports a hit for every protein starting with "MKK" and writes it to the
+    # protein output with a description
+    for job in jobs:
+        hits = [
+            (protein_id, sequence)
+            for protein_id, sequence in _read_fasta(job["protein_path"])
+            if sequence.startswith("MKK")
+        ]
+        with open(job["amr_annotations_path"], "w") as f:
+            f.write(HEADER)
+            for protein_id, _ in hits:
+                f.write(f"{protein_id}\tNA\tNA\tNA\tNA\tblaTEM\tEXACTP\n")
+        with open(job["amr_proteins_path"], "w") as f:
+            for protein_id, sequence in hits:
+                f.write(f">{protein_id} blaTEM beta-lactamase\n{sequence}\n")
+    return [{"wall_time": 1.0, "user_time": 2.0}] * len(jobs)
+
+
+def _fake_amrfinderplus_contigs(jobs, threads, cores=None, cache=None, failures=None):
+    # Reports two hits for every contig containing "GGGG", the second one on the
+    # reverse strand
+    for job in jobs:
+        with open(job["amr_annotations_path"], "w") as f, open(
+            job["amr_genes_path"], "w"
+        ) as genes:
+            f.write(HEADER)
+            for contig_id, sequence in _read_fasta(job["dna_path"]):
+                start = sequence.find("GGGG") + 1
+                if start:
+                    for strand, symbol in (("+", "blaTEM"), ("-", "sul1")):
+                        stop = start + 3
+                        f.write(f"NA\t{contig_id}\t{start}\t{stop}\t{strand}\t{symbol}")
+                        f.write("\tBLASTX\n")
+                        genes.write(f">{contig_id}:{start}-{stop} {symbol}\nGGGG\n")
+                        start += 10
+    return [{"wall_time": 1.0}] * len(jobs)
+
+
+class TestProteinDeduplication(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = self.temp_dir.name
+
+    def _job(self, name, proteins):
+        protein_path = os.path.join(self.tmp, f"{name}.faa")
+        with open(protein_path, "w") as f:
+            f.write(proteins)
+        return {
+            "dna_path": None,
+            "protein_path": protein_path,
+            "gff_path": None,
+            "organism": None,
+            "threads": 1,
+            "amr_annotations_path": os.path.join(self.tmp, f"{name}_amr.tsv"),
+            "amr_genes_path": os.path.join(self.tmp, f"{name}_genes.fasta"),
+            "amr_proteins_path": os.path.join(self.tmp, f"{name}_proteins.fasta"),
+            "amr_all_mutations_path": os.path.join(self.tmp, f"{name}_mut.tsv"),
+        }
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    @patch(
+        "q2_amrfinderplus.dedup._run_amrfinderplus_jobs",
+        side_effect=_fake_amrfinderplus,
+    )
+    def test_run(self, mock_run):
+        jobs = [
+            self._job("g1", ">p2 desc\nMKKLV\n>p1\nMAAA\nGG\n"),
+            self._job("g2", ">x1\nMKK\nLV\n>x2\nMAAAGG\n>x0\nMKKLV\n"),
+            self._job("g3", ">y1\nMAAAGG\n"),
+        ]
+        deduplication = ProteinDeduplication(jobs)
+
+        usages = deduplication.run(threads=2, cores=4, cache="cache")
+
+        # Only the two unique proteins are annotated, split into one chunk per
+        # concurrent AMRFinderPlus process
+        chunk_jobs = mock_run.call_args.args[0]
+        self.assertEqual(len(chunk_jobs), 2)
+        self.assertEqual(chunk_jobs[0]["threads"], 1)
+        self.assertEqual(
+            mock_run.call_args.kwargs,
+            {"threads": 2, "cores": 4, "cache": "cache", "failures": None},
+        )
+        self.assertEqual(deduplication.num_unique, 2)
+        self.assertEqual(deduplication.sequence_chunks, [0, 1])
+        self.assertIn("2 of 6 proteins in 3 genomes", deduplication.summary())
+
+        # The chunks run concurrently
+        self.assertEqual(usages, [{"wall_time": 1.0, "user_time": 4.0, "batch": 0}] * 3)
+
+        self.assertEqual(
+            self._read(jobs[0]["amr_annotations_path"]),
+            HEADER + "p2\tNA\tNA\tNA\tNA\tblaTEM\tEXACTP\n",
+        )
+        self.assertEqual(
+            self._read(jobs[1]["amr_annotations_path"]),
+            HEADER
+            + "x0\tNA\tNA\tNA\tNA\tblaTEM\tEXACTP\n"
+            + "x1\tNA\tNA\tNA\tNA\tblaTEM\tEXACTP\n",
+        )
+        self.assertEqual(self._read(jobs[2]["amr_annotations_path"]), HEADER)
+
+        self.assertEqual(
+            self._read(jobs[1]["amr_proteins_path"]),
+            ">x0 blaTEM beta-lactamase\nMKKLV\n>x1 blaTEM beta-lactamase\nMKKLV\n",
+        )
+        self.assertEqual(self._read(jobs[2]["amr_proteins_path"]), "")
+
+    @patch("q2_amrfinderplus.dedup._run_amrfinderplus_jobs", return_value=[None])
+    def test_run_cached(self, mock_run):
+        # Outputs restored from the cache are split like the outputs of a run
+        jobs = [self._job("g1", ">p1\nMAAA\n"), self._job("g2", ">p1\nMAAA\n")]
+        deduplication = ProteinDeduplication(jobs)
+
+        with patch.object(deduplication, "_split") as mock_split:
+            usages = deduplication.run(threads=1)
+
+        mock_split.assert_called_once()
+        self.assertEqual(usages, [None, None])
+
+    def test_merge(self):
+        # Unique sequences are written to the chunk with the fewest characters
+        jobs = [
+            self._job("g1", ">p1\nMAAAAAAA\n>p2\nMK\n"),
+            self._job("g2", ">x1\nMK\n>x2\nMLL\n>x3\nMAAAAAAA\n"),
+        ]
+        deduplication = ProteinDeduplication(jobs)
+
+        chunk_jobs = deduplication._merge(self.tmp, num_chunks=2)
+
+        self.assertEqual(
+            [list(_read_fasta(job["protein_path"])) for job in chunk_jobs],
+            [
+                [("q2amrseq0", "MAAAAAAA")],
+                [("q2amrseq1", "MK"), ("q2amrseq2", "MLL")],
+            ],
+        )
+        self.assertEqual(deduplication.occurrences[0], [(0, "p1"), (1, "x3")])
+
+    def test_merge_empty_chunks(self):
+        # Chunks without sequences are not run
+        deduplication = ProteinDeduplication([self._job("g1", ">p1\nMK\n")])
+
+        self.assertEqual(len(deduplication._merge(self.tmp, num_chunks=4)), 1)
+
+    @patch("q2_amrfinderplus.dedup._run_amrfinderplus_jobs")
+    def test_run_failures(self, mock_run):
+        jobs = [
+            self._job("g1", ">p1\nMKKAAAAAAA\n"),
+            self._job("g2", ">x1\nMKKL\n>x2\nMKKAAAAAAA\n"),
+            self._job("g3", ">y1\nMKKL\n"),
+        ]
+
+        def run_jobs(chunk_jobs, threads, cores=None, cache=None, failures=None):
+            # The chunk with the first protein fails
+            usages = _fake_amrfinderplus(chunk_jobs[1:], threads)
+            failures.append((0, "AMRFinderPlus failed"))
+            return [{"failed": True}] + usages
+
+        mock_run.side_effect = run_jobs
+        deduplication = ProteinDeduplication(jobs)
+        failures = []
+
+        usages = deduplication.run(threads=1, cores=2, failures=failures)
+
+        # Genomes with a protein in the failed chunk fail and get no outputs
+        self.assertEqual(
+            failures, [(0, "AMRFinderPlus failed"), (1, "AMRFinderPlus failed")]
+        )
+        self.assertEqual(usages[0], {"failed": True, "batch": 0})
+        self.assertEqual(usages[2], {"wall_time": 1.0, "user_time": 2.0, "batch": 0})
+        self.assertFalse(os.path.exists(jobs[0]["amr_annotations_path"]))
+        self.assertFalse(os.path.exists(jobs[1]["amr_proteins_path"]))
+        self.assertEqual(
+            self._read(jobs[2]["amr_annotations_path"]),
+            HEADER + "y1\tNA\tNA\tNA\tNA\tblaTEM\tEXACTP\n",
+        )
+
+    @patch("q2_amrfinderplus.dedup._run_amrfinderplus_jobs")
+    def test_run_all_failed(self, mock_run):
+        # Genomes without sequences also fail if no chunk was annotated
+        jobs = [self._job("g1", ">p1\nMKK\n"), self._job("g2", "")]
+
+        def run_jobs(chunk_jobs, threads, cores=None, cache=None, failures=None):
+            failures.append((0, "AMRFinderPlus failed"))
+            return [{"failed": True}]
+
+        mock_run.side_effect = run_jobs
+        failures = []
+
+        ProteinDeduplication(jobs).run(threads=1, failures=failures)
+
+        self.assertEqual([index for index, _ in failures], [0, 1])
+
+    def test_unassigned_output(self):
+        jobs = [self._job("g1", ">p1\nMAAA\n")]
+        deduplication = ProteinDeduplication(jobs)
+        chunk_jobs = deduplication._merge(self.tmp)
+        with open(chunk_jobs[0]["amr_annotations_path"], "w") as f:
+            f.write(HEADER + "q2amrseq7\tNA\tNA\tNA\tNA\tblaTEM\tEXACTP\n")
+
+        with self.assertRaisesRegex(ValueError, "q2amrseq7"):
+            deduplication._split(chunk_jobs)
+
+    @patch(
+        "q2_amrfinderplus.dedup._run_amrfinderplus_jobs",
+        side_effect=_fake_amrfinderplus_contigs,
+    )
+    def test_run_contigs(self, mock_run):
+        plasmid = "ACGTGGGGAC" + "T" * 20
+        jobs = [
+            self._job("g1", f">chr1\n{'A' * 50}\n>p1\n{plasmid}\n"),
+            self._job("g2", f">c9\n{plasmid.lower()}\n>c10\n{plasmid}\n>c2\nCC\n"),
+        ]
+        for job in jobs:
+            job["dna_path"], job["protein_path"] = job["protein_path"], None
+        deduplication = ContigDeduplication(jobs)
+
+        deduplication.run(threads=1)
+
+        # Contigs are compared case-insensitively
+        self.assertEqual(deduplication.num_unique, 3)
+        self.assertIn("3 of 5 contigs in 2 genomes", deduplication.summary())
+
+        self.assertEqual(
+            self._read(jobs[0]["amr_annotations_path"]),
+            HEADER
+            + "NA\tp1\t5\t8\t+\tblaTEM\tBLASTX\n"
+            + "NA\tp1\t15\t18\t-\tsul1\tBLASTX\n",
+        )
+        # Rows are sorted by contig ID and position
+        self.assertEqual(
+            self._read(jobs[1]["amr_annotations_path"]),
+            HEADER
+            + "NA\tc10\t5\t8\t+\tblaTEM\tBLASTX\n"
+            + "NA\tc10\t15\t18\t-\tsul1\tBLASTX\n"
+            + "NA\tc9\t5\t8\t+\tblaTEM\tBLASTX\n"
+            + "NA\tc9\t15\t18\t-\tsul1\tBLASTX\n",
+        )
+        self.assertEqual(
+            self._read(jobs[1]["amr_genes_path"]),
+            ">c10:5-8 blaTEM\nGGGG\n>c10:15-18 sul1\nGGGG\n"
+            ">c9:5-8 blaTEM\nGGGG\n>c9:15-18 sul1\nGGGG\n",
+        )
+
+    def test_merge_contigs_lowercase(self):
+        # Contigs that only differ in case are annotated once, with the sequence
+        # of the first genome that contains them
+        jobs = [
+            self._job("g1", ">c1\nacgtGGGG\n"),
+            self._job("g2", ">c7\nACGTGGGG\n>c8\nacgtgggg\n"),
+        ]
+        for job in jobs:
+            job["dna_path"], job["protein_path"] = job["protein_path"], None
+        deduplication = ContigDeduplication(jobs)
+
+        chunk_jobs = deduplication._merge(self.tmp)
+
+        self.assertEqual(
+            list(_read_fasta(chunk_jobs[0]["dna_path"])), [("q2amrseq0", "acgtGGGG")]
+        )
+        self.assertEqual(deduplication.occurrences, [[(0, "c1"), (1, "c7"), (1, "c8")]])
+
+    def test_can_deduplicate_contigs(self):
+        self.assertTrue(_can_deduplicate_contigs("mags", None, None))
+        self.assertFalse(_can_deduplicate_contigs("mags", "proteins", None))
+        self.assertFalse(_can_deduplicate_contigs("mags", None, "Escherichia"))
+        self.assertFalse(_can_deduplicate_contigs(None, "proteins", None))
+
+    def test_sort_key(self):
+        rows = [["c1", "100"], ["c1", "20"], ["c10", "5"]]
+
+        self.assertEqual(
+            sorted(rows, key=lambda fields: _sort_key(fields, [0, 1])),
+            [["c1", "20"], ["c1", "100"], ["c10", "5"]],
+        )
+
+    def test_can_deduplicate_proteins(self):
+        self.assertTrue(_can_deduplicate_proteins(None, "proteins", None))
+        self.assertFalse(_can_deduplicate_proteins("mags", "proteins", None))
+        self.assertFalse(_can_deduplicate_proteins(None, "proteins", "Escherichia"))
+        self.assertFalse(_can_deduplicate_proteins("mags", None, None))
+
+    def test_read_fasta(self):
+        fasta_fp = os.path.join(self.tmp, "seqs.fasta")
+        with open(fasta_fp, "w") as f:
+            f.write(">a desc\nMK\nLV\n\n>b\nGG")
+
+        self.assertEqual(list(_read_fasta(fasta_fp)), [("a", "MKLV"), ("b", "GG")])
+        self.assertEqual(
+            list(_read_fasta(fasta_fp, full_header=True))[0], ("a desc", "MKLV")
+        )
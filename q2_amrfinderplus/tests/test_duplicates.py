@@ -0,0 +1,113 @@
+import hashlib
+import os
+from unittest.mock import patch
+
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.duplicates import (
+    _copy_duplicate_results,
+    _duplicate_report,
+    _find_duplicate_genomes,
+    _hash_file,
+)
+
+
+class TestDuplicates(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = self.temp_dir.name
+
+    def _job(self, name, dna=None, protein=None):
+        job = {
+            "dna_path": None,
+            "protein_path": None,
+            "gff_path": None,
+            "organism": None,
+            "amr_annotations_path": os.path.join(self.tmp, f"{name}_amr.tsv"),
+            "amr_genes_path": os.path.join(self.tmp, f"{name}_genes.fasta"),
+            "amr_proteins_path": os.path.join(self.tmp, f"{name}_proteins.fasta"),
+            "amr_all_mutations_path": os.path.join(self.tmp, f"{name}_mut.tsv"),
+        }
+        for input_type, content in (("dna_path", dna), ("protein_path", protein)):
+            if content is not None:
+                job[input_type] = os.path.join(self.tmp, f"{name}_{input_type}")
+                with open(job[input_type], "w") as f:
+                    f.write(content)
+        return job
+
+    def test_find_duplicate_genomes(self):
+        jobs = [
+            self._job("g1", dna=">c1\nACGT\n"),
+            self._job("g2", dna=">c1\nACGA\n"),
+            self._job("g3", dna=">c1\nACGT\n"),
+            self._job("g4", dna=">c1\nACGTACGT\n"),
+            self._job("g5", dna=">c1\nACGA\n"),
+            self._job("g6", dna=">c1\nACGT\n", protein=">p1\nMK\n"),
+        ]
+
+        self.assertEqual(
+            _find_duplicate_genomes(jobs, threads=2), [None, None, 0, None, 1, None]
+        )
+
+    def test_find_duplicate_genomes_unique_sizes(self):
+        # Files are only hashed if their size matches another genome
+        jobs = [self._job("g1", dna=">c1\nA\n"), self._job("g2", dna=">c1\nAC\n")]
+
+        with patch("q2_amrfinderplus.duplicates._hash_file") as mock_hash:
+            self.assertEqual(_find_duplicate_genomes(jobs), [None, None])
+
+        mock_hash.assert_not_called()
+
+    def test_hash_file(self):
+        file_fp = os.path.join(self.tmp, "file")
+        content = os.urandom(10000)
+        with open(file_fp, "wb") as f:
+            f.write(content)
+
+        self.assertEqual(
+            _hash_file(file_fp, chunk_size=4096),
+            hashlib.blake2b(content, digest_size=32).hexdigest(),
+        )
+
+    def test_hash_file_empty(self):
+        file_fp = os.path.join(self.tmp, "file")
+        open(file_fp, "w").close()
+
+        self.assertEqual(
+            _hash_file(file_fp), hashlib.blake2b(b"", digest_size=32).hexdigest()
+        )
+
+    def test_copy_duplicate_results(self):
+        jobs = [self._job("g1", dna="x"), self._job("g2", dna="x")]
+        for path_arg in ("amr_annotations_path", "amr_genes_path"):
+            with open(jobs[0][path_arg], "w") as f:
+                f.write(path_arg)
+
+        _copy_duplicate_results(jobs, [None, 0])
+
+        for path_arg in ("amr_annotations_path", "amr_genes_path"):
+            with open(jobs[1][path_arg]) as f:
+                self.assertEqual(f.read(), path_arg)
+        self.assertTrue(
+            os.path.samefile(
+                jobs[0]["amr_annotations_path"], jobs[1]["amr_annotations_path"]
+            )
+        )
+        # Outputs that are not expected for the inputs are not created
+        self.assertFalse(os.path.exists(jobs[1]["amr_proteins_path"]))
+        self.assertFalse(os.path.exists(jobs[1]["amr_all_mutations_path"]))
+
+    def test_duplicate_report(self):
+        genome_ids = [("s1", "g1"), ("s1", "g2"), ("s2", "g1")]
+
+        self.assertEqual(
+            _duplicate_report(genome_ids, [None, None, 0]),
+            "Duplicate genomes: 1 of 3 genomes are identical to another genome and "
+            "were not annotated again:\n  s2/g1 is identical to s1/g1",
+        )
+        self.assertEqual(
+            _duplicate_report(genome_ids, [None] * 3),
+            "Duplicate genomes: none found.",
+        )
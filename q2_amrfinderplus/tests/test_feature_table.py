@@ -1,7 +1,11 @@
+from unittest.mock import patch
+
+import biom
+import numpy as np
 import pandas as pd
 from qiime2.plugin.testing import TestPluginBase
 
-from q2_amrfinderplus.feature_table import create_feature_table
+from q2_amrfinderplus.feature_table import _encode, create_feature_table
 from q2_amrfinderplus.types import AMRFinderPlusAnnotationsDirFmt
 
 
@@ -21,25 +25,83 @@ class TestFetchAMRFinderPlusDB(TestPluginBase):
             },
             index=["contig01", "contig02", "contig03", "contig08", "contig13"],
         )
-        self.exp_gene_table.index.name = "Contig id"
 
     def test_create_feature_table_gene(self):
-        exp = self.exp_gene_table.copy()
-        exp.columns.name = "Gene symbol"
+        exp = self.exp_gene_table
         annotations = AMRFinderPlusAnnotationsDirFmt(
             self.get_data_path("annotations_contigs_1"), mode="r"
         )
-        obs = create_feature_table(annotations, level="gene")
-        pd.testing.assert_frame_equal(exp, obs)
+        obs = _load_table(create_feature_table(annotations, level="gene"))
+        self.assertEqual(_to_table(exp), obs)
 
     def test_create_feature_table_gene_new_header(self):
-        exp = self.exp_gene_table.copy()
-        exp.columns.name = "Element symbol"
+        exp = self.exp_gene_table
         annotations = AMRFinderPlusAnnotationsDirFmt(
             self.get_data_path("annotations_contigs_new_header"), mode="r"
         )
-        obs = create_feature_table(annotations, level="gene")
-        pd.testing.assert_frame_equal(exp, obs)
+        obs = _load_table(create_feature_table(annotations, level="gene"))
+        self.assertEqual(_to_table(exp), obs)
+
+    @patch("q2_amrfinderplus.feature_table.COMPACT_INTERVAL", 1)
+    def test_create_feature_table_gene_compacted(self):
+        exp = self.exp_gene_table
+        annotations = AMRFinderPlusAnnotationsDirFmt(
+            self.get_data_path("annotations_contigs_1"), mode="r"
+        )
+        obs = _load_table(create_feature_table(annotations, level="gene"))
+        self.assertEqual(_to_table(exp), obs)
+
+    def test_create_feature_table_duplicates_across_files(self):
+        annotations = AMRFinderPlusAnnotationsDirFmt()
+        src = self.get_data_path("annotations_contigs_1/sample2_amr_annotations.tsv")
+        for sample in ("sample1", "sample2"):
+            with open(src) as f_in, open(
+                annotations.path / f"{sample}_amr_annotations.tsv", "w"
+            ) as f_out:
+                f_out.write(f_in.read())
+
+        obs = _load_table(create_feature_table(annotations, level="gene"))
+
+        # Identical hits are only counted once
+        exp = pd.DataFrame(
+            {"arsR": [0, 1], "blaTEM": [1, 0], "emrD3": [0, 1]},
+            index=["contig08", "contig13"],
+        )
+        self.assertEqual(_to_table(exp), obs)
+
+    def test_encode(self):
+        vocabulary = {"b": 0}
+
+        obs = _encode(pd.Series(["a", "b", None, "a"]), vocabulary)
+
+        np.testing.assert_array_equal(obs, [1, 0, -1, 1])
+        self.assertEqual(vocabulary, {"b": 0, "a": 1})
+
+    def test_encode_unused_categories(self):
+        vocabulary = {}
+        values = pd.Series(["a", "b", "c"], dtype="category")
+
+        obs = _encode(values[values != "b"], vocabulary)
+
+        np.testing.assert_array_equal(obs, [0, 1])
+        self.assertEqual(vocabulary, {"a": 0, "c": 1})
+
+    def test_create_feature_table_dropped_hits(self):
+        # Contigs and features only occurring in hits without feature or contig
+        # are not part of the table
+        annotations = AMRFinderPlusAnnotationsDirFmt()
+        with open(annotations.path / "sample1_amr_annotations.tsv", "w") as f:
+            f.write("Contig id\tStart\tStop\tStrand\tElement symbol\n")
+            f.write("contig1\t1\t10\t+\tblaTEM\n")
+            f.write("contig2\t1\t10\t+\tNA\n")
+            f.write("NA\t1\t10\t+\tsul1\n")
+
+        obs = _load_table(create_feature_table(annotations, level="gene"))
+
+        self.assertEqual(obs.ids(axis="sample").tolist(), ["contig1"])
+        self.assertEqual(obs.ids(axis="observation").tolist(), ["blaTEM"])
+        self.assertTrue((obs.sum(axis="observation") > 0).all())
+        self.assertTrue((obs.sum(axis="sample") > 0).all())
 
     def test_create_feature_table_class(self):
         exp = pd.DataFrame(
@@ -50,13 +112,11 @@ class TestFetchAMRFinderPlusDB(TestPluginBase):
             },
             index=["contig01", "contig02", "contig03", "contig08", "contig13"],
         )
-        exp.index.name = "Contig id"
-        exp.columns.name = "Class"
         annotations = AMRFinderPlusAnnotationsDirFmt(
             self.get_data_path("annotations_contigs_1"), mode="r"
         )
-        obs = create_feature_table(annotations, level="class")
-        pd.testing.assert_frame_equal(exp, obs)
+        obs = _load_table(create_feature_table(annotations, level="class"))
+        self.assertEqual(_to_table(exp), obs)
 
     def test_create_feature_table_sub_class(self):
         exp = pd.DataFrame(
@@ -68,13 +128,11 @@ class TestFetchAMRFinderPlusDB(TestPluginBase):
             },
             index=["contig01", "contig02", "contig03", "contig08", "contig13"],
         )
-        exp.index.name = "Contig id"
-        exp.columns.name = "Subclass"
         annotations = AMRFinderPlusAnnotationsDirFmt(
             self.get_data_path("annotations_contigs_1"), mode="r"
         )
-        obs = create_feature_table(annotations, level="subclass")
-        pd.testing.assert_frame_equal(exp, obs)
+        obs = _load_table(create_feature_table(annotations, level="subclass"))
+        self.assertEqual(_to_table(exp), obs)
 
     def test_key_error(self):
         annotations = AMRFinderPlusAnnotationsDirFmt(
@@ -89,3 +147,14 @@ class TestFetchAMRFinderPlusDB(TestPluginBase):
             pass
         with self.assertRaisesRegex(ValueError, "File is empty"):
             create_feature_table(annotations)
+
+
+def _load_table(feature_table):
+    return biom.load_table(str(feature_table))
+
+
+def _to_table(df):
+    # Features are observations and contigs are samples of the table
+    return biom.Table(
+        df.T.values, observation_ids=list(df.columns), sample_ids=list(df.index)
+    )
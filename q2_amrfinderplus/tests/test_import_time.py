@@ -0,0 +1,128 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.tests.benchmarks.test_benchmarks import BENCHMARK_ENV
+
+# Modules that QIIME 2 loads before any plugin. They are imported before the plugin
+# so that their import time is not attributed to it.
+FRAMEWORK_MODULES = (
+    "numpy",
+    "pandas",
+    "qiime2.plugin",
+    "q2_types.feature_data",
+    "q2_types.feature_table",
+    "q2_types.genome_data",
+    "q2_types.per_sample_sequences",
+    "q2_types.sample_data",
+)
+
+# Maximum time in seconds to import the plugin on top of the framework modules. The
+# measured baseline is about 15 ms. Times depend on the load of the machine, so the
+# budgets are only checked with the benchmarks.
+IMPORT_TIME_BUDGET = 0.05
+
+# Maximum time in seconds spent in the modules of this plugin itself. The measured
+# baseline is about 6 ms.
+PLUGIN_IMPORT_TIME_BUDGET = 0.02
+
+# Modules that the modules of this plugin only import when an action or
+# transformer runs
+LAZY_MODULES = ("biom", "scipy", "pyarrow", "h5py")
+
+
+def _import_times(module, preload=()):
+    """
+    Imports a module in a new interpreter with "-X importtime" and returns a list of
+    (name, self time, cumulative time, importer) tuples in import order, where the
+    times are in seconds and importer is the name of the module whose import
+    triggered this one (None for top-level imports).
+    """
+    statements = [f"import {name}" for name in (*preload, module)]
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "; ".join(statements)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # A module is printed after all modules it imports, which are indented one
+    # level deeper, so the importer of a module is the next one printed above it
+    times = []
+    pending = []
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        depth = len(name) - len(name.lstrip())
+        while pending and pending[-1][0] > depth:
+            times[pending.pop()[1]][3] = name.strip()
+        times.append([name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, None])
+        pending.append((depth, len(times) - 1))
+    return [tuple(entry) for entry in times]
+
+
+class TestImportTime(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.times = _import_times(
+            "q2_amrfinderplus.plugin_setup", preload=FRAMEWORK_MODULES
+        )
+        # Without preloading, so that modules first imported by the plugin show up
+        cls.all_times = _import_times("q2_amrfinderplus.plugin_setup")
+
+    @unittest.skipUnless(
+        os.environ.get(BENCHMARK_ENV), f"Set {BENCHMARK_ENV}=1 to check the budget."
+    )
+    def test_import_time_budget(self):
+        cumulative = next(
+            cumulative
+            for name, _, cumulative, _ in self.times
+            if name == "q2_amrfinderplus.plugin_setup"
+        )
+        self.assertLessEqual(
+            cumulative,
+            IMPORT_TIME_BUDGET,
+            f"Importing the plugin took {cumulative:.3f} s.",
+        )
+
+    @unittest.skipUnless(
+        os.environ.get(BENCHMARK_ENV), f"Set {BENCHMARK_ENV}=1 to check the budget."
+    )
+    def test_plugin_import_time_budget(self):
+        plugin_time = sum(
+            self_time
+            for name, self_time, _, _ in self.times
+            if name.startswith("q2_amrfinderplus")
+        )
+        self.assertLessEqual(
+            plugin_time,
+            PLUGIN_IMPORT_TIME_BUDGET,
+            f"The modules of the plugin took {plugin_time:.3f} s to import.",
+        )
+
+    def test_lazy_modules_not_imported(self):
+        # q2-types and pandas may load some of these modules themselves, so only
+        # imports made by the modules of this plugin count
+        for name, _, _, importer in self.all_times:
+            if name.split(".")[0] in LAZY_MODULES and importer is not None:
+                self.assertFalse(
+                    importer.startswith("q2_amrfinderplus"),
+                    f"{importer} imports {name} at the top level.",
+                )
+
+    def test_import_times_importer(self):
+        times = _import_times("json")
+        importers = {name: importer for name, _, _, importer in times}
+        self.assertIsNone(importers["json"])
+        self.assertEqual(importers["json.decoder"], "json")
+        self.assertEqual(importers["json.scanner"], "json.decoder")
@@ -0,0 +1,100 @@
+import os
+
+import pandas as pd
+from q2_types.feature_data_mag import MAGSequencesDirFmt
+from q2_types.genome_data import ProteinsDirectoryFormat
+from q2_types.per_sample_sequences import ContigSequencesDirFmt, MultiMAGSequencesDirFmt
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.partition import (
+    _bin_pack,
+    _get_file_weight,
+    _partition_contigs_by_size,
+    _partition_feature_data_mags_by_size,
+    _partition_proteins_by_size,
+    _partition_sample_data_mags_by_size,
+)
+
+
+class TestPartitionBySize(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def test_bin_pack(self):
+        units = {"a": 10, "b": 1, "c": 6, "d": 5, "e": 2}
+
+        obs = _bin_pack(units, 2)
+
+        # a + e = 12 and c + d + b = 12
+        self.assertEqual(obs, [["a", "e"], ["b", "c", "d"]])
+
+    def test_bin_pack_drops_empty_partitions(self):
+        obs = _bin_pack({"a": 1}, 3)
+
+        self.assertEqual(obs, [["a"]])
+
+    def test_get_file_weight(self):
+        fp = os.path.join(self.temp_dir.name, "seqs.fasta")
+        with open(fp, "w") as f:
+            f.write(">seq1 description\nACGT\nAC\n>seq2\nGG\n")
+
+        self.assertEqual(_get_file_weight(fp, "bytes"), 35)
+        self.assertEqual(_get_file_weight(fp, "bases"), 8)
+
+    def test_partition_contigs_by_size(self):
+        contigs = ContigSequencesDirFmt(self.get_data_path("minimal_contigs"), "r")
+
+        obs = _partition_contigs_by_size(contigs, num_partitions=2)
+
+        self.assertEqual(len(obs), 2)
+        self.assertEqual(
+            sorted(os.listdir(str(obs[1])) + os.listdir(str(obs[2]))),
+            ["sample1_contigs.fasta", "sample2_contigs.fasta"],
+        )
+
+    def test_partition_contigs_by_size_too_many_partitions(self):
+        contigs = ContigSequencesDirFmt(self.get_data_path("minimal_contigs"), "r")
+
+        with self.assertWarnsRegex(UserWarning, "into 2 partitions"):
+            obs = _partition_contigs_by_size(contigs, num_partitions=5, weight="bases")
+
+        self.assertEqual(len(obs), 2)
+
+    def test_partition_sample_data_mags_by_size(self):
+        mags = MultiMAGSequencesDirFmt(
+            self.get_data_path("minimal_sample_data_mags"), "r"
+        )
+
+        obs = _partition_sample_data_mags_by_size(mags, num_partitions=2)
+
+        self.assertEqual(len(obs), 2)
+        for partition in obs.values():
+            samples = [
+                entry for entry in os.listdir(str(partition)) if entry != "MANIFEST"
+            ]
+            self.assertEqual(len(samples), 1)
+
+            # The manifest only lists the sample of this partition
+            manifest = pd.read_csv(os.path.join(str(partition), "MANIFEST"))
+            self.assertEqual(manifest["sample-id"].tolist(), samples)
+            self.assertTrue(
+                os.path.exists(os.path.join(str(partition), samples[0], "mag1.fasta"))
+            )
+
+    def test_partition_feature_data_mags_by_size(self):
+        mags = MAGSequencesDirFmt(self.get_data_path("minimal_feature_data_mag"), "r")
+
+        obs = _partition_feature_data_mags_by_size(mags)
+
+        self.assertEqual(len(obs), 2)
+
+    def test_partition_proteins_by_size(self):
+        proteins = ProteinsDirectoryFormat(
+            self.get_data_path("proteins_per_sample"), "r"
+        )
+
+        obs = _partition_proteins_by_size(proteins, num_partitions=1)
+
+        self.assertEqual(len(obs), 1)
+        self.assertTrue(
+            os.path.exists(os.path.join(str(obs[1]), "sample1", "genome1.fasta"))
+        )
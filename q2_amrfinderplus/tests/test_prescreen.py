@@ -0,0 +1,206 @@
+import os
+import random
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import numpy as np
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.prescreen import (
+    ANNOTATION_HEADERS,
+    KmerPrescreen,
+    _annotation_header,
+    _iter_sequences,
+    _kmers,
+    _read_sequences,
+)
+
+
+def _reverse_complement(sequence):
+    return sequence[::-1].translate(bytes.maketrans(b"ACGT", b"TGCA"))
+
+
+class TestKmerPrescreen(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = self.temp_dir.name
+        self.db = os.path.join(self.tmp, "db")
+        shutil.copytree(self.get_data_path("minimal_database"), self.db)
+
+        # The index is cached in a temporary cache directory
+        env_patcher = patch.dict(
+            os.environ, {"XDG_CACHE_HOME": os.path.join(self.tmp, "cache")}
+        )
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+
+        rng = random.Random(42)
+        self.random_dna = "".join(rng.choices("ACGT", k=5000))
+        self.random_protein = "".join(rng.choices("ACDEFGHIKLMNPQRSTVWY", k=2000))
+        self.stx_dna = _read_sequences(os.path.join(self.db, "AMR_CDS.fa"))
+        self.stx_dna = self.stx_dna.decode().strip("*")
+        self.stx_protein = _read_sequences(os.path.join(self.db, "AMRProt.fa"))
+        self.stx_protein = self.stx_protein.decode().strip("*").split("*")[0]
+
+    def _job(self, name, dna=None, protein=None):
+        job = {
+            "dna_path": None,
+            "protein_path": None,
+            "gff_path": None,
+            "amr_annotations_path": os.path.join(self.tmp, f"{name}_amr.tsv"),
+            "amr_genes_path": os.path.join(self.tmp, f"{name}_genes.fasta"),
+            "amr_proteins_path": os.path.join(self.tmp, f"{name}_proteins.fasta"),
+            "amr_all_mutations_path": None,
+        }
+        for input_type, sequence in (("dna_path", dna), ("protein_path", protein)):
+            if sequence is not None:
+                job[input_type] = os.path.join(self.tmp, f"{name}_{input_type}.fasta")
+                with open(job[input_type], "w") as f:
+                    f.write(f">seq1\n{sequence[:60]}\n{sequence[60:]}\n>seq2\nACGT\n")
+        return job
+
+    def test_screen_dna(self):
+        jobs = [
+            self._job("amr", dna=self.random_dna + self.stx_dna.upper()),
+            self._job(
+                "reverse",
+                dna=_reverse_complement(self.stx_dna.upper().encode()).decode(),
+            ),
+            self._job("empty", dna=self.random_dna),
+        ]
+        prescreen = KmerPrescreen(self.db, min_hits=10)
+
+        skipped = prescreen.screen(jobs)
+
+        self.assertEqual(skipped, [False, False, True])
+        self.assertEqual(prescreen.skipped, 1)
+        self.assertIn("1 of 3 genomes", prescreen.summary())
+
+        # Skipped genomes get outputs as written by AMRFinderPlus without hits
+        with open(jobs[2]["amr_annotations_path"]) as f:
+            self.assertEqual(f.read(), "\t".join(ANNOTATION_HEADERS["4"]) + "\n")
+        self.assertEqual(os.path.getsize(jobs[2]["amr_genes_path"]), 0)
+        self.assertFalse(os.path.exists(jobs[2]["amr_proteins_path"]))
+        self.assertFalse(os.path.exists(jobs[0]["amr_annotations_path"]))
+
+    def test_screen_proteins(self):
+        jobs = [
+            self._job("amr", protein=self.random_protein + self.stx_protein),
+            self._job("empty", protein=self.random_protein),
+        ]
+        prescreen = KmerPrescreen(self.db, min_hits=10)
+
+        self.assertEqual(prescreen.screen(jobs), [False, True])
+
+        # Without contigs there are no position columns
+        with open(jobs[1]["amr_annotations_path"]) as f:
+            header = f.read().rstrip("\n").split("\t")
+        self.assertNotIn("Contig id", header)
+        self.assertEqual(header[0], "Protein id")
+        self.assertEqual(os.path.getsize(jobs[1]["amr_proteins_path"]), 0)
+
+    def test_screen_proteins_gff(self):
+        job = self._job("empty", protein=self.random_protein)
+        job["gff_path"] = os.path.join(self.tmp, "empty.gff")
+        open(job["gff_path"], "w").close()
+        prescreen = KmerPrescreen(self.db, min_hits=10)
+
+        self.assertEqual(prescreen.screen([job]), [True])
+
+        # Proteins with GFF files get the position columns
+        with open(job["amr_annotations_path"]) as f:
+            self.assertEqual(f.read(), "\t".join(ANNOTATION_HEADERS["4"]) + "\n")
+
+    def test_screen_min_hits(self):
+        # Part of the gene only shares some k-mers with the database
+        job = self._job("partial", dna=self.random_dna + self.stx_dna[:40])
+        prescreen = KmerPrescreen(self.db, min_hits=10)
+
+        self.assertEqual(prescreen.hits(job), 16)
+        self.assertEqual(prescreen.screen([job]), [False])
+
+        prescreen = KmerPrescreen(self.db, min_hits=17)
+        self.assertEqual(prescreen.screen([job]), [True])
+
+    def test_screen_max_workers(self):
+        job = self._job("empty", dna=self.random_dna)
+        prescreen = KmerPrescreen(self.db, max_workers=2)
+
+        with patch(
+            "q2_amrfinderplus.prescreen.ThreadPoolExecutor",
+            wraps=ThreadPoolExecutor,
+        ) as mock_executor:
+            prescreen.screen([job])
+
+        mock_executor.assert_called_once_with(max_workers=2)
+
+    def test_iter_sequences(self):
+        # Chunks overlap, so that they contain the same k-mers as the sequences
+        job = self._job("amr", dna=self.random_dna + self.stx_dna.upper())
+
+        chunks = list(_iter_sequences(job["dna_path"], overlap=24, chunk_size=100))
+
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        np.testing.assert_array_equal(
+            np.unique(np.concatenate([_kmers(chunk, "dna") for chunk in chunks])),
+            _kmers(_read_sequences(job["dna_path"]), "dna"),
+        )
+
+    def test_index_cached(self):
+        KmerPrescreen(self.db)
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp, "cache"))), 1)
+
+        with patch("q2_amrfinderplus.prescreen._kmers") as mock_kmers:
+            prescreen = KmerPrescreen(self.db)
+
+        mock_kmers.assert_not_called()
+        self.assertGreater(len(prescreen.index["dna"]), 0)
+        self.assertGreater(len(prescreen.index["protein"]), 0)
+
+    def test_index_missing_source(self):
+        # Nothing is skipped if the database has no sequences to build an index
+        os.remove(os.path.join(self.db, "AMR_CDS.fa"))
+        prescreen = KmerPrescreen(self.db)
+
+        self.assertEqual(
+            prescreen.screen([self._job("x", dna=self.random_dna)]), [False]
+        )
+
+    def test_kmers_canonical(self):
+        sequence = self.random_dna[:200].encode()
+
+        obs = _kmers(sequence, "dna")
+
+        self.assertEqual(len(obs), 176)
+        np.testing.assert_array_equal(obs, _kmers(_reverse_complement(sequence), "dna"))
+        np.testing.assert_array_equal(obs, _kmers(sequence.lower(), "dna"))
+
+    def test_kmers_invalid_characters(self):
+        # Windows with invalid characters or across sequences are left out
+        sequence = ("A" * 30 + "N" + "C" * 30 + "*" + "G" * 10).encode()
+
+        self.assertEqual(len(_kmers(sequence, "dna")), 2)
+        self.assertEqual(len(_kmers(b"MKLV", "protein")), 0)
+
+    def test_read_sequences(self):
+        fasta_fp = os.path.join(self.tmp, "seqs.fasta")
+        with open(fasta_fp, "w") as f:
+            f.write(">a desc\nACG\nTT\r\n>b\nGG\n")
+
+        self.assertEqual(_read_sequences(fasta_fp), b"*ACGTT*GG")
+
+    def test_annotation_header_version_3(self):
+        with open(os.path.join(self.db, "database_format_version.txt"), "w") as f:
+            f.write("3.12.0\n")
+
+        self.assertEqual(
+            _annotation_header(self.db, positional=True),
+            list(ANNOTATION_HEADERS["3"]),
+        )
+        self.assertEqual(
+            _annotation_header(self.db, positional=False)[:2],
+            ["Protein identifier", "Gene symbol"],
+        )
@@ -0,0 +1,174 @@
+import os
+from unittest.mock import MagicMock
+
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.cache import ResultCache
+from q2_amrfinderplus.resume import ResumeState
+
+
+class TestResumeState(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = self.temp_dir.name
+        self.resume_dir = os.path.join(self.tmp, "resume")
+        self.output_dir = os.path.join(self.tmp, "output")
+        os.makedirs(os.path.join(self.output_dir, "sample1"))
+
+        self.dna_path = os.path.join(self.tmp, "genome1.fasta")
+        with open(self.dna_path, "w") as f:
+            f.write(">contig1\nACGT\n")
+
+        self.db = self.get_data_path("minimal_database")
+        self.params = {"organism": None, "plus": False}
+
+    def _job(self):
+        return {
+            "dna_path": self.dna_path,
+            "protein_path": None,
+            "gff_path": None,
+            "organism": None,
+            "amr_annotations_path": os.path.join(
+                self.output_dir, "sample1", "genome1_amr_annotations.tsv"
+            ),
+            "amr_genes_path": os.path.join(
+                self.output_dir, "sample1", "genome1_amr_genes.fasta"
+            ),
+            "amr_proteins_path": os.path.join(
+                self.output_dir, "sample1", "genome1_amr_proteins.fasta"
+            ),
+            "amr_all_mutations_path": os.path.join(
+                self.output_dir, "sample1", "genome1_amr_all_mutations.tsv"
+            ),
+        }
+
+    def _state(self, **kwargs):
+        state = ResumeState(self.resume_dir, self.db, self.params, **kwargs)
+        output_job = self._job()
+        return state, state.redirect(output_job, "sample1", "genome1"), output_job
+
+    def _write_outputs(self, job):
+        for path_arg in ("amr_annotations_path", "amr_genes_path"):
+            with open(job[path_arg], "w") as f:
+                f.write(path_arg)
+
+    def test_redirect(self):
+        _, job, output_job = self._state()
+
+        self.assertEqual(
+            job["amr_annotations_path"],
+            os.path.join(self.resume_dir, "sample1", "genome1_amr_annotations.tsv"),
+        )
+        self.assertEqual(job["dna_path"], output_job["dna_path"])
+        self.assertNotIn("marker_path", job)
+
+    def test_resume(self):
+        state, job, output_job = self._state()
+        self.assertFalse(state.is_complete(job))
+
+        self._write_outputs(job)
+        state.mark_complete(job)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.resume_dir, "sample1", "genome1.done"))
+        )
+
+        # A new run with the same inputs finds the completed genome
+        state, job, output_job = self._state()
+        self.assertTrue(state.is_complete(job))
+        self.assertIn("1 genomes", state.summary())
+
+        state.publish(job, output_job)
+        with open(output_job["amr_genes_path"]) as f:
+            self.assertEqual(f.read(), "amr_genes_path")
+        self.assertFalse(os.path.exists(output_job["amr_proteins_path"]))
+
+    def test_resume_changed_input(self):
+        state, job, _ = self._state()
+        self._write_outputs(job)
+        state.mark_complete(job)
+
+        with open(self.dna_path, "a") as f:
+            f.write(">contig2\nGG\n")
+        state, job, _ = self._state()
+
+        # The stale marker is removed
+        self.assertFalse(state.is_complete(job))
+        self.assertFalse(
+            os.path.exists(os.path.join(self.resume_dir, "sample1", "genome1.done"))
+        )
+
+    def test_resume_changed_parameters(self):
+        state, job, _ = self._state()
+        self._write_outputs(job)
+        state.mark_complete(job)
+
+        self.params["plus"] = True
+        state, job, _ = self._state()
+
+        self.assertFalse(state.is_complete(job))
+
+    def test_resume_missing_output(self):
+        state, job, _ = self._state()
+        self._write_outputs(job)
+        state.mark_complete(job)
+        os.remove(job["amr_genes_path"])
+
+        state, job, _ = self._state()
+
+        self.assertFalse(state.is_complete(job))
+
+    def test_resume_corrupt_marker(self):
+        state, job, _ = self._state()
+        self._write_outputs(job)
+        with open(os.path.join(self.resume_dir, "sample1", "genome1.done"), "w") as f:
+            f.write("{")
+
+        self.assertFalse(state.is_complete(job))
+
+    def test_store_and_fetch(self):
+        cache = MagicMock()
+        cache.fetch.return_value = False
+        state, job, _ = self._state(cache=cache)
+        self._write_outputs(job)
+
+        self.assertFalse(state.fetch(job))
+        state.store(job)
+
+        cache.store.assert_called_once_with(job)
+        self.assertTrue(self._state()[0].is_complete(job))
+
+    def test_fetch_from_cache(self):
+        cache = MagicMock()
+        cache.fetch.return_value = True
+        state, job, _ = self._state(cache=cache)
+        self._write_outputs(job)
+
+        self.assertTrue(state.fetch(job))
+        self.assertTrue(
+            os.path.exists(os.path.join(self.resume_dir, "sample1", "genome1.done"))
+        )
+
+    def test_rerun_does_not_change_cache(self):
+        # The outputs of the first run are hardlinks of the cache entry
+        cache_dir = os.path.join(self.tmp, "cache")
+        cache = ResultCache(cache_dir, self.db, self.params)
+        state, job, _ = self._state(cache=cache)
+        self._write_outputs(job)
+        state.store(job)
+
+        # A rerun with other parameters removes the outputs before rewriting them
+        self.params["plus"] = True
+        state, job, _ = self._state(cache=cache)
+        self.assertFalse(state.is_complete(job))
+        self.assertFalse(os.path.exists(job["amr_annotations_path"]))
+        with open(job["amr_annotations_path"], "w") as f:
+            f.write("rerun")
+
+        self.params["plus"] = False
+        entry_dir = cache._entry_dir(
+            ResultCache(cache_dir, self.db, self.params).key(job)
+        )
+        with open(os.path.join(entry_dir, "amr_annotations.tsv")) as f:
+            self.assertEqual(f.read(), "amr_annotations_path")
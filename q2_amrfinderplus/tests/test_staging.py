@@ -0,0 +1,126 @@
+import os
+from unittest.mock import patch
+
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.staging import DatabaseStaging, _is_running
+
+
+class TestDatabaseStaging(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = self.temp_dir.name
+        self.staging_dir = os.path.join(self.tmp, "staging")
+        self.db = self._create_db("db", "2024-01-31.1")
+
+    def _create_db(self, name, version, content="MKLV"):
+        db = os.path.join(self.tmp, name)
+        os.mkdir(db)
+        with open(os.path.join(db, "version.txt"), "w") as f:
+            f.write(f"{version}\n")
+        with open(os.path.join(db, "AMRProt.fa"), "w") as f:
+            f.write(f">prot1\n{content}\n")
+        return db
+
+    def test_stage(self):
+        staging = DatabaseStaging(self.staging_dir)
+
+        with staging.stage(self.db) as local_db:
+            self.assertEqual(os.path.dirname(local_db), self.staging_dir)
+            self.assertTrue(os.path.basename(local_db).startswith("2024-01-31.1-"))
+            self.assertEqual(
+                sorted(os.listdir(local_db)), ["AMRProt.fa", "version.txt"]
+            )
+            self.assertFalse(
+                os.path.samefile(
+                    os.path.join(local_db, "AMRProt.fa"),
+                    os.path.join(self.db, "AMRProt.fa"),
+                )
+            )
+
+        # No temporary directories or references are left
+        self.assertEqual(
+            [e for e in os.listdir(self.staging_dir) if e.startswith(".tmp")], []
+        )
+        self.assertEqual(
+            os.listdir(os.path.join(self.staging_dir, ".refs", staging.key(self.db))),
+            [],
+        )
+
+    def test_stage_reuses_copy(self):
+        staging = DatabaseStaging(self.staging_dir)
+        with staging.stage(self.db):
+            pass
+
+        with patch.object(DatabaseStaging, "_copy") as mock_copy:
+            with staging.stage(self.db) as local_db:
+                self.assertTrue(os.path.exists(local_db))
+
+        mock_copy.assert_not_called()
+
+    def test_key_manifest(self):
+        # Databases with the same version and different manifests are separate
+        staging = DatabaseStaging(self.staging_dir)
+        db2 = self._create_db("db2", "2024-01-31.1")
+        with open(os.path.join(self.db, "checksums.tsv"), "w") as f:
+            f.write("AMRProt.fa\ta\n")
+        with open(os.path.join(db2, "checksums.tsv"), "w") as f:
+            f.write("AMRProt.fa\tb\n")
+
+        self.assertNotEqual(staging.key(self.db), staging.key(db2))
+
+    def test_key_without_manifest(self):
+        staging = DatabaseStaging(self.staging_dir)
+        db2 = self._create_db("db2", "2024-01-31.1", content="MKLVMKLV")
+
+        self.assertNotEqual(staging.key(self.db), staging.key(db2))
+        self.assertEqual(staging.key(self.db), staging.key(self.db))
+
+    def test_evict(self):
+        staging = DatabaseStaging(self.staging_dir, max_size=10)
+        db2 = self._create_db("db2", "2024-02-01.1")
+
+        with staging.stage(self.db) as local_db:
+            # The database in use is kept although the cache is too large
+            with staging.stage(db2) as local_db2:
+                pass
+            self.assertTrue(os.path.exists(local_db))
+            self.assertFalse(os.path.exists(local_db2))
+
+        self.assertFalse(os.path.exists(local_db))
+
+    def test_evict_stale_references(self):
+        # References of processes that are not running do not prevent eviction
+        staging = DatabaseStaging(self.staging_dir, max_size=0)
+        with patch.object(DatabaseStaging, "evict"):
+            with staging.stage(self.db) as local_db:
+                pass
+        ref_dir = os.path.join(self.staging_dir, ".refs", staging.key(self.db))
+        with open(os.path.join(ref_dir, "999999999-abc"), "w"):
+            pass
+
+        with patch("q2_amrfinderplus.staging._is_running", return_value=False):
+            staging.evict()
+
+        self.assertFalse(os.path.exists(local_db))
+        self.assertEqual(os.listdir(ref_dir), [])
+
+    def test_stage_copy_error(self):
+        staging = DatabaseStaging(self.staging_dir)
+
+        with patch("shutil.copyfile", side_effect=OSError("No space left")):
+            with self.assertRaisesRegex(OSError, "No space left"):
+                with staging.stage(self.db):
+                    pass
+
+        self.assertEqual(
+            [e for e in os.listdir(self.staging_dir) if not e.startswith(".")], []
+        )
+        self.assertEqual(
+            [e for e in os.listdir(self.staging_dir) if e.startswith(".tmp")], []
+        )
+
+    def test__is_running(self):
+        self.assertTrue(_is_running(os.getpid()))
@@ -0,0 +1,126 @@
+import os
+
+import pandas as pd
+from qiime2.plugin.testing import TestPluginBase
+
+from q2_amrfinderplus.telemetry import (
+    FAILURE_REPORT_COLUMNS,
+    TELEMETRY_COLUMNS,
+    _write_failure_report,
+    _write_telemetry,
+)
+
+
+class TestTelemetry(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = self.temp_dir.name
+        self.telemetry_path = os.path.join(self.tmp, "telemetry", "runs.tsv")
+        self.jobs = []
+        for i, size in enumerate([10, 20]):
+            dna_path = os.path.join(self.tmp, f"genome{i}.fasta")
+            with open(dna_path, "w") as f:
+                f.write("A" * size)
+            self.jobs.append(
+                {"dna_path": dna_path, "protein_path": None, "gff_path": None}
+            )
+        self.genome_ids = [("sample1", "genome0"), ("sample1", "genome1")]
+        self.usages = [
+            {
+                "wall_time": 1.23456,
+                "user_time": 2.5,
+                "system_time": 0.25,
+                "max_rss": 1024,
+            },
+            None,
+        ]
+
+    def test_write_telemetry(self):
+        _write_telemetry(self.telemetry_path, self.genome_ids, self.jobs, self.usages)
+
+        obs = pd.read_csv(self.telemetry_path, sep="\t", dtype=str)
+        self.assertEqual(list(obs.columns), list(TELEMETRY_COLUMNS))
+        self.assertEqual(
+            obs.iloc[0].drop("batch").tolist(),
+            ["sample1", "genome0", "10", "False", "False", "False", "False", "False"]
+            + ["1.235", "2.500", "0.250", "1024"],
+        )
+        self.assertTrue(obs["batch"].isna().all())
+
+        # Cached genomes have no resource usage
+        self.assertEqual(obs.iloc[1]["cached"], "True")
+        self.assertEqual(obs.iloc[1]["input_size"], "20")
+        self.assertTrue(obs.iloc[1][["wall_time", "max_rss"]].isna().all())
+
+    def test_write_telemetry_append(self):
+        _write_telemetry(
+            self.telemetry_path, self.genome_ids[:1], self.jobs[:1], self.usages[:1]
+        )
+        _write_telemetry(
+            self.telemetry_path,
+            self.genome_ids[1:],
+            self.jobs[1:],
+            [{**self.usages[0], "batch": 3}],
+        )
+
+        # The header is only written once
+        obs = pd.read_csv(self.telemetry_path, sep="\t", dtype=str)
+        self.assertEqual(obs["id"].tolist(), ["genome0", "genome1"])
+        self.assertEqual(obs["batch"].tolist()[1], "3")
+
+    def test_write_telemetry_skipped(self):
+        _write_telemetry(
+            self.telemetry_path, self.genome_ids[:1], self.jobs[:1], [{"skipped": True}]
+        )
+
+        obs = pd.read_csv(self.telemetry_path, sep="\t", dtype=str)
+        self.assertEqual(obs.loc[0, "skipped"], "True")
+        self.assertEqual(obs.loc[0, "cached"], "False")
+        self.assertTrue(pd.isna(obs.loc[0, "wall_time"]))
+
+    def test_write_telemetry_resumed(self):
+        _write_telemetry(
+            self.telemetry_path, self.genome_ids[:1], self.jobs[:1], [{"resumed": True}]
+        )
+
+        # Genomes completed by a previous run are not cache hits
+        obs = pd.read_csv(self.telemetry_path, sep="\t", dtype=str)
+        self.assertEqual(
+            obs.loc[0, ["cached", "resumed", "skipped", "duplicate"]].tolist(),
+            ["False", "True", "False", "False"],
+        )
+        self.assertTrue(pd.isna(obs.loc[0, "wall_time"]))
+
+    def test_write_telemetry_duplicate(self):
+        _write_telemetry(
+            self.telemetry_path,
+            self.genome_ids[:1],
+            self.jobs[:1],
+            [{"duplicate": True}],
+        )
+
+        obs = pd.read_csv(self.telemetry_path, sep="\t", dtype=str)
+        self.assertEqual(
+            obs.loc[0, ["cached", "resumed", "skipped", "duplicate"]].tolist(),
+            ["False", "False", "False", "True"],
+        )
+
+    def test_write_failure_report(self):
+        failure_report_path = os.path.join(self.tmp, "failures.tsv")
+        _write_failure_report(
+            failure_report_path, self.genome_ids[:1], ["AMRFinderPlus\nfailed\t(1)"]
+        )
+        _write_failure_report(failure_report_path, self.genome_ids[1:], ["failed"])
+
+        # Whitespace in errors is collapsed so that every failure is one row
+        obs = pd.read_csv(failure_report_path, sep="\t", dtype=str)
+        self.assertEqual(list(obs.columns), list(FAILURE_REPORT_COLUMNS))
+        self.assertEqual(
+            obs.values.tolist(),
+            [
+                ["sample1", "genome0", "AMRFinderPlus failed (1)"],
+                ["sample1", "genome1", "failed"],
+            ],
+        )
@@ -1,6 +1,7 @@
 import os
 import subprocess
-from unittest.mock import call, patch
+import time
+from unittest.mock import MagicMock, call, patch
 
 from q2_types.feature_data_mag import MAGSequencesDirFmt
 from q2_types.genome_data import (
@@ -11,19 +12,23 @@ from q2_types.genome_data import (
 from q2_types.per_sample_sequences import ContigSequencesDirFmt, MultiMAGSequencesDirFmt
 from qiime2.plugin.testing import TestPluginBase
 
-from q2_amrfinderplus.types import (
-    AMRFinderPlusAnnotationsDirFmt,
-    AMRFinderPlusDatabaseDirFmt,
-)
+from q2_amrfinderplus.types import AMRFinderPlusAnnotationsDirFmt
 from q2_amrfinderplus.utils import (
     EXTERNAL_CMD_WARNING,
     _create_empty_files,
     _create_sample_dict,
     _create_sample_dirs,
     _get_file_paths,
+    _get_input_size,
+    _get_num_partitions,
+    _is_memory_error,
+    _job_outputs,
+    _link_or_copy,
+    _prefetch_database,
+    _prefetch_file,
     _run_amrfinderplus_analyse,
+    _run_amrfinderplus_jobs,
     _validate_inputs,
-    collate_amrfinderplus_annotations,
     colorify,
     run_command,
 )
@@ -32,44 +37,87 @@ from q2_amrfinderplus.utils import (
 class TestRunCommand(TestPluginBase):
     package = "q2_amrfinderplus.tests"
 
-    @patch("subprocess.run")
     @patch("builtins.print")
-    def test_run_command_verbose(self, mock_print, mock_subprocess_run):
-        # Mock command and working directory
-        cmd = ["echo", "Hello"]
-        cwd = "/test/directory"
+    def test_run_command_verbose(self, mock_print):
+        cmd = ["true"]
 
         # Run the function with verbose=True
-        run_command(cmd, cwd=cwd, verbose=True)
+        usage = run_command(cmd, cwd=self.temp_dir.name, verbose=True)
 
-        # Check if subprocess.run was called with the correct arguments
-        mock_subprocess_run.assert_called_once_with(cmd, check=True, cwd=cwd, stderr=-1)
+        # Check if the resource usage of the command is returned
+        self.assertEqual(
+            set(usage), {"wall_time", "user_time", "system_time", "max_rss"}
+        )
+        self.assertGreaterEqual(usage["wall_time"], 0)
+        self.assertGreater(usage["max_rss"], 0)
 
         # Check if the correct print statements were called
         mock_print.assert_has_calls(
             [
                 call(EXTERNAL_CMD_WARNING),
                 call("\nCommand:", end=" "),
-                call("echo Hello", end="\n\n"),
+                call("true", end="\n\n"),
             ]
         )
 
-    @patch("subprocess.run")
+    @patch("subprocess.Popen")
+    @patch("os.wait4", return_value=(1, 0, MagicMock(ru_maxrss=2)))
     @patch("builtins.print")
-    def test_run_command_non_verbose(self, mock_print, mock_subprocess_run):
+    def test_run_command_non_verbose(self, mock_print, mock_wait4, mock_popen):
         # Mock command and working directory
         cmd = ["echo", "Hello"]
         cwd = "/test/directory"
 
         # Run the function with verbose=False
-        run_command(cmd, cwd=cwd, verbose=False)
+        usage = run_command(cmd, cwd=cwd, verbose=False)
 
-        # Check if subprocess.run was called with the correct arguments
-        mock_subprocess_run.assert_called_once_with(cmd, check=True, cwd=cwd, stderr=-1)
+        # Check if the process was started with the correct arguments
+        mock_popen.assert_called_once_with(cmd, cwd=cwd, stderr=-1)
+        mock_wait4.assert_called_once_with(mock_popen.return_value.pid, 0)
+        self.assertEqual(usage["max_rss"], 2048)
 
         # Ensure no print statements were made
         mock_print.assert_not_called()
 
+    def test_run_command_error(self):
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            run_command(["sh", "-c", "echo failed >&2; exit 3"], verbose=False)
+
+        self.assertEqual(cm.exception.returncode, 3)
+        self.assertEqual(cm.exception.stderr, b"failed\n")
+
+    def test_run_command_timeout(self):
+        # The whole process group is killed, including subprocesses
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            run_command(["sh", "-c", "sleep 30; true"], verbose=False, timeout=1)
+
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_run_command_timeout_after_exit(self):
+        # The timer fires after the process exited but before it was reaped
+        wait4 = os.wait4
+
+        def delayed_wait4(pid, options):
+            time.sleep(1.5)
+            return wait4(pid, options)
+
+        with patch("q2_amrfinderplus.utils.os.wait4", side_effect=delayed_wait4):
+            usage = run_command(["true"], verbose=False, timeout=1)
+
+        self.assertGreater(usage["wall_time"], 1)
+
+    @patch("q2_amrfinderplus.utils._kill_process_group")
+    @patch("q2_amrfinderplus.utils.threading.Timer")
+    def test_run_command_timeout_after_reap(self, mock_timer, mock_kill):
+        # The process group of a reaped process is not killed, its ID may be reused
+        run_command(["true"], verbose=False, timeout=1)
+        _, kill = mock_timer.call_args.args
+        kill()
+
+        mock_timer.return_value.cancel.assert_called_once()
+        mock_kill.assert_not_called()
+
 
 class TestRunAMRFinderPlusAnalyse(TestPluginBase):
     package = "q2_amrfinderplus.tests"
@@ -130,6 +178,7 @@ class TestRunAMRFinderPlusAnalyse(TestPluginBase):
                 "prodigal",
                 "--report_common",
             ],
+            timeout=None,
         )
 
     @patch("q2_amrfinderplus.utils.run_command")
@@ -161,6 +210,7 @@ class TestRunAMRFinderPlusAnalyse(TestPluginBase):
                 "--ident_min",
                 "-1",
             ],
+            timeout=None,
         )
 
     @patch("q2_amrfinderplus.utils.run_command")
@@ -221,6 +271,238 @@ class TestRunAMRFinderPlusAnalyse(TestPluginBase):
                 amr_annotations_path="mock_annotations_path",
             )
 
+    def _analyse(self, **kwargs):
+        return _run_amrfinderplus_analyse(
+            amrfinderplus_db="mock_db",
+            dna_path=None,
+            protein_path=None,
+            gff_path=None,
+            organism=None,
+            plus=False,
+            ident_min=None,
+            curated_ident=False,
+            coverage_min=None,
+            translation_table=None,
+            annotation_format=None,
+            report_common=False,
+            amr_annotations_path="mock_annotations_path",
+            **kwargs,
+        )
+
+    @patch("builtins.print")
+    @patch("q2_amrfinderplus.utils.run_command")
+    def test_run_amrfinderplus_analyse_memory_retry(self, mock_run_command, _):
+        results = [
+            subprocess.CalledProcessError(returncode=-9, cmd="amrfinder", stderr=b""),
+            subprocess.CalledProcessError(
+                returncode=1, cmd="amrfinder", stderr=b"std::bad_alloc"
+            ),
+            {"wall_time": 1.0},
+        ]
+        threads = []
+
+        def run(cmd, timeout):
+            threads.append(cmd[cmd.index("--threads") + 1])
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        mock_run_command.side_effect = run
+
+        usage = self._analyse(threads=8, retries=2)
+
+        # Every retry halves the threads
+        self.assertEqual(usage, {"wall_time": 1.0})
+        self.assertEqual(threads, ["8", "4", "2"])
+
+    @patch("builtins.print")
+    @patch("q2_amrfinderplus.utils.run_command")
+    def test_run_amrfinderplus_analyse_no_retry(self, mock_run_command, _):
+        mock_run_command.side_effect = subprocess.CalledProcessError(
+            returncode=1, cmd="amrfinder", stderr=b"Mock stderr message"
+        )
+
+        # Only memory errors are retried
+        with self.assertRaisesRegex(Exception, "return code 1"):
+            self._analyse(threads=None, retries=2)
+
+        mock_run_command.assert_called_once()
+
+    @patch("q2_amrfinderplus.utils.run_command")
+    def test_run_amrfinderplus_analyse_timeout(self, mock_run_command):
+        mock_run_command.side_effect = subprocess.TimeoutExpired("amrfinder", 5)
+
+        with self.assertRaisesRegex(Exception, "within 5 seconds"):
+            self._analyse(threads=None, timeout=5, retries=2)
+
+        mock_run_command.assert_called_once()
+
+    def test_is_memory_error(self):
+        self.assertTrue(_is_memory_error(-9, ""))
+        self.assertTrue(_is_memory_error(137, ""))
+        self.assertTrue(_is_memory_error(1, "Cannot allocate memory"))
+        self.assertFalse(_is_memory_error(1, "gff_check.cpp"))
+
+
+class TestRunAMRFinderPlusJobs(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def _create_jobs(self, sizes):
+        jobs = []
+        for i, size in enumerate(sizes):
+            dna_path = os.path.join(self.temp_dir.name, f"genome{i}.fasta")
+            with open(dna_path, "w") as f:
+                f.write("A" * size)
+            jobs.append(
+                {
+                    "dna_path": dna_path,
+                    "protein_path": None,
+                    "gff_path": None,
+                    "amr_annotations_path": f"genome{i}_amr_annotations.tsv",
+                }
+            )
+        return jobs
+
+    @patch("q2_amrfinderplus.utils._run_amrfinderplus_analyse")
+    def test_run_amrfinderplus_jobs_sequential(self, mock_run):
+        jobs = self._create_jobs([1, 3, 2])
+
+        _run_amrfinderplus_jobs(jobs, threads=4, cores=None)
+
+        # Without a core budget the genomes are processed in their original order
+        self.assertEqual(mock_run.call_args_list, [call(**job) for job in jobs])
+
+    @patch("q2_amrfinderplus.utils._run_amrfinderplus_analyse")
+    def test_run_amrfinderplus_jobs_budget_smaller_than_threads(self, mock_run):
+        jobs = self._create_jobs([1, 3, 2])
+
+        _run_amrfinderplus_jobs(jobs, threads=8, cores=4)
+
+        self.assertEqual(mock_run.call_args_list, [call(**job) for job in jobs])
+
+    @patch("q2_amrfinderplus.utils.as_completed", return_value=[])
+    @patch("q2_amrfinderplus.utils.ThreadPoolExecutor")
+    @patch("q2_amrfinderplus.utils._run_amrfinderplus_analyse")
+    def test_run_amrfinderplus_jobs_concurrent(
+        self, mock_run, mock_executor, mock_as_completed
+    ):
+        jobs = self._create_jobs([1, 3, 2])
+
+        _run_amrfinderplus_jobs(jobs, threads=2, cores=8)
+
+        # Four workers with two threads each, largest genomes submitted first
+        mock_executor.assert_called_once_with(max_workers=4)
+        submitted = [
+            c.args[1]["dna_path"]
+            for c in mock_executor.return_value.submit.call_args_list
+        ]
+        self.assertEqual(
+            submitted, [jobs[1]["dna_path"], jobs[2]["dna_path"], jobs[0]["dna_path"]]
+        )
+
+    @patch("q2_amrfinderplus.utils._run_amrfinderplus_analyse")
+    def test_run_amrfinderplus_jobs_concurrent_runs_all(self, mock_run):
+        jobs = self._create_jobs([1, 3, 2, 5])
+
+        _run_amrfinderplus_jobs(jobs, threads=1, cores=2)
+
+        self.assertEqual(mock_run.call_count, 4)
+
+    @patch("q2_amrfinderplus.utils._run_amrfinderplus_analyse")
+    def test_run_amrfinderplus_jobs_cache_hit(self, mock_run):
+        jobs = self._create_jobs([1, 2])
+        cache = MagicMock()
+        cache.fetch.side_effect = [True, False]
+
+        _run_amrfinderplus_jobs(jobs, threads=4, cache=cache)
+
+        # Only the cache miss is run and stored
+        mock_run.assert_called_once_with(**jobs[1])
+        cache.store.assert_called_once_with(jobs[1])
+
+    @patch("q2_amrfinderplus.utils._run_amrfinderplus_analyse")
+    def test_run_amrfinderplus_jobs_usages(self, mock_run):
+        jobs = self._create_jobs([1, 3, 2])
+        mock_run.side_effect = lambda **job: {"wall_time": job["dna_path"]}
+        cache = MagicMock()
+        cache.fetch.side_effect = lambda job: job is jobs[1]
+
+        usages = _run_amrfinderplus_jobs(jobs, threads=1, cores=2, cache=cache)
+
+        # Usages are returned in the order of the jobs, None for cache hits
+        self.assertEqual(
+            usages,
+            [
+                {"wall_time": jobs[0]["dna_path"]},
+                None,
+                {"wall_time": jobs[2]["dna_path"]},
+            ],
+        )
+
+    @patch(
+        "q2_amrfinderplus.utils._run_amrfinderplus_analyse",
+        side_effect=Exception("AMRFinderPlus failed"),
+    )
+    def test_run_amrfinderplus_jobs_concurrent_error(self, mock_run):
+        jobs = self._create_jobs([1, 3])
+
+        with self.assertRaisesRegex(Exception, "AMRFinderPlus failed"):
+            _run_amrfinderplus_jobs(jobs, threads=1, cores=2)
+
+    @patch(
+        "q2_amrfinderplus.utils._run_amrfinderplus_analyse",
+        side_effect=[{"wall_time": 1.0}, Exception("AMRFinderPlus failed")],
+    )
+    def test_run_amrfinderplus_jobs_failures(self, mock_run):
+        jobs = self._create_jobs([1, 3])
+        for job in jobs:
+            job["amr_annotations_path"] = os.path.join(
+                self.temp_dir.name, job["amr_annotations_path"]
+            )
+            open(job["amr_annotations_path"], "w").close()
+        failures = []
+
+        usages = _run_amrfinderplus_jobs(jobs, threads=4, failures=failures)
+
+        # The failed job is recorded and its partial outputs are removed
+        self.assertEqual(usages, [{"wall_time": 1.0}, {"failed": True}])
+        self.assertEqual(failures, [(1, "AMRFinderPlus failed")])
+        self.assertTrue(os.path.exists(jobs[0]["amr_annotations_path"]))
+        self.assertFalse(os.path.exists(jobs[1]["amr_annotations_path"]))
+
+    def test_get_num_partitions(self):
+        self.assertEqual(_get_num_partitions(3), 3)
+        self.assertIsNone(_get_num_partitions(None))
+
+    @patch("os.sched_getaffinity", return_value=set(range(64)), create=True)
+    def test_get_num_partitions_auto(self, mock_affinity):
+        self.assertEqual(_get_num_partitions("auto"), 16)
+        self.assertEqual(_get_num_partitions("auto", threads=8), 8)
+        self.assertEqual(_get_num_partitions("auto", threads=8, cores=32), 2)
+        self.assertEqual(_get_num_partitions("auto", threads=128), 1)
+
+    def test_get_input_size(self):
+        jobs = self._create_jobs([3, 2])
+
+        size = _get_input_size(jobs[0]["dna_path"], jobs[1]["dna_path"], None, "x")
+
+        self.assertEqual(size, 5)
+
+    def test_job_outputs(self):
+        job = {
+            "dna_path": "dna.fasta",
+            "protein_path": None,
+            "organism": None,
+            "amr_annotations_path": "amr_annotations.tsv",
+            "amr_genes_path": "amr_genes.fasta",
+            "amr_proteins_path": "amr_proteins.fasta",
+            "amr_all_mutations_path": None,
+        }
+
+        # Protein output is not written without protein input
+        self.assertEqual(_job_outputs(job), ["amr_annotations_path", "amr_genes_path"])
+
 
 class TestValidateInputs(TestPluginBase):
     package = "q2_amrfinderplus.tests"
@@ -484,6 +766,37 @@ class TestCreateEmptyFiles(TestPluginBase):
         )
 
 
+class TestPrefetchDatabase(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def test_prefetch_database(self):
+        db = self.temp_dir.name
+        for file_name, content in (
+            ("AMRProt.fa.psq", "1234"),
+            ("AMR_CDS.fa.nsq", "12"),
+            ("AMR.LIB.h3f", "1"),
+            ("AMR_DNA-Escherichia.fa.nin", "123"),
+            ("AMRProt.fa", "not prefetched"),
+            ("version.txt", "not prefetched"),
+        ):
+            with open(os.path.join(db, file_name), "w") as f:
+                f.write(content)
+
+        num_files, size, duration = _prefetch_database(db)
+
+        self.assertEqual((num_files, size), (4, 10))
+        self.assertGreaterEqual(duration, 0)
+
+    @patch("os.posix_fadvise", create=True)
+    def test_prefetch_file(self, mock_fadvise):
+        path = os.path.join(self.temp_dir.name, "AMRProt.fa.psq")
+        with open(path, "wb") as f:
+            f.write(b"x" * 10)
+
+        self.assertEqual(_prefetch_file(path, chunk_size=3), 10)
+        mock_fadvise.assert_called_once()
+
+
 class TestCreateSampleDirs(TestPluginBase):
     package = "q2_amrfinderplus.tests"
 
@@ -526,6 +839,51 @@ class TestCreateSampleDirs(TestPluginBase):
         self.assertTrue(os.path.exists(os.path.join(str(amr_annotations), "sample1")))
 
 
+class TestLinkOrCopy(TestPluginBase):
+    package = "q2_amrfinderplus.tests"
+
+    def setUp(self):
+        super().setUp()
+        self.src = os.path.join(self.temp_dir.name, "a")
+        self.dst = os.path.join(self.temp_dir.name, "b")
+        with open(self.src, "w") as f:
+            f.write("a")
+
+    def test__link_or_copy_hardlink(self):
+        _link_or_copy(self.src, self.dst)
+
+        self.assertTrue(os.path.samefile(self.src, self.dst))
+
+    @patch("q2_amrfinderplus.utils._reflink", return_value=False)
+    @patch("q2_amrfinderplus.utils.os.link", side_effect=OSError)
+    def test__link_or_copy_copy(self, mock_link, mock_reflink):
+        _link_or_copy(self.src, self.dst)
+
+        mock_reflink.assert_called_once()
+        self.assertFalse(os.path.samefile(self.src, self.dst))
+        with open(self.dst) as f:
+            self.assertEqual(f.read(), "a")
+
+    def test__link_or_copy_linked_dst(self):
+        # An existing dst is replaced instead of written through, so that files
+        # linked to it keep their content
+        linked = os.path.join(self.temp_dir.name, "c")
+        with open(linked, "w") as f:
+            f.write("c")
+        os.link(linked, self.dst)
+
+        with patch("q2_amrfinderplus.utils.os.link", side_effect=OSError), patch(
+            "q2_amrfinderplus.utils._reflink", return_value=False
+        ):
+            _link_or_copy(self.src, self.dst)
+
+        with open(self.dst) as f:
+            self.assertEqual(f.read(), "a")
+        with open(linked) as f:
+            self.assertEqual(f.read(), "c")
+        self.assertCountEqual(os.listdir(self.temp_dir.name), ["a", "b", "c"])
+
+
 class TestColorify(TestPluginBase):
     package = "q2_amrfinderplus.tests"
 
@@ -534,47 +892,3 @@ class TestColorify(TestPluginBase):
         result = colorify("Hello")
         expected = "\033[1;33mHello\033[0m"
         self.assertEqual(result, expected)
-
-
-class TestCollate(TestPluginBase):
-    package = "q2_amrfinderplus.tests"
-
-    def test_collate_annotations_contigs(self):
-        # Set up the list with annotations objects to collate
-        annotations_1 = AMRFinderPlusDatabaseDirFmt(
-            path=self.get_data_path("annotations_contigs_1"), mode="r"
-        )
-        annotations_2 = AMRFinderPlusDatabaseDirFmt(
-            path=self.get_data_path("annotations_contigs_2"), mode="r"
-        )
-
-        # Run collate functions on the annotations
-        collate = collate_amrfinderplus_annotations([annotations_1, annotations_2])
-
-        for i in range(1, 5):
-            self.assertTrue(
-                os.path.exists(
-                    os.path.join(str(collate), f"sample{i}_amr_annotations.tsv")
-                )
-            )
-
-    def test_collate_annotations_mags(self):
-        # Set up the list with annotations objects to collate
-        annotations_1 = AMRFinderPlusDatabaseDirFmt(
-            path=self.get_data_path("annotations_mags_1"), mode="r"
-        )
-        annotations_2 = AMRFinderPlusDatabaseDirFmt(
-            path=self.get_data_path("annotations_mags_2"), mode="r"
-        )
-
-        # Run collate functions on the annotations
-        collate = collate_amrfinderplus_annotations([annotations_1, annotations_2])
-
-        for i in range(1, 3):
-            self.assertTrue(
-                os.path.exists(
-                    os.path.join(
-                        str(collate), f"sample{i}", f"mag{i}_amr_annotations.tsv"
-                    )
-                )
-            )
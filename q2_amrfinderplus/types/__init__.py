@@ -8,6 +8,8 @@
 from q2_amrfinderplus.types._format import (
     AMRFinderPlusAnnotationFormat,
     AMRFinderPlusAnnotationsDirFmt,
+    AMRFinderPlusAnnotationsParquetDirFmt,
+    AMRFinderPlusAnnotationsParquetFormat,
     AMRFinderPlusDatabaseDirFmt,
     BinaryFormat,
     TextFormat,
@@ -17,6 +19,8 @@ __all__ = [
     "AMRFinderPlusDatabaseDirFmt",
     "AMRFinderPlusAnnotationFormat",
     "AMRFinderPlusAnnotationsDirFmt",
+    "AMRFinderPlusAnnotationsParquetFormat",
+    "AMRFinderPlusAnnotationsParquetDirFmt",
     "TextFormat",
     "BinaryFormat",
 ]
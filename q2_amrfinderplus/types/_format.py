@@ -5,10 +5,14 @@
 #
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
+import hashlib
+import json
 import os
+import re
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-import pandas as pd
 from q2_types.feature_data import MixedCaseDNAFASTAFormat, ProteinFASTAFormat
 from qiime2.core.exceptions import ValidationError
 from qiime2.plugin import model
@@ -25,6 +29,31 @@ HEADER_SHARED_COLUMNS = {
     "Hierarchy node",
 }
 GENE_SYMBOL_COLUMNS = {"Gene symbol", "Element symbol"}
+ANNOTATION_FILE_REGEX = r".*amr_(annotations|all_mutations)\.tsv$"
+
+# Manifest with the SHA-256 checksums of all database files
+DATABASE_CHECKSUMS = "checksums.tsv"
+
+# Column with the sample/MAG ID in the Parquet annotation format
+PARQUET_ID_COLUMN = "Sample/MAG_ID"
+
+# Numeric columns of the Parquet annotation format, all other columns are strings
+PARQUET_COLUMN_TYPES = {
+    "Start": "Int64",
+    "Stop": "Int64",
+    "Target length": "Int64",
+    "Reference sequence length": "Int64",
+    "Alignment length": "Int64",
+    "% Coverage of reference sequence": "float64",
+    "% Identity to reference sequence": "float64",
+    "% Coverage of reference": "float64",
+    "% Identity to reference": "float64",
+}
+
+# Numeric columns are also stored as the text they had in the annotation files,
+# in a column with this suffix, so that the files are restored byte by byte, e.g.
+# "100.00" and not "100.0"
+PARQUET_TEXT_SUFFIX = " (text)"
 
 
 class TextFormat(model.TextFileFormat):
@@ -61,6 +90,18 @@ class AMRFinderPlusDatabaseDirFmt(model.DirectoryFormat):
         r"^AMR_DNA-[a-zA-Z_]+\.fa\.n..$", format=BinaryFormat
     )
     amr_dna_tsv = model.FileCollection(r"^AMR_DNA-[a-zA-Z_]+\.tsv$", format=TextFormat)
+    checksums = model.File(DATABASE_CHECKSUMS, format=TextFormat, optional=True)
+
+    def validate(self, level="max"):
+        # Databases with a checksum manifest are verified against the manifest
+        # instead of parsing all FASTA files
+        if level == "max" and os.path.exists(
+            os.path.join(str(self), DATABASE_CHECKSUMS)
+        ):
+            _verify_database_checksums(str(self))
+            level = "min"
+
+        super().validate(level)
 
     @amr_lib_comp.set_path_maker
     def amr_lib_comp_path_maker(self, extension):
@@ -87,37 +128,174 @@ class AMRFinderPlusDatabaseDirFmt(model.DirectoryFormat):
         return "AMR_DNA-%s.tsv" % species
 
 
+def _compute_checksums(db_path, file_names):
+    # Files are hashed in parallel, hashlib releases the GIL for large chunks
+    def checksum(file_name):
+        file_hash = hashlib.sha256()
+        with open(os.path.join(db_path, file_name), "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    with ThreadPoolExecutor() as executor:
+        return dict(zip(file_names, executor.map(checksum, file_names)))
+
+
+def _get_verified_dir():
+    # Directory with markers of databases that were verified before
+    cache_home = os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "q2-amrfinderplus", "verified-databases")
+
+
+def _parse_checksums(manifest):
+    # The manifest has one line with file name and checksum per file
+    return dict(line.split("\t") for line in manifest.splitlines() if line.strip())
+
+
+def _read_checksums(db_path):
+    # Returns the checksums of a database or an empty dict if it has no manifest
+    manifest_fp = os.path.join(db_path, DATABASE_CHECKSUMS)
+    if not os.path.exists(manifest_fp):
+        return {}
+    with open(manifest_fp) as f:
+        return _parse_checksums(f.read())
+
+
+def _verify_database_checksums(db_path):
+    """
+    Verifies all database files against the checksum manifest. Verified databases
+    are remembered with a marker file named after the digest of the manifest and
+    the file sizes, so that loading the same database again does not hash the
+    files again.
+    """
+    with open(os.path.join(db_path, DATABASE_CHECKSUMS), "rb") as f:
+        manifest = f.read()
+    checksums = _parse_checksums(manifest.decode())
+
+    missing = sorted(
+        name for name in checksums if not os.path.isfile(os.path.join(db_path, name))
+    )
+    if missing:
+        raise ValidationError(
+            "Files listed in the database checksum manifest are missing: "
+            + ", ".join(missing)
+        )
+
+    marker = _get_verified_marker(db_path, manifest, checksums)
+    if os.path.exists(marker):
+        return
+
+    observed = _compute_checksums(db_path, list(checksums))
+    mismatched = sorted(
+        name for name, checksum in checksums.items() if observed[name] != checksum
+    )
+    if mismatched:
+        raise ValidationError(
+            "Checksums of the following database files do not match the checksum "
+            "manifest: " + ", ".join(mismatched)
+        )
+
+    _touch_marker(marker)
+
+
+def _mark_database_verified(db_path):
+    # Used after the checksums were computed while creating the database, so that
+    # the validation of the new artifact does not hash all files again
+    with open(os.path.join(db_path, DATABASE_CHECKSUMS), "rb") as f:
+        manifest = f.read()
+    checksums = _parse_checksums(manifest.decode())
+    _touch_marker(_get_verified_marker(db_path, manifest, checksums))
+
+
+def _get_verified_marker(db_path, manifest, checksums):
+    sizes = {name: os.path.getsize(os.path.join(db_path, name)) for name in checksums}
+    digest = hashlib.sha256(manifest + json.dumps(sizes, sort_keys=True).encode())
+    return os.path.join(_get_verified_dir(), digest.hexdigest())
+
+
+def _touch_marker(marker):
+    # The marker is only an optimization, a read-only cache directory is fine
+    try:
+        os.makedirs(os.path.dirname(marker), exist_ok=True)
+        open(marker, "w").close()
+    except OSError:
+        pass
+
+
 class AMRFinderPlusAnnotationFormat(model.TextFileFormat):
     def _validate(self):
-        try:
-            header_obs = pd.read_csv(str(self), sep="\t", nrows=0).columns.tolist()
-            header_obs_set = set(header_obs)
-            missing_columns = HEADER_SHARED_COLUMNS - header_obs_set
-            has_gene_symbol_column = not GENE_SYMBOL_COLUMNS.isdisjoint(header_obs_set)
-
-            if missing_columns or not has_gene_symbol_column:
-                raise ValidationError(
-                    "Header line does not match AMRFinderPlusAnnotationFormat. Must "
-                    "contain the required output columns and at least one of: "
-                    + ", ".join(sorted(GENE_SYMBOL_COLUMNS))
-                    + "."
-                    + "\n\nMissing columns: "
-                    + ", ".join(sorted(missing_columns))
-                    + "\n\nFound instead: "
-                    + ", ".join(header_obs)
-                )
-        except pd.errors.EmptyDataError:
-            pass
+        path = os.path.abspath(str(self))
+        stat = os.stat(path)
+        error = _validate_annotation_header(path, stat.st_size, stat.st_mtime_ns)
+        if error:
+            raise ValidationError(error)
 
     def _validate_(self, level):
         self._validate()
 
 
+@lru_cache(maxsize=2**20)
+def _validate_annotation_header(path, size, mtime_ns):
+    """
+    Validates the header of an annotation file and returns the error message or
+    None if the header is valid. Results are memoized per path, size and
+    modification time, so files of artifacts that are loaded repeatedly are only
+    read once.
+    """
+    # Only the first non-blank line is read, empty files are valid
+    with open(path) as f:
+        header_line = next((line for line in f if line.strip()), None)
+    if header_line is None:
+        return None
+
+    header_obs = header_line.rstrip("\r\n").split("\t")
+    header_obs_set = set(header_obs)
+    missing_columns = HEADER_SHARED_COLUMNS - header_obs_set
+    has_gene_symbol_column = not GENE_SYMBOL_COLUMNS.isdisjoint(header_obs_set)
+
+    if missing_columns or not has_gene_symbol_column:
+        return (
+            "Header line does not match AMRFinderPlusAnnotationFormat. Must "
+            "contain the required output columns and at least one of: "
+            + ", ".join(sorted(GENE_SYMBOL_COLUMNS))
+            + "."
+            + "\n\nMissing columns: "
+            + ", ".join(sorted(missing_columns))
+            + "\n\nFound instead: "
+            + ", ".join(header_obs)
+        )
+    return None
+
+
+def _prevalidate_annotation_file(path):
+    # Errors are raised again by the validation of the single file
+    try:
+        stat = os.stat(path)
+        _validate_annotation_header(
+            os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+        )
+    except (OSError, ValueError):
+        pass
+
+
 class AMRFinderPlusAnnotationsDirFmt(model.DirectoryFormat):
     annotations = model.FileCollection(
-        r".*amr_(annotations|all_mutations)\.tsv$", format=AMRFinderPlusAnnotationFormat
+        ANNOTATION_FILE_REGEX, format=AMRFinderPlusAnnotationFormat
     )
 
+    def validate(self, level="max"):
+        # Read the headers of all files in parallel. The validation of the single
+        # files afterwards only looks up the memoized results.
+        paths = [
+            str(path)
+            for path in self.path.glob("**/*")
+            if re.match(ANNOTATION_FILE_REGEX, path.name) and path.is_file()
+        ]
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(_prevalidate_annotation_file, paths))
+
+        super().validate(level)
+
     def annotation_dict(self, relative=False):
         """
         For per sample directories it returns a mapping of sample id to
@@ -166,6 +344,85 @@ class AMRFinderPlusAnnotationsDirFmt(model.DirectoryFormat):
         return os.path.join(dir_name, f"{id}_amr_{name}.tsv")
 
 
+class AMRFinderPlusAnnotationsParquetFormat(model.BinaryFileFormat):
+    def _validate_(self, level):
+        # Parquet files start and end with the magic bytes "PAR1"
+        with open(str(self), "rb") as f:
+            head = f.read(4)
+            f.seek(0, os.SEEK_END)
+            if f.tell() >= 8:
+                f.seek(-4, os.SEEK_END)
+            tail = f.read(4)
+
+        if head != b"PAR1" or tail != b"PAR1":
+            raise ValidationError(f"{self.path.name} is not a Parquet file.")
+
+
+class AMRFinderPlusAnnotationsParquetDirFmt(model.DirectoryFormat):
+    """
+    Annotations of all genomes in Parquet files with one row per annotation and
+    the sample/MAG ID in the column "Sample/MAG_ID". The file "genomes.json" lists
+    the original annotation files and their headers, so that genomes without
+    annotations are kept.
+    """
+
+    genomes = model.File("genomes.json", format=TextFormat)
+    parts = model.FileCollection(
+        r"^part-\d+\.parquet$", format=AMRFinderPlusAnnotationsParquetFormat
+    )
+
+    @parts.set_path_maker
+    def parts_path_maker(self, index):
+        return "part-%05d.parquet" % index
+
+    def part_paths(self):
+        return sorted(str(path) for path in self.path.glob("part-*.parquet"))
+
+    def genome_list(self):
+        """
+        Returns the headers and the list of genomes from "genomes.json". Every
+        genome is a dict with the keys "sample_id", "id", "name" ("annotations" or
+        "all_mutations") and "header", the index of its header in the headers or
+        None for empty files.
+        """
+        with open(os.path.join(str(self), "genomes.json")) as f:
+            genomes = json.load(f)
+        return genomes["headers"], genomes["genomes"]
+
+    def read(self, columns=None, filters=None):
+        """
+        Reads the annotations into a DataFrame. Only the requested columns and
+        the row groups matching the filters are read from disk.
+
+        Parameters
+        ---------
+        columns : list of str
+            Columns to read. The column "Sample/MAG_ID" is always included. All
+            columns except the text of the numeric columns are read if None.
+        filters : list of tuple or pyarrow.compute.Expression
+            Row filters in the format of pyarrow.parquet.ParquetDataset, e.g.
+            [("Class", "==", "BETA-LACTAM")].
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per annotation.
+        """
+        import pyarrow.parquet as pq
+
+        dataset = pq.ParquetDataset(self.part_paths(), filters=filters)
+        if columns is None:
+            columns = [
+                column
+                for column in dataset.schema.names
+                if not column.endswith(PARQUET_TEXT_SUFFIX)
+            ]
+        elif PARQUET_ID_COLUMN not in columns:
+            columns = [PARQUET_ID_COLUMN, *columns]
+
+        return dataset.read(columns=columns).to_pandas()
+
+
 def _create_path(path, relative, dir_format):
     """
     This function processes the input file path to generate an absolute or relative
@@ -5,11 +5,43 @@
 #
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 import qiime2
 
 from q2_amrfinderplus.plugin_setup import plugin
-from q2_amrfinderplus.types import AMRFinderPlusAnnotationsDirFmt
+from q2_amrfinderplus.types import (
+    AMRFinderPlusAnnotationsDirFmt,
+    AMRFinderPlusAnnotationsParquetDirFmt,
+)
+from q2_amrfinderplus.types._format import (
+    PARQUET_COLUMN_TYPES,
+    PARQUET_ID_COLUMN,
+    PARQUET_TEXT_SUFFIX,
+)
+
+# Columns with few distinct values that are stored as categoricals
+CATEGORICAL_COLUMNS = [
+    "Strand",
+    "Scope",
+    "Type",
+    "Subtype",
+    "Element type",
+    "Element subtype",
+    "Class",
+    "Subclass",
+    "Method",
+]
+
+# Number of genomes per Parquet file and number of rows per row group. Row groups
+# are the unit that is skipped when filtering.
+PARQUET_GENOMES_PER_PART = 1000
+PARQUET_ROW_GROUP_SIZE = 65536
 
 
 @plugin.register_transformer
@@ -17,9 +49,20 @@ def _1(data: AMRFinderPlusAnnotationsDirFmt) -> qiime2.Metadata:
     return qiime2.Metadata(_metadata_transformer_helper(data))
 
 
-def _metadata_transformer_helper(data):
-    df_list = []
+@plugin.register_transformer
+def _2(data: AMRFinderPlusAnnotationsDirFmt) -> AMRFinderPlusAnnotationsParquetDirFmt:
+    return _annotations_to_parquet(data)
+
 
+@plugin.register_transformer
+def _3(data: AMRFinderPlusAnnotationsParquetDirFmt) -> AMRFinderPlusAnnotationsDirFmt:
+    return _parquet_to_annotations(data)
+
+
+def _get_annotation_files(data):
+    # Returns sample ID, MAG or sample ID and file path of all annotation files,
+    # sorted by sample and MAG ID. The sample ID is "" for files without sample
+    # directories.
     if any(item.is_dir() for item in data.path.iterdir()):
         annotation_dict = data.annotation_dict()
 
@@ -28,28 +71,239 @@ def _metadata_transformer_helper(data):
         # Create annotation_dict with fake sample
         annotation_dict = {"": file_dict}
 
-    for outer_id, files_dict in annotation_dict.items():
-        for inner_id, file_fp in files_dict.items():
-            id_value = f"{outer_id}/{inner_id}" if outer_id else inner_id
+    return [
+        (outer_id, inner_id, file_fp)
+        for outer_id, files_dict in annotation_dict.items()
+        for inner_id, file_fp in files_dict.items()
+    ]
 
-            # Create df and append to df_list
-            df = pd.read_csv(file_fp, sep="\t")
-            df.insert(0, "Sample/MAG_ID", id_value)
-            df_list.append(df)
 
-    return combine_dataframes(df_list)
+def _get_id(outer_id, inner_id):
+    return f"{outer_id}/{inner_id}" if outer_id else inner_id
+
+
+def _metadata_transformer_helper(data):
+    ids = []
+    file_fps = []
+    for outer_id, inner_id, file_fp in _get_annotation_files(data):
+        ids.append(_get_id(outer_id, inner_id))
+        file_fps.append(file_fp)
 
+    # Read all files in parallel
+    with ThreadPoolExecutor() as executor:
+        df_list = list(executor.map(_read_annotations, file_fps))
 
-def combine_dataframes(df_list):
-    # Concat all dfs
-    df_combined = pd.concat(df_list, axis=0)
+    return combine_dataframes(df_list, ids)
 
-    # Sort all values by sample/mag ID column
-    df_combined.sort_values(by=df_combined.columns[0], inplace=True)
 
-    # Reset and rename index and set it to string to conform to metadata format
-    df_combined.reset_index(inplace=True, drop=True)
+def _read_annotations(file_fp):
+    return pd.read_csv(
+        file_fp,
+        sep="\t",
+        dtype={column: "category" for column in CATEGORICAL_COLUMNS},
+    )
+
+
+def combine_dataframes(df_list, ids):
+    # Use the same categories in all dfs, so that they stay categorical when
+    # concatenated
+    for column in CATEGORICAL_COLUMNS:
+        frames = [df for df in df_list if column in df.columns]
+        categories = sorted(set().union(*(df[column].cat.categories for df in frames)))
+        for df in frames:
+            df[column] = df[column].cat.set_categories(categories)
+
+    # Concat all dfs and add the sample/mag ID column, one ID per row of each df
+    df_combined = pd.concat(df_list, axis=0, ignore_index=True)
+    df_combined.insert(0, "Sample/MAG_ID", np.repeat(ids, [len(df) for df in df_list]))
+
+    # Convert categoricals back to plain columns, the values are shared between
+    # all rows. Columns without any values are read as floats by pandas.
+    for column in df_combined.select_dtypes("category").columns:
+        categories = df_combined[column].cat.categories
+        df_combined[column] = df_combined[column].astype(
+            categories.dtype if len(categories) else float
+        )
+
+    # Rename index and set it to string to conform to metadata format
     df_combined.index.name = "id"
     df_combined.index = df_combined.index.astype(str)
 
     return df_combined
+
+
+def _annotations_to_parquet(data):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    result = AMRFinderPlusAnnotationsParquetDirFmt()
+
+    # Read all headers to build one schema for all Parquet files
+    headers = {}
+    genomes = []
+    for outer_id, inner_id, file_fp in _get_annotation_files(data):
+        try:
+            header = tuple(
+                pd.read_csv(file_fp, sep="\t", nrows=0, quoting=csv.QUOTE_NONE).columns
+            )
+        except pd.errors.EmptyDataError:
+            header = None
+
+        genomes.append(
+            {
+                "sample_id": outer_id,
+                "id": inner_id,
+                "name": (
+                    "all_mutations"
+                    if file_fp.endswith("_amr_all_mutations.tsv")
+                    else "annotations"
+                ),
+                "header": (
+                    headers.setdefault(header, len(headers))
+                    if header is not None
+                    else None
+                ),
+                "file_fp": file_fp,
+            }
+        )
+
+    columns = [PARQUET_ID_COLUMN]
+    for header in headers:
+        columns.extend(column for column in header if column not in columns)
+    columns.extend(
+        column + PARQUET_TEXT_SUFFIX
+        for column in list(columns)
+        if column in PARQUET_COLUMN_TYPES
+    )
+    schema = pa.schema([(column, _get_arrow_type(column)) for column in columns])
+
+    # Write the annotations of consecutive genomes into the same file
+    non_empty = [genome for genome in genomes if genome["header"] is not None]
+    for index, start in enumerate(
+        range(0, max(len(non_empty), 1), PARQUET_GENOMES_PER_PART)
+    ):
+        part = non_empty[start : start + PARQUET_GENOMES_PER_PART]
+        pq.write_table(
+            _read_parquet_part(part, schema),
+            os.path.join(str(result), f"part-{index:05d}.parquet"),
+            row_group_size=PARQUET_ROW_GROUP_SIZE,
+            compression="zstd",
+        )
+
+    with open(os.path.join(str(result), "genomes.json"), "w") as f:
+        json.dump(
+            {
+                "headers": [list(header) for header in headers],
+                "genomes": [
+                    {key: value for key, value in genome.items() if key != "file_fp"}
+                    for genome in genomes
+                ],
+            },
+            f,
+        )
+
+    return result
+
+
+def _get_arrow_type(column):
+    import pyarrow as pa
+
+    return {"Int64": pa.int64(), "float64": pa.float64()}.get(
+        PARQUET_COLUMN_TYPES.get(column), pa.string()
+    )
+
+
+def _read_parquet_part(genomes, schema):
+    import pyarrow as pa
+
+    def read(genome):
+        # All values are read as they are written in the file, including "NA"
+        df = pd.read_csv(
+            genome["file_fp"],
+            sep="\t",
+            dtype=str,
+            keep_default_na=False,
+            quoting=csv.QUOTE_NONE,
+        )
+        for column, dtype in PARQUET_COLUMN_TYPES.items():
+            if column in df.columns:
+                df[column + PARQUET_TEXT_SUFFIX] = df[column]
+                df[column] = pd.to_numeric(df[column], errors="coerce").astype(dtype)
+        return df
+
+    with ThreadPoolExecutor() as executor:
+        df_list = list(executor.map(read, genomes))
+
+    ids = [_get_id(genome["sample_id"], genome["id"]) for genome in genomes]
+    num_rows = sum(len(df) for df in df_list)
+    df = (
+        pd.concat(df_list, ignore_index=True)
+        if df_list
+        else pd.DataFrame(index=pd.RangeIndex(0))
+    )
+    df[PARQUET_ID_COLUMN] = np.repeat(ids, [len(df) for df in df_list])
+
+    # Columns missing in all files of this part are filled with nulls
+    return pa.Table.from_arrays(
+        [
+            (
+                pa.array(df[field.name], type=field.type, from_pandas=True)
+                if field.name in df.columns
+                else pa.nulls(num_rows, type=field.type)
+            )
+            for field in schema
+        ],
+        schema=schema,
+    )
+
+
+def _parquet_to_annotations(data):
+    import pyarrow.parquet as pq
+
+    result = AMRFinderPlusAnnotationsDirFmt()
+    headers, genomes = data.genome_list()
+    genome_dict = {
+        _get_id(genome["sample_id"], genome["id"]): genome for genome in genomes
+    }
+
+    # Genomes are stored in the order of the manifest, one file at a time is read
+    written = set()
+    for part_fp in data.part_paths():
+        df = pq.read_table(part_fp).to_pandas()
+        for _id, genome_df in df.groupby(PARQUET_ID_COLUMN, sort=False):
+            genome = genome_dict[_id]
+            header = headers[genome["header"]]
+            _write_annotations(
+                result,
+                genome,
+                header,
+                genome_df[[_get_text_column(column) for column in header]],
+            )
+            written.add(_id)
+
+    # Files of genomes without annotations only contain the header or are empty
+    for _id, genome in genome_dict.items():
+        if _id not in written:
+            header = headers[genome["header"]] if genome["header"] is not None else None
+            _write_annotations(result, genome, header)
+
+    return result
+
+
+def _get_text_column(column):
+    # Column with the original text of a column of the annotation files
+    return column + PARQUET_TEXT_SUFFIX if column in PARQUET_COLUMN_TYPES else column
+
+
+def _write_annotations(result, genome, header, df=None):
+    dir_path = os.path.join(str(result), genome["sample_id"])
+    os.makedirs(dir_path, exist_ok=True)
+    file_fp = os.path.join(dir_path, f"{genome['id']}_amr_{genome['name']}.tsv")
+
+    # The values are the original text of the annotation files, so they are
+    # written without quoting or conversion
+    with open(file_fp, "w") as f:
+        if header is not None:
+            f.write("\t".join(header) + "\n")
+        if df is not None:
+            f.writelines("\t".join(row) + "\n" for row in df.itertuples(index=False))
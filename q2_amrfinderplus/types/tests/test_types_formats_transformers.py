@@ -6,22 +6,34 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 import os
+import shutil
 import tempfile
+from unittest.mock import patch
 
+import numpy as np
 import pandas as pd
 import qiime2
 from pandas._testing import assert_frame_equal
 from qiime2.core.exceptions import ValidationError
 from qiime2.plugin.testing import TestPluginBase
 
+from q2_amrfinderplus.database import _write_checksums
 from q2_amrfinderplus.types._format import (
+    HEADER_SHARED_COLUMNS,
     AMRFinderPlusAnnotationFormat,
     AMRFinderPlusAnnotationsDirFmt,
+    AMRFinderPlusAnnotationsParquetDirFmt,
+    AMRFinderPlusAnnotationsParquetFormat,
     AMRFinderPlusDatabaseDirFmt,
+    _compute_checksums,
     _create_path,
+    _validate_annotation_header,
 )
 from q2_amrfinderplus.types._transformer import (
+    _annotations_to_parquet,
     _metadata_transformer_helper,
+    _parquet_to_annotations,
+    _read_annotations,
     combine_dataframes,
 )
 
@@ -33,6 +45,57 @@ class TestAMRFinderPlusTypesAndFormats(TestPluginBase):
         format = AMRFinderPlusDatabaseDirFmt(self.get_data_path("database"), mode="r")
         format.validate()
 
+    def _database_with_checksums(self):
+        db_path = os.path.join(self.temp_dir.name, "database")
+        shutil.copytree(self.get_data_path("database"), db_path)
+        _write_checksums(db_path)
+        return db_path
+
+    @patch("q2_amrfinderplus.types._format._get_verified_dir")
+    def test_amrfinderplus_database_dir_fmt_validate_checksums(self, mock_dir):
+        mock_dir.return_value = os.path.join(self.temp_dir.name, "verified")
+        db_path = self._database_with_checksums()
+
+        AMRFinderPlusDatabaseDirFmt(db_path, mode="r").validate()
+
+        self.assertEqual(len(os.listdir(mock_dir.return_value)), 1)
+
+    @patch("q2_amrfinderplus.types._format._compute_checksums")
+    @patch("q2_amrfinderplus.types._format._get_verified_dir")
+    def test_amrfinderplus_database_dir_fmt_validate_verified(
+        self, mock_dir, mock_compute
+    ):
+        # Databases that were verified before are not hashed again
+        mock_dir.return_value = os.path.join(self.temp_dir.name, "verified")
+        db_path = self._database_with_checksums()
+        mock_compute.side_effect = _compute_checksums
+        AMRFinderPlusDatabaseDirFmt(db_path, mode="r").validate()
+
+        AMRFinderPlusDatabaseDirFmt(db_path, mode="r").validate()
+
+        mock_compute.assert_called_once()
+
+    @patch("q2_amrfinderplus.types._format._get_verified_dir")
+    def test_amrfinderplus_database_dir_fmt_validate_checksum_mismatch(self, mock_dir):
+        mock_dir.return_value = os.path.join(self.temp_dir.name, "verified")
+        db_path = self._database_with_checksums()
+        with open(os.path.join(db_path, "version.txt"), "w") as f:
+            f.write("corrupted")
+
+        with self.assertRaisesRegex(ValidationError, "do not match.*version.txt"):
+            AMRFinderPlusDatabaseDirFmt(db_path, mode="r").validate()
+
+    @patch("q2_amrfinderplus.types._format._get_verified_dir")
+    def test_amrfinderplus_database_dir_fmt_validate_checksum_missing_file(
+        self, mock_dir
+    ):
+        mock_dir.return_value = os.path.join(self.temp_dir.name, "verified")
+        db_path = self._database_with_checksums()
+        os.remove(os.path.join(db_path, "fam.tsv"))
+
+        with self.assertRaisesRegex(ValidationError, "missing: fam.tsv"):
+            AMRFinderPlusDatabaseDirFmt(db_path, mode="r").validate()
+
     def test_amrfinderplus_database_dir_fmt_path_makers(self):
         format = AMRFinderPlusDatabaseDirFmt()
 
@@ -152,6 +215,59 @@ class TestAMRFinderPlusTypesAndFormats(TestPluginBase):
 
             self.assertEqual(str(context.exception), expected_message)
 
+    def test_amrfinderplus_annotation_format_validate_memoized(self):
+        filepath = self.get_data_path(
+            "annotation/coordinates/"
+            "e026af61-d911-4de3-a957-7e8bf837f30d_amr_annotations.tsv"
+        )
+        format = AMRFinderPlusAnnotationFormat(filepath, mode="r")
+        format.validate()
+        hits = _validate_annotation_header.cache_info().hits
+
+        format.validate()
+
+        self.assertEqual(_validate_annotation_header.cache_info().hits, hits + 1)
+
+    def test_amrfinderplus_annotation_format_validate_modified_file(self):
+        # Changed files are validated again
+        filepath = os.path.join(self.temp_dir.name, "amr_annotations.tsv")
+        with open(filepath, "w") as f:
+            f.write("Gene symbol\t" + "\t".join(sorted(HEADER_SHARED_COLUMNS)) + "\n")
+        AMRFinderPlusAnnotationFormat(filepath, mode="r").validate()
+
+        with open(filepath, "w") as f:
+            f.write("Incorrect Header 1\tIncorrect Header 2\n")
+
+        with self.assertRaisesRegex(ValidationError, "Incorrect Header 1"):
+            AMRFinderPlusAnnotationFormat(filepath, mode="r").validate()
+
+    def test_validate_annotation_header_blank_lines(self):
+        filepath = os.path.join(self.temp_dir.name, "amr_annotations.tsv")
+        with open(filepath, "w") as f:
+            f.write("\n\nIncorrect Header 1\tIncorrect Header 2\n")
+
+        obs = _validate_annotation_header(filepath, 0, 0)
+
+        self.assertIn("Found instead: Incorrect Header 1, Incorrect Header 2", obs)
+
+    @patch("q2_amrfinderplus.types._format._prevalidate_annotation_file")
+    def test_amrfinderplus_annotations_dir_fmt_validate_prevalidates(
+        self, mock_prevalidate
+    ):
+        dirpath = self.get_data_path("annotations_sample_data_mags")
+        AMRFinderPlusAnnotationsDirFmt(dirpath, mode="r").validate()
+
+        self.assertEqual(
+            sorted(
+                os.path.relpath(c.args[0], dirpath)
+                for c in mock_prevalidate.call_args_list
+            ),
+            [
+                "sample1/e026af61-d911-4de3-a957-7e8bf837f30d_amr_annotations.tsv",
+                "sample2/aa447c99-ecd9-4c4a-a53b-4df6999815dd_amr_annotations.tsv",
+            ],
+        )
+
     def test_amrfinderplus_annotations_dir_fmt_feature(self):
         dirpath = self.get_data_path("annotation/coordinates")
         annotations = AMRFinderPlusAnnotationsDirFmt(dirpath, mode="r")
@@ -251,30 +367,28 @@ class MetadataTransformerUtilsTest(TestPluginBase):
         # Setup test data
         self.df1 = pd.DataFrame(
             {
-                "Sample/MAG_ID": ["id_value_1", "id_value_2"],
                 "col1": ["val1", "val3"],
-                "col2": ["val2", "val4"],
+                "Class": pd.Categorical(["BETA-LACTAM", "BETA-LACTAM"]),
             }
         )
 
         self.df2 = pd.DataFrame(
             {
-                "Sample/MAG_ID": ["id_value_3", "id_value_4"],
                 "col1": ["val5", "val7"],
-                "col2": ["val6", "val8"],
+                "Class": pd.Categorical(["AMINOGLYCOSIDE", None]),
             }
         )
 
         self.expected_combined_df = pd.DataFrame(
             {
                 "Sample/MAG_ID": [
+                    "id_value_1",
                     "id_value_1",
                     "id_value_2",
-                    "id_value_3",
-                    "id_value_4",
+                    "id_value_2",
                 ],
                 "col1": ["val1", "val3", "val5", "val7"],
-                "col2": ["val2", "val4", "val6", "val8"],
+                "Class": ["BETA-LACTAM", "BETA-LACTAM", "AMINOGLYCOSIDE", np.nan],
             }
         )
 
@@ -284,9 +398,27 @@ class MetadataTransformerUtilsTest(TestPluginBase):
     def test_combine_dataframes(self):
         # Test combine_dataframes function
         df_list = [self.df1, self.df2]
-        combined_df = combine_dataframes(df_list)
+        combined_df = combine_dataframes(df_list, ["id_value_1", "id_value_2"])
         pd.testing.assert_frame_equal(combined_df, self.expected_combined_df)
 
+    def test_combine_dataframes_empty_categorical(self):
+        # Columns without any values are floats like in pd.read_csv
+        df = pd.DataFrame({"Subclass": pd.Categorical([None, None])})
+        combined_df = combine_dataframes([df], ["id_value_1"])
+        self.assertEqual(combined_df["Subclass"].dtype, float)
+        self.assertTrue(combined_df["Subclass"].isna().all())
+
+    def test_read_annotations_categorical(self):
+        df = _read_annotations(
+            self.get_data_path(
+                "annotations_sample_data_mags/sample1/"
+                "e026af61-d911-4de3-a957-7e8bf837f30d_amr_annotations.tsv"
+            )
+        )
+        self.assertIsInstance(df["Class"].dtype, pd.CategoricalDtype)
+        self.assertIsInstance(df["Scope"].dtype, pd.CategoricalDtype)
+        self.assertNotIsInstance(df["Gene symbol"].dtype, pd.CategoricalDtype)
+
 
 class TestAMRFinderPlusTransformers(TestPluginBase):
     package = "q2_amrfinderplus.types.tests"
@@ -331,3 +463,140 @@ class TestAMRFinderPlusTransformers(TestPluginBase):
         metadata_obt = transformer(fmt)
 
         self.assertIsInstance(metadata_obt, qiime2.Metadata)
+
+    def test_annotations_to_parquet_round_trip(self):
+        for data in ("annotations_sample_data_mags", "mutations_feature_data_mags"):
+            fmt = AMRFinderPlusAnnotationsDirFmt(self.get_data_path(data), "r")
+            to_parquet = self.get_transformer(
+                AMRFinderPlusAnnotationsDirFmt, AMRFinderPlusAnnotationsParquetDirFmt
+            )
+            from_parquet = self.get_transformer(
+                AMRFinderPlusAnnotationsParquetDirFmt, AMRFinderPlusAnnotationsDirFmt
+            )
+
+            obs = from_parquet(to_parquet(fmt))
+
+            self.assertEqual(
+                obs.annotation_dict(relative=True), fmt.annotation_dict(relative=True)
+            )
+            for rel_path in _relative_paths(fmt.annotation_dict(relative=True)):
+                assert_frame_equal(
+                    pd.read_csv(os.path.join(str(fmt), rel_path), sep="\t"),
+                    pd.read_csv(os.path.join(str(obs), rel_path), sep="\t"),
+                )
+
+    def test_annotations_to_parquet_round_trip_identical(self):
+        # All sample annotations are restored byte by byte
+        data = [
+            "annotations_sample_data_mags",
+            "annotations_sample_data_contigs",
+            "annotations_feature_data_mags",
+            "mutations_sample_data_mags",
+            "mutations_sample_data_contigs",
+            "mutations_feature_data_mags",
+        ]
+        for name in data:
+            with self.subTest(data=name):
+                fmt = AMRFinderPlusAnnotationsDirFmt(self.get_data_path(name), "r")
+
+                obs = _parquet_to_annotations(_annotations_to_parquet(fmt))
+
+                for rel_path in _relative_paths(fmt.annotation_dict(relative=True)):
+                    with open(os.path.join(str(fmt), rel_path), "rb") as f:
+                        exp = f.read()
+                    with open(os.path.join(str(obs), rel_path), "rb") as f:
+                        self.assertEqual(f.read(), exp)
+
+    def test_annotations_to_parquet_na_like_values(self):
+        # Values that pandas would parse as missing or as numbers are kept as text
+        content = (
+            "Contig id\tElement symbol\tStart\t% Identity to reference\n"
+            "contig1\tNA\tNA\t100.00\n"
+            "contig2\tN/A\t0012\tNaN\n"
+            'contig3\t"quoted"\t7\t\n'
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "mag1_amr_annotations.tsv"), "w") as f:
+                f.write(content)
+            fmt = AMRFinderPlusAnnotationsDirFmt(tmp, "r")
+
+            parquet_fmt = _annotations_to_parquet(fmt)
+            obs = _parquet_to_annotations(parquet_fmt)
+
+            with open(os.path.join(str(obs), "mag1_amr_annotations.tsv")) as f:
+                self.assertEqual(f.read(), content)
+            df = parquet_fmt.read()
+            self.assertEqual(df["Start"].fillna(-1).tolist(), [-1, 12, 7])
+            self.assertEqual(df["Element symbol"].tolist(), ["NA", "N/A", '"quoted"'])
+            self.assertNotIn("Start (text)", df.columns)
+
+    def test_annotations_to_parquet_empty_files(self):
+        # Genomes without annotations and empty files are kept
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "empty_amr_all_mutations.tsv"), "w"):
+                pass
+            with open(os.path.join(tmp, "mag1_amr_annotations.tsv"), "w") as f:
+                f.write("Contig id\tGene symbol\tStart\n")
+            fmt = AMRFinderPlusAnnotationsDirFmt(tmp, "r")
+
+            parquet_fmt = _annotations_to_parquet(fmt)
+            obs = _parquet_to_annotations(parquet_fmt)
+
+            self.assertTrue(parquet_fmt.read().empty)
+            self.assertEqual(
+                os.path.getsize(os.path.join(str(obs), "empty_amr_all_mutations.tsv")),
+                0,
+            )
+            with open(os.path.join(str(obs), "mag1_amr_annotations.tsv")) as f:
+                self.assertEqual(f.read(), "Contig id\tGene symbol\tStart\n")
+
+    def test_parquet_read_columns_and_filters(self):
+        fmt = AMRFinderPlusAnnotationsDirFmt(
+            self.get_data_path("annotations_sample_data_mags"), "r"
+        )
+        parquet_fmt = _annotations_to_parquet(fmt)
+
+        obs = parquet_fmt.read(
+            columns=["Class", "Gene symbol"], filters=[("Class", "==", "BETA-LACTAM")]
+        )
+
+        self.assertEqual(
+            obs.columns.tolist(), ["Sample/MAG_ID", "Class", "Gene symbol"]
+        )
+        self.assertEqual(
+            obs["Sample/MAG_ID"].tolist(),
+            [
+                "sample1/e026af61-d911-4de3-a957-7e8bf837f30d",
+                "sample2/aa447c99-ecd9-4c4a-a53b-4df6999815dd",
+            ],
+        )
+        self.assertEqual(obs["Class"].unique().tolist(), ["BETA-LACTAM"])
+
+    def test_parquet_numeric_columns(self):
+        fmt = AMRFinderPlusAnnotationsDirFmt(
+            self.get_data_path("annotations_sample_data_mags"), "r"
+        )
+        obs = _annotations_to_parquet(fmt).read(
+            columns=["Target length", "% Identity to reference sequence"]
+        )
+
+        self.assertTrue(pd.api.types.is_integer_dtype(obs["Target length"]))
+        self.assertTrue(
+            pd.api.types.is_float_dtype(obs["% Identity to reference sequence"])
+        )
+
+    def test_parquet_format_validate_negative(self):
+        fp = os.path.join(self.temp_dir.name, "part-00000.parquet")
+        with open(fp, "w") as f:
+            f.write("not parquet")
+
+        with self.assertRaisesRegex(ValidationError, "not a Parquet file"):
+            AMRFinderPlusAnnotationsParquetFormat(fp, mode="r").validate()
+
+
+def _relative_paths(annotation_dict):
+    for value in annotation_dict.values():
+        if isinstance(value, dict):
+            yield from value.values()
+        else:
+            yield value
@@ -1,11 +1,40 @@
+import fcntl
 import os
+import re
+import shutil
+import signal
 import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from q2_types._util import _collate_helper
 from q2_types.feature_data_mag import MAGSequencesDirFmt
 from q2_types.per_sample_sequences import ContigSequencesDirFmt, MultiMAGSequencesDirFmt
 
-from q2_amrfinderplus.types import AMRFinderPlusAnnotationsDirFmt
+# BLAST and HMM index files of the database that are read by every AMRFinderPlus run
+DATABASE_INDEX_REGEX = re.compile(
+    r"^(AMRProt\.fa\.p..|AMR_CDS\.fa\.n..|AMR\.LIB\.h3.|AMR_DNA-.*\.fa\.n..)$"
+)
+
+# Messages of AMRFinderPlus and its BLAST and HMMER subprocesses if they run out of
+# memory
+MEMORY_ERROR_REGEX = re.compile(
+    r"bad_alloc|out of memory|cannot allocate memory", re.IGNORECASE
+)
+
+# Maps the output path arguments of _run_amrfinderplus_analyse to the file names
+# used for outputs that are stored outside of the output artifacts
+OUTPUT_FILES = {
+    "amr_annotations_path": "amr_annotations.tsv",
+    "amr_genes_path": "amr_genes.fasta",
+    "amr_proteins_path": "amr_proteins.fasta",
+    "amr_all_mutations_path": "amr_all_mutations.tsv",
+}
+
+# ioctl request of Linux to clone a file with copy-on-write (reflink)
+FICLONE = 0x40049409
 
 EXTERNAL_CMD_WARNING = (
     "Running external command line application(s). "
@@ -16,12 +45,80 @@ EXTERNAL_CMD_WARNING = (
 )
 
 
-def run_command(cmd, cwd=None, verbose=True):
+def run_command(cmd, cwd=None, verbose=True, timeout=None):
     if verbose:
         print(EXTERNAL_CMD_WARNING)
         print("\nCommand:", end=" ")
         print(" ".join(cmd), end="\n\n")
-    subprocess.run(cmd, check=True, cwd=cwd, stderr=subprocess.PIPE)
+
+    # With a timeout, the process is started in its own process group, so that it
+    # can be killed together with all of its subprocesses
+    popen_kwargs = {"start_new_session": True} if timeout else {}
+
+    # The process is reaped with wait4 to get its resource usage, which includes
+    # all subprocesses it waited for, e.g. BLAST and HMMER
+    start = time.monotonic()
+    process = subprocess.Popen(cmd, cwd=cwd, stderr=subprocess.PIPE, **popen_kwargs)
+
+    # Once the process is reaped, its ID can be reused by an unrelated process, so
+    # the timer must not kill its process group anymore. The lock makes sure that
+    # the timer either kills the process before it is reaped or not at all.
+    lock = threading.Lock()
+    state = {"reaped": False, "expired": False}
+
+    def kill():
+        with lock:
+            if not state["reaped"]:
+                state["expired"] = True
+                _kill_process_group(process.pid)
+
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+    try:
+        with process.stderr:
+            stderr = process.stderr.read()
+        _, status, rusage = os.wait4(process.pid, 0)
+        with lock:
+            state["reaped"] = True
+    except BaseException:
+        with lock:
+            if not state["reaped"]:
+                if timeout:
+                    _kill_process_group(process.pid)
+                else:
+                    process.kill()
+                process.wait()
+                state["reaped"] = True
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+    wall_time = time.monotonic() - start
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # The timer can fire after the process exited but before it was reaped, so the
+    # timeout only counts if the process was actually killed
+    if state["expired"] and process.returncode == -signal.SIGKILL:
+        raise subprocess.TimeoutExpired(cmd, timeout, stderr=stderr)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+
+    # The peak resident set size is reported in bytes on macOS and in KB on Linux
+    return {
+        "wall_time": wall_time,
+        "user_time": rusage.ru_utime,
+        "system_time": rusage.ru_stime,
+        "max_rss": rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+    }
+
+
+def _kill_process_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
 
 
 def _validate_inputs(
@@ -76,6 +173,8 @@ def _run_amrfinderplus_analyse(
     amr_genes_path=None,
     amr_proteins_path=None,
     amr_all_mutations_path=None,
+    timeout=None,
+    retries=0,
 ):
     cmd = [
         "amrfinder",
@@ -134,26 +233,242 @@ def _run_amrfinderplus_analyse(
     if report_common:
         cmd.append("--report_common")
 
-    try:
-        run_command(cmd=cmd)
-    except subprocess.CalledProcessError as e:
-        print(e.stderr.decode("utf-8"))
-        if "gff_check.cpp" in e.stderr.decode("utf-8"):
+    # Runs that ran out of memory are retried with half the threads, because every
+    # BLAST and HMMER thread holds its own search data
+    for attempt in range(retries + 1):
+        try:
+            return run_command(cmd=cmd, timeout=timeout)
+        except subprocess.TimeoutExpired:
             raise Exception(
-                "GFF file error: Either there is data missing in one GFF file or an "
-                "incorrect GFF input format was specified with the parameter "
-                "'--p-annotation-format'. Please check https://github.com/ncbi/amr/wiki"
-                "/Running-AMRFinderPlus#input-file-formats for documentation and "
-                "choose the correct GFF input format. Please inspect stdout and stderr "
-                "to learn more."
+                f"AMRFinderPlus did not finish within {timeout} seconds and was "
+                "stopped."
             )
-        else:
-            raise Exception(
-                "An error was encountered while running AMRFinderPlus, "
-                f"(return code {e.returncode}), please inspect stdout and stderr to "
-                "learn more."
+        except subprocess.CalledProcessError as e:
+            error = e
+            if attempt == retries or not _is_memory_error(
+                e.returncode, e.stderr.decode("utf-8")
+            ):
+                break
+            threads = max(1, (threads or 4) // 2)
+            _set_threads(cmd, threads)
+            print(
+                colorify(
+                    "AMRFinderPlus ran out of memory. Retrying with "
+                    f"{threads} threads (retry {attempt + 1} of {retries})."
+                )
             )
 
+    stderr = error.stderr.decode("utf-8")
+    print(stderr)
+    if "gff_check.cpp" in stderr:
+        raise Exception(
+            "GFF file error: Either there is data missing in one GFF file or an "
+            "incorrect GFF input format was specified with the parameter "
+            "'--p-annotation-format'. Please check https://github.com/ncbi/amr/wiki"
+            "/Running-AMRFinderPlus#input-file-formats for documentation and "
+            "choose the correct GFF input format. Please inspect stdout and stderr "
+            "to learn more."
+        )
+    else:
+        raise Exception(
+            "An error was encountered while running AMRFinderPlus, "
+            f"(return code {error.returncode}), please inspect stdout and stderr to "
+            "learn more."
+        )
+
+
+def _is_memory_error(returncode, stderr):
+    # Processes killed by the kernel OOM killer exit with SIGKILL
+    return returncode in (-signal.SIGKILL, 128 + signal.SIGKILL) or bool(
+        MEMORY_ERROR_REGEX.search(stderr)
+    )
+
+
+def _set_threads(cmd, threads):
+    if "--threads" in cmd:
+        cmd[cmd.index("--threads") + 1] = str(threads)
+    else:
+        cmd.extend(["--threads", str(threads)])
+
+
+def _run_amrfinderplus_jobs(jobs, threads, cores=None, cache=None, failures=None):
+    """
+    Runs AMRFinderPlus for all jobs and returns the resource usage of every job in
+    the order of the jobs. The usage is None for jobs whose results were cached.
+    If a failures list is given, failed jobs do not stop the run. Their index and
+    error are appended to the list instead and their usage is marked as failed.
+    """
+    num_jobs = _get_num_jobs(threads, cores)
+
+    if num_jobs == 1:
+        return [
+            _run_amrfinderplus_job(job, cache, index=i, failures=failures)
+            for i, job in enumerate(jobs)
+        ]
+
+    # Start the largest genomes first to shorten the total runtime
+    order = sorted(
+        range(len(jobs)),
+        key=lambda i: _get_input_size(
+            jobs[i]["dna_path"], jobs[i]["protein_path"], jobs[i]["gff_path"]
+        ),
+        reverse=True,
+    )
+
+    usages = [None] * len(jobs)
+    executor = ThreadPoolExecutor(max_workers=num_jobs)
+    futures = {
+        executor.submit(_run_amrfinderplus_job, jobs[i], cache, i, failures): i
+        for i in order
+    }
+    try:
+        for future in as_completed(futures):
+            usages[futures[future]] = future.result()
+    except Exception:
+        # Do not start any queued genomes after the first failure
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+    return usages
+
+
+def _get_num_jobs(threads, cores=None):
+    # Split the core budget into concurrent AMRFinderPlus processes that use
+    # "threads" cores each. AMRFinderPlus uses 4 threads if none are specified.
+    return max(1, cores // (threads or 4)) if cores else 1
+
+
+def _run_amrfinderplus_job(job, cache=None, index=None, failures=None):
+    # Reuse cached results of identical inputs instead of running amrfinderplus
+    if cache is not None and cache.fetch(job):
+        return None
+
+    try:
+        usage = _run_amrfinderplus_analyse(**job)
+    except Exception as e:
+        if failures is None:
+            raise
+        # Partial outputs of failed jobs are removed
+        failures.append((index, str(e)))
+        _remove_outputs(job)
+        return {"failed": True}
+
+    if cache is not None:
+        cache.store(job)
+    return usage
+
+
+def _remove_outputs(job):
+    for path_arg in OUTPUT_FILES:
+        if job.get(path_arg) and os.path.exists(job[path_arg]):
+            os.remove(job[path_arg])
+
+
+def _link_or_copy(src, dst):
+    # Hardlinks and reflinks share the data blocks with the source file, a copy is
+    # only made if both are not possible. The file is created under a temporary
+    # name and replaces dst, so that an existing dst is never written through,
+    # which would change all files that are linked to it.
+    tmp_dst = os.path.join(
+        os.path.dirname(dst), f".tmp-{os.path.basename(dst)}-{uuid.uuid4().hex}"
+    )
+    try:
+        try:
+            os.link(src, tmp_dst)
+        except OSError:
+            if not _reflink(src, tmp_dst):
+                shutil.copyfile(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+    except BaseException:
+        if os.path.lexists(tmp_dst):
+            os.remove(tmp_dst)
+        raise
+
+
+def _reflink(src, dst):
+    # Copy-on-write clones are supported by btrfs, XFS and others on Linux only
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            return True
+        except OSError:
+            return False
+
+
+def _is_output_expected(job, path_arg):
+    # AMRFinderPlus only writes the gene, protein and all mutations outputs for
+    # DNA input, protein input or a given organism
+    if path_arg == "amr_genes_path":
+        return bool(job.get("dna_path"))
+    if path_arg == "amr_proteins_path":
+        return bool(job.get("protein_path"))
+    if path_arg == "amr_all_mutations_path":
+        return bool(job.get("organism"))
+    return True
+
+
+def _job_outputs(job):
+    # Output path arguments of a job that AMRFinderPlus writes. Output paths are
+    # None if the output artifact is not requested.
+    return [
+        path_arg
+        for path_arg in OUTPUT_FILES
+        if job.get(path_arg) and _is_output_expected(job, path_arg)
+    ]
+
+
+def _get_num_partitions(num_partitions, threads=None, cores=None):
+    if num_partitions != "auto":
+        return num_partitions
+
+    # Run as many partitions in parallel as fit on the available cores, with each
+    # partition using its core budget or the threads of one AMRFinderPlus process
+    try:
+        available_cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available_cores = os.cpu_count() or 1
+    return max(1, available_cores // (cores or threads or 4))
+
+
+def _get_input_size(*paths):
+    return sum(os.path.getsize(path) for path in paths if path and os.path.exists(path))
+
+
+def _prefetch_database(amrfinderplus_db):
+    """
+    Reads the BLAST and HMM files of the database into the page cache, so that the
+    first AMRFinderPlus runs on a cold node are as fast as the following ones.
+    Returns the number of files, their total size in bytes and the duration in
+    seconds.
+    """
+    start = time.monotonic()
+    paths = [
+        entry.path
+        for entry in os.scandir(str(amrfinderplus_db))
+        if entry.is_file() and DATABASE_INDEX_REGEX.match(entry.name)
+    ]
+
+    with ThreadPoolExecutor() as executor:
+        size = sum(executor.map(_prefetch_file, paths))
+
+    return len(paths), size, time.monotonic() - start
+
+
+def _prefetch_file(path, chunk_size=4 * 1024 * 1024):
+    # Ask the kernel to start reading ahead and read the file to wait until it is
+    # cached. Reading into one buffer avoids allocating memory for every chunk.
+    size = 0
+    buffer = bytearray(chunk_size)
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            size += n
+    return size
+
 
 def _create_empty_files(
     sequences, proteins, organism, amr_genes, amr_proteins, amr_all_mutations
@@ -281,9 +596,3 @@ def _get_file_paths(sequences, proteins, loci, _id, file_fp, sample_id=""):
 
 def colorify(string: str):
     return "%s%s%s" % ("\033[1;33m", string, "\033[0m")
-
-
-def collate_amrfinderplus_annotations(
-    annotations: AMRFinderPlusAnnotationsDirFmt,
-) -> AMRFinderPlusAnnotationsDirFmt:
-    return _collate_helper(annotations)